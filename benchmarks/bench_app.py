@@ -0,0 +1,264 @@
+"""
+整个应用（run:app）的基准测试：先生成一个新的 SQLite 数据库并写入固定随机种子的数据，再分别以进程内 ASGI 和真实的 uvicorn 套接字两种方式压测各个路由。
+
+    python -m benchmarks.bench_app run --cities 200 --days 60 --requests 500 --concurrency 10 --output base.json
+    python -m benchmarks.bench_app run --mode asgi --scenario coronavirus --output new.json
+    python -m benchmarks.bench_app compare base.json new.json --threshold 0.1
+
+run 输出每个场景的吞吐量（请求/秒）和 p50/p95/p99 延迟（毫秒）的 JSON；
+compare 对比两次结果，p95 变慢或吞吐量下降超过 threshold（默认 10%）的场景标记为退化，存在退化时退出码为 1。
+
+注意：coronavirus 包在导入时就根据环境变量创建数据库引擎，所以本模块在设置好环境变量之后才导入应用，不要在文件开头导入 run 或 coronavirus。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import httpx
+
+class Scenario(NamedTuple):
+    name: str
+    group: str
+    method: str
+    url: str
+    # 返回 httpx 请求参数（json、data、files、headers）的函数，参数是 setup 阶段得到的上下文
+    kwargs: Callable[[dict], dict] = lambda context: {}
+
+
+SCENARIOS = [
+    Scenario('coronavirus get_data', 'coronavirus', 'GET', '/coronavirus/get_data?limit=100'),
+    Scenario('coronavirus get_data city', 'coronavirus', 'GET', '/coronavirus/get_data?city=Province-000001&limit=100'),
+    Scenario('coronavirus get_cities', 'coronavirus', 'GET', '/coronavirus/get_cities?limit=100'),
+    Scenario('coronavirus get_city', 'coronavirus', 'GET', '/coronavirus/get_city/Province-000001'),
+    Scenario('coronavirus home', 'coronavirus', 'GET', '/coronavirus/?limit=100'),
+    Scenario('coronavirus stats global', 'coronavirus', 'GET', '/coronavirus/stats/global?limit=100'),
+    Scenario('chapter03 query', 'app03', 'GET', '/chatpter03/query?page=2&limit=10'),
+    Scenario('chapter03 request body', 'app03', 'POST', '/chatpter03/request_body/city',
+             lambda context: {'json': {'name': 'Shanghai', 'country': 'China', 'country_code': 'CN', 'country_population': 1}}),
+    Scenario('chapter04 response model', 'app04', 'POST', '/chatpter04/respose_model',
+             lambda context: {'json': {'username': 'user01', 'password': '123123', 'email': 'user01@example.com'}}),
+    Scenario('chapter04 upload', 'app04', 'POST', '/chatpter04/file',
+             lambda context: {'files': {'file': ('upload.bin', context['upload'], 'application/octet-stream')}}),
+    Scenario('chapter05 dependency', 'app05', 'GET', '/chatpter05/items/',
+             lambda context: {'headers': {'x-token': 'fake-super-secret-token', 'x-key': 'fake-super-secret-key'}}),
+    Scenario('chapter06 jwt login', 'app06', 'POST', '/chatpter06/jwt/token',
+             lambda context: {'data': {'username': 'johnsnow', 'password': 'secret'}}),
+    Scenario('chapter06 jwt users/me', 'app06', 'GET', '/chatpter06/jwt/users/me',
+             lambda context: {'headers': {'Authorization': f'Bearer {context["token"]}'}}),
+]
+
+
+def seed_database(path: Path, cities: int, days: int, seed: int):
+    """用 coronavirus.synthetic 生成 cities 个城市、每个城市 days 天的数据，同样的参数和种子总是生成同样的数据"""
+    from coronavirus import synthetic
+
+    engine = synthetic.create_load_engine(f'sqlite:///{path}')
+    try:
+        synthetic.load(engine, cities, days, seed=seed, prefix='Province')
+    finally:
+        engine.dispose()
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """最近秩法计算百分位数"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(q / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, context: dict,
+                       requests: int, concurrency: int, warmup: int) -> dict:
+    kwargs = scenario.kwargs(context)
+    for _ in range(warmup):
+        await client.request(scenario.method, scenario.url, **kwargs)
+
+    latencies: List[float] = []
+    errors = 0
+    remaining = [requests]
+
+    async def worker():
+        nonlocal errors
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            start = time.perf_counter()
+            response = await client.request(scenario.method, scenario.url, **kwargs)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+    }
+
+
+async def run_all(client: httpx.AsyncClient, scenarios: List[Scenario], args) -> Dict[str, dict]:
+    context = {'upload': random.Random(args.seed).randbytes(args.upload_kb * 1024)}
+    login = await client.post('/chatpter06/jwt/token', data={'username': 'johnsnow', 'password': 'secret'})
+    context['token'] = login.json().get('access_token', '') if login.status_code == 200 else ''
+
+    results = {}
+    for scenario in scenarios:
+        # bcrypt 每次校验都要几百毫秒，登录场景的请求数单独限制
+        requests = min(args.requests, args.login_requests) if scenario.name == 'chapter06 jwt login' else args.requests
+        results[scenario.name] = await run_scenario(client, scenario, context, requests, args.concurrency, min(args.warmup, requests))
+        print(f'  {scenario.name:<30} {results[scenario.name]}', file=sys.stderr)
+    return results
+
+
+async def run_asgi(app, scenarios: List[Scenario], args) -> Dict[str, dict]:
+    """进程内通过 ASGI 直接调用应用，不经过网络和 HTTP 解析，测的是应用本身的开销"""
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            return await run_all(client, scenarios, args)
+    finally:
+        await app.router.shutdown()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def run_uvicorn(app, scenarios: List[Scenario], args) -> Dict[str, dict]:
+    """在后台线程中启动 uvicorn，通过真实的 TCP 连接压测，包括 HTTP 解析和网络开销"""
+    import uvicorn
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning', lifespan='on'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        await asyncio.sleep(0.05)
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', limits=limits) as client:
+            return await run_all(client, scenarios, args)
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def run(args) -> dict:
+    directory = Path(tempfile.mkdtemp(prefix='coronavirus-bench-'))
+    db_path = directory / 'bench.sqlite3'
+    # 必须在导入 coronavirus 之前设置，见文件开头的说明
+    os.environ['CORONAVIRUS_DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ.setdefault('CORONAVIRUS_DB_PROFILE', args.profile)
+    os.environ['CORONAVIRUS_PROFILING_ENABLED'] = 'false'
+
+    start = time.perf_counter()
+    seed_database(db_path, args.cities, args.days, args.seed)
+    print(f'已生成数据库 {db_path}（{args.cities} 个城市 x {args.days} 天），耗时 {time.perf_counter() - start:.1f} 秒', file=sys.stderr)
+
+    from run import app
+
+    scenarios = [s for s in SCENARIOS if not args.scenario or s.group in args.scenario or s.name in args.scenario]
+    modes = ['asgi', 'uvicorn'] if args.mode == 'all' else [args.mode]
+    results = {}
+    for mode in modes:
+        print(f'{mode}:', file=sys.stderr)
+        runner = run_asgi if mode == 'asgi' else run_uvicorn
+        results[mode] = asyncio.run(runner(app, scenarios, args))
+    return {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': {k: v for k, v in vars(args).items() if k != 'func'},
+        },
+        'results': results,
+    }
+
+
+def compare(base: dict, new: dict, threshold: float) -> List[dict]:
+    """对比两次结果中都存在的场景，p95 变慢或吞吐量下降超过 threshold 的标记为退化"""
+    rows = []
+    for mode, scenarios in new['results'].items():
+        for name, stats in scenarios.items():
+            old = base['results'].get(mode, {}).get(name)
+            if old is None:
+                continue
+            p95_change = (stats['p95_ms'] - old['p95_ms']) / old['p95_ms'] if old['p95_ms'] else 0.0
+            rps_change = (stats['throughput_rps'] - old['throughput_rps']) / old['throughput_rps'] if old['throughput_rps'] else 0.0
+            rows.append({
+                'mode': mode,
+                'scenario': name,
+                'p95_ms': [old['p95_ms'], stats['p95_ms']],
+                'p95_change': round(p95_change, 3),
+                'throughput_rps': [old['throughput_rps'], stats['throughput_rps']],
+                'throughput_change': round(rps_change, 3),
+                'regression': p95_change > threshold or rps_change < -threshold,
+            })
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='生成数据库并压测')
+    run_parser.add_argument('--cities', type=int, default=200)
+    run_parser.add_argument('--days', type=int, default=60)
+    run_parser.add_argument('--seed', type=int, default=20200122)
+    run_parser.add_argument('--mode', choices=['asgi', 'uvicorn', 'all'], default='all')
+    run_parser.add_argument('--scenario', action='append', help='只运行指定分组（coronavirus、app03 等）或名称的场景，可以重复')
+    run_parser.add_argument('--requests', type=int, default=500, help='每个场景的请求数')
+    run_parser.add_argument('--login-requests', type=int, default=20, help='bcrypt 登录场景的请求数')
+    run_parser.add_argument('--concurrency', type=int, default=10)
+    run_parser.add_argument('--warmup', type=int, default=10)
+    run_parser.add_argument('--upload-kb', type=int, default=256, help='上传场景的文件大小（KiB）')
+    run_parser.add_argument('--profile', default='bench', help='数据库预设方案，见 coronavirus/config.py')
+    run_parser.add_argument('--output', help='结果写入的 JSON 文件，默认输出到标准输出')
+
+    compare_parser = commands.add_parser('compare', help='对比两次压测结果')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1)
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        result = json.dumps(run(args), ensure_ascii=False, indent=2)
+        if args.output:
+            Path(args.output).write_text(result, encoding='utf-8')
+        else:
+            print(result)
+        return 0
+
+    base = json.loads(Path(args.base).read_text(encoding='utf-8'))
+    new = json.loads(Path(args.new).read_text(encoding='utf-8'))
+    rows = compare(base, new, args.threshold)
+    for row in rows:
+        flag = '退化' if row['regression'] else ''
+        print(f"{row['mode']:<8} {row['scenario']:<30} p95 {row['p95_ms'][0]:>9} -> {row['p95_ms'][1]:>9} ms ({row['p95_change']:+.1%})  "
+              f"吞吐量 {row['throughput_rps'][0]:>8} -> {row['throughput_rps'][1]:>8} rps ({row['throughput_change']:+.1%})  {flag}")
+    return 1 if any(row['regression'] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+对比列表接口的 JSON 序列化耗时（不访问数据库，只测序列化本身）：
+
+    python -m benchmarks.bench_serialization --rows 100 --number 2000
+
+    jsonable_encoder：原来的 /get_data，没有 response_model，jsonable_encoder 通过反射遍历 ORM 对象
+    response_model：原来的 /get_cities，先用 pydantic（orm_mode）校验每一行，再 jsonable_encoder
+    fast：compile_serializer 生成的字典 + FastJSONResponse（orjson）
+"""
+
+import argparse
+import json
+import timeit
+from datetime import date, datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import parse_obj_as
+from typing import List
+
+from coronavirus import models, schemas
+from coronavirus.serializers import FastJSONResponse, compile_serializer, serialize_many
+
+
+def make_rows(n: int):
+    now = datetime(2020, 3, 22, 12, 0, 0)
+    data = [models.Data(id=i, city_id=i % 50, date=date(2020, 1, 22) + timedelta(days=i), confirmed=i * 100,
+                        deaths=i, recovered=i * 10, created_at=now, updated_at=now) for i in range(n)]
+    cities = [models.City(id=i, province=f'province-{i}', country='China', country_code='CN',
+                          country_population=1400000000, created_at=now, updated_at=now) for i in range(n)]
+    return data, cities
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100)
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    data, cities = make_rows(args.rows)
+    serialize_data = compile_serializer(schemas.ReadData)
+    serialize_city = compile_serializer(schemas.ReadCity)
+
+    cases = {
+        'get_data jsonable_encoder': lambda: JSONResponse(jsonable_encoder(data)).body,
+        'get_data fast': lambda: FastJSONResponse(serialize_many(serialize_data, data)).body,
+        'get_cities response_model': lambda: JSONResponse(jsonable_encoder(parse_obj_as(List[schemas.ReadCity], cities))).body,
+        'get_cities fast': lambda: FastJSONResponse(serialize_many(serialize_city, cities)).body,
+    }
+    # 确认两种方式输出的数据一致
+    assert json.loads(cases['get_data fast']()) == json.loads(JSONResponse(jsonable_encoder(parse_obj_as(List[schemas.ReadData], data))).body)
+    assert json.loads(cases['get_cities fast']()) == json.loads(cases['get_cities response_model']())
+
+    results = {}
+    for name, case in cases.items():
+        seconds = min(timeit.repeat(case, number=args.number, repeat=3))
+        results[name] = round(seconds / args.number * 1e6, 1)
+        print(f'{name:<28} {results[name]:>10} µs / {args.rows} 行')
+    return results
+
+
+if __name__ == '__main__':
+    main()
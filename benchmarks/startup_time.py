@@ -0,0 +1,200 @@
+"""
+应用（run:app）的冷启动耗时：在新的解释器中用 python -X importtime 导入 run，再执行一遍启动事件，按路由和顶层包统计耗时。
+
+    python -m benchmarks.startup_time
+    python -m benchmarks.startup_time --repeat 5 --isolated --output startup.json
+    python -m benchmarks.startup_time --import-budget-ms 800 --startup-budget-ms 300 --router-budget chapter06=120
+
+    import：导入 run 的总耗时，包括创建 app 和挂载路由
+    startup：执行所有启动事件（建表、预热城市缓存、初始化汇总表等）的耗时
+    routers：按 run.ROUTERS 的挂载顺序，每个路由模块导入的增量耗时，前面的模块已经导入的依赖（例如 fastapi、SQLAlchemy）不再计入
+    isolated（--isolated）：每次只启用一个路由（ROUTERS=<名称>）时导入 run 的总耗时
+    packages：run 直接导入的各个顶层包的耗时，slowest：自身耗时最长的模块
+
+每次测量都在新的子进程中进行，--repeat 多次取中位数。设置了任意预算时，超出预算则退出码为 1，可以放在 CI 中防止启动变慢。
+没有设置 CORONAVIRUS_DATABASE_URL 时使用临时目录中新建的 SQLite 数据库，不会修改项目中的数据库。
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+# 子进程输出结果的行前缀，和应用自己的输出区分开
+MARKER = '@@startup_time '
+
+CHILD = f'''
+import asyncio, json, time
+start = time.perf_counter()
+import run
+imported = time.perf_counter()
+asyncio.run(run.app.router.startup())
+started = time.perf_counter()
+asyncio.run(run.app.router.shutdown())
+print({MARKER!r} + json.dumps({{
+    'import_ms': (imported - start) * 1000,
+    'startup_ms': (started - imported) * 1000,
+    'routers': {{name: run.ROUTERS[name][0] for name in run.routers}},
+}}), flush=True)
+'''
+
+
+def parse_importtime(stderr: str) -> List[tuple]:
+    """解析 -X importtime 的输出，返回 (模块名, 层级, 自身耗时毫秒, 累计耗时毫秒) 的列表"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        # 格式为 import time: <自身微秒> | <累计微秒> | <缩进><模块名>，缩进表示导入的层级，每一层两个空格
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), level, int(self_us) / 1000, int(cumulative_us) / 1000))
+    return modules
+
+
+def measure(env: Dict[str, str]) -> dict:
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD], cwd=ROOT, env=env,
+                            capture_output=True, text=True)
+    lines = [line for line in result.stdout.splitlines() if line.startswith(MARKER)]
+    if result.returncode != 0 or not lines:
+        raise RuntimeError(f'启动失败（退出码 {result.returncode}）：\n{result.stderr[-2000:]}')
+    summary = json.loads(lines[-1][len(MARKER):])
+    modules = parse_importtime(result.stderr)
+    cumulative = {}
+    for name, level, self_ms, cumulative_ms in modules:
+        cumulative.setdefault(name, cumulative_ms)
+    # 子模块的行在父模块之前输出，所以 run 之前、上一个同层级模块之后的下一层模块就是 run 直接导入的包
+    packages, children = {}, []
+    for name, level, _, cumulative_ms in modules:
+        if name == 'run':
+            for child, child_ms in children:
+                package = child.split('.')[0]
+                packages[package] = packages.get(package, 0) + child_ms
+            break
+        if level == 0:
+            children = []
+        elif level == 1:
+            children.append((name, cumulative_ms))
+    return {
+        'import_ms': summary['import_ms'],
+        'startup_ms': summary['startup_ms'],
+        'routers': {name: cumulative.get(module, 0.0) for name, module in summary['routers'].items()},
+        'packages': packages,
+        'slowest': sorted(((name, self_ms) for name, _, self_ms, _ in modules), key=lambda m: -m[1]),
+    }
+
+
+def median_of(samples: List[dict], key: str) -> Dict[str, float]:
+    names = dict.fromkeys(name for sample in samples for name in sample[key])
+    return {name: round(statistics.median(s[key].get(name, 0.0) for s in samples), 2) for name in names}
+
+
+def report(args) -> dict:
+    env = dict(os.environ)
+    if 'CORONAVIRUS_DATABASE_URL' not in env:
+        directory = Path(tempfile.mkdtemp(prefix='coronavirus-startup-'))
+        env['CORONAVIRUS_DATABASE_URL'] = f'sqlite:///{directory / "startup.sqlite3"}'
+    # 使用和生产环境相同的数据库选项（WAL、连接池）测量启动耗时
+    env.setdefault('CORONAVIRUS_DB_PROFILE', 'prod')
+
+    samples = [measure(env) for _ in range(args.repeat)]
+    slowest = {}
+    for sample in samples:
+        for name, self_ms in sample['slowest'][:args.top * 2]:
+            slowest.setdefault(name, []).append(self_ms)
+    results = {
+        'import_ms': round(statistics.median(s['import_ms'] for s in samples), 2),
+        'startup_ms': round(statistics.median(s['startup_ms'] for s in samples), 2),
+        'routers': median_of(samples, 'routers'),
+        'packages': dict(sorted(median_of(samples, 'packages').items(), key=lambda p: -p[1])),
+        'slowest': dict(sorted(((name, round(statistics.median(values), 2)) for name, values in slowest.items()),
+                               key=lambda m: -m[1])[:args.top]),
+    }
+    if args.isolated:
+        results['isolated'] = {}
+        for name in results['routers']:
+            isolated = [measure({**env, 'ROUTERS': name}) for _ in range(args.repeat)]
+            results['isolated'][name] = round(statistics.median(s['import_ms'] for s in isolated), 2)
+    return {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': {k: v for k, v in vars(args).items()},
+        },
+        'results': results,
+    }
+
+
+def check_budgets(results: dict, args) -> List[str]:
+    violations = []
+    if args.import_budget_ms is not None and results['import_ms'] > args.import_budget_ms:
+        violations.append(f'import {results["import_ms"]:.1f}ms > {args.import_budget_ms:.1f}ms')
+    if args.startup_budget_ms is not None and results['startup_ms'] > args.startup_budget_ms:
+        violations.append(f'startup {results["startup_ms"]:.1f}ms > {args.startup_budget_ms:.1f}ms')
+    for name, budget in args.router_budget:
+        if name not in results['routers']:
+            violations.append(f'路由 {name} 没有启用')
+        elif results['routers'][name] > budget:
+            violations.append(f'router {name} {results["routers"][name]:.1f}ms > {budget:.1f}ms')
+    return violations
+
+
+def print_table(results: dict):
+    print(f'import run: {results["import_ms"]:8.1f} ms', file=sys.stderr)
+    print(f'startup:    {results["startup_ms"]:8.1f} ms', file=sys.stderr)
+    print('routers（增量 / 单独启用）:', file=sys.stderr)
+    for name, ms in results['routers'].items():
+        isolated = results.get('isolated', {}).get(name)
+        print(f'  {name:20s} {ms:8.1f} ms' + (f' / {isolated:8.1f} ms' if isolated is not None else ''), file=sys.stderr)
+    print('packages:', file=sys.stderr)
+    for name, ms in results['packages'].items():
+        print(f'  {name:20s} {ms:8.1f} ms', file=sys.stderr)
+    print('slowest modules (self):', file=sys.stderr)
+    for name, ms in results['slowest'].items():
+        print(f'  {name:40s} {ms:8.1f} ms', file=sys.stderr)
+
+
+def router_budget(value: str) -> tuple:
+    name, _, ms = value.partition('=')
+    if not name or not ms:
+        raise argparse.ArgumentTypeError('格式为 <路由名称>=<毫秒>，例如 chapter06=120')
+    return name, float(ms)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='统计应用的导入和启动耗时，可以检查耗时预算')
+    parser.add_argument('--repeat', type=int, default=3, help='测量次数，取中位数')
+    parser.add_argument('--isolated', action='store_true', help='再逐个只启用一个路由测量导入耗时')
+    parser.add_argument('--top', type=int, default=15, help='列出自身耗时最长的模块数量')
+    parser.add_argument('--import-budget-ms', type=float, help='导入 run 的耗时预算（毫秒）')
+    parser.add_argument('--startup-budget-ms', type=float, help='启动事件的耗时预算（毫秒）')
+    parser.add_argument('--router-budget', type=router_budget, action='append', default=[],
+                        help='单个路由的增量导入耗时预算，格式为 <路由名称>=<毫秒>，可以重复')
+    parser.add_argument('--output', help='结果写入的 JSON 文件，默认输出到标准输出')
+    args = parser.parse_args(argv)
+
+    result = report(args)
+    print_table(result['results'])
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text, encoding='utf-8')
+    else:
+        print(text)
+
+    violations = check_budgets(result['results'], args)
+    for violation in violations:
+        print(f'超出预算：{violation}', file=sys.stderr)
+    return 1 if violations else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1 +1,12 @@
-from .main import application
\ No newline at end of file
+# 路由在第一次访问时才导入，没有启用异步接口时不会导入 async_main 及其依赖，见 tutorial/__init__.py
+_routers = {
+    'application': 'main',
+    'async_application': 'async_main',
+}
+
+
+def __getattr__(name):
+    if name in _routers:
+        # 用 __import__ 而不是 importlib.import_module，python -X importtime 中才能看到这些模块
+        return getattr(__import__(f'{__name__}.{_routers[name]}', fromlist=[name]), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,224 @@
+"""静态文件的构建和托管：带内容哈希的文件名、预压缩的 gzip/brotli 文件和长期缓存"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+from functools import lru_cache
+from pathlib import Path, PurePosixPath
+from typing import Dict
+
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from coronavirus.config import BASE_DIR
+
+try:
+    import brotli  # 可选依赖：pip install brotli，未安装时只生成 gzip 文件
+except ImportError:
+    brotli = None
+
+"""
+构建：python -m coronavirus.assets build
+    把 static 目录下的文件复制到 static/dist 下，文件名中加入内容哈希，例如 semantic.min.css -> semantic.min.3f2a9c0d1b4e.css，
+    文本文件再生成预压缩的 .gz 和 .br 文件，最后写入 dist/manifest.json（原路径 -> 相对于 dist 的带哈希的路径）。
+    文件内容变化后哈希随之变化，URL 也就变了，所以带哈希的文件可以让浏览器永久缓存（Cache-Control: immutable）。
+    .js 和 .css 中的 sourceMappingURL 会换成带哈希的 .map 文件名；上一次构建的带哈希的文件会保留，
+    客户端缓存的旧页面引用的还是它们，更早的构建留下的文件才会被删除。
+
+托管：StaticAssets 根据请求的 Accept-Encoding 直接返回预先压缩好的文件，不需要在每次请求时压缩；
+    模板中用 static_url('semantic.min.css') 生成 URL，有 manifest 时返回带哈希的路径，没有构建过时返回原路径。
+    文件通过 FileResponse 分块发送，不会整个读入内存；直接请求 .gz/.br 文件返回 404，它们只通过 Accept-Encoding 协商返回。
+"""
+
+STATIC_DIR = BASE_DIR / 'static'
+DIST_DIR = STATIC_DIR / 'dist'
+MANIFEST_PATH = DIST_DIR / 'manifest.json'
+STATIC_URL = '/coronavirus/static/'
+# 构建输出目录对应的 URL，manifest 中的路径相对于这个目录
+DIST_URL = STATIC_URL + DIST_DIR.relative_to(STATIC_DIR).as_posix() + '/'
+
+# 只有文本文件值得压缩，图片、字体等格式本身已经压缩过
+COMPRESSIBLE_SUFFIXES = {'.css', '.js', '.map', '.html', '.svg', '.json', '.txt'}
+# 按优先级排列的预压缩格式：(Content-Encoding, 文件后缀)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# 内容中的 sourceMappingURL 需要换成带哈希的 .map 文件名的文件
+SOURCE_MAP_SUFFIXES = {'.js', '.css'}
+SOURCE_MAP_URL = re.compile(rb'(?P<prefix>[#@]\s*sourceMappingURL=)(?P<url>[^\s*]+)')
+HASH_LENGTH = 12
+HASHED_NAME = re.compile(r'\.[0-9a-f]{%d}\.[^./]+$' % HASH_LENGTH)
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# 没有哈希的文件可以缓存，但每次使用前都要向服务器确认（ETag / Last-Modified）
+REVALIDATE = 'no-cache'
+
+
+def hashed_name(path: Path, digest: str) -> str:
+    return f'{path.stem}.{digest[:HASH_LENGTH]}{path.suffix}'
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_manifest(path: Path) -> Dict[str, str]:
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except FileNotFoundError:
+        return {}
+
+
+def _rewrite_source_map_url(content: bytes, relative: PurePosixPath, manifest: Dict[str, str]) -> bytes:
+    """把 sourceMappingURL 引用的 .map 文件换成带哈希的文件，引用的不是本次构建的文件（例如完整的 URL）时保持不变"""
+    directory = relative.parent.as_posix()
+
+    def replace(match):
+        url = match.group('url').decode('utf-8', 'replace')
+        hashed = manifest.get(posixpath.normpath(posixpath.join(directory, url)))
+        if hashed is None:
+            return match.group(0)
+        return match.group('prefix') + posixpath.relpath(hashed, directory).encode('utf-8')
+
+    return SOURCE_MAP_URL.sub(replace, content)
+
+
+def build(source: Path = STATIC_DIR, output: Path = DIST_DIR) -> Dict[str, str]:
+    """构建带哈希的文件和预压缩文件，manifest 写入 output/manifest.json，其中的路径相对于 output，返回 manifest"""
+    manifest_path = output / 'manifest.json'
+    previous = _read_manifest(manifest_path)
+    paths = [path for path in source.rglob('*') if path.is_file() and output not in path.parents]
+    # 先处理 .map 文件，引用它们的 .js 和 .css 才能查到带哈希的文件名
+    paths.sort(key=lambda path: (path.suffix != '.map', path))
+    manifest = {}
+    for path in paths:
+        relative = path.relative_to(source)
+        if path.suffix in COMPRESSIBLE_SUFFIXES:
+            # 文本文件要压缩，需要读入内存；其他文件（图片、字体等）分块计算哈希，用 copyfile 复制（Linux 上使用 sendfile）
+            content = path.read_bytes()
+            if path.suffix in SOURCE_MAP_SUFFIXES:
+                content = _rewrite_source_map_url(content, PurePosixPath(relative.as_posix()), manifest)
+            target = output / relative.parent / hashed_name(path, hashlib.sha256(content).hexdigest())
+        else:
+            content = None
+            target = output / relative.parent / hashed_name(path, _file_sha256(path))
+        manifest[relative.as_posix()] = target.relative_to(output).as_posix()
+        if target.exists():
+            # 内容相同的文件在之前的构建中已经生成过
+            continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if content is None:
+            shutil.copyfile(path, target)
+        else:
+            target.write_bytes(content)
+            _write_compressed(target, content)
+
+    output.mkdir(parents=True, exist_ok=True)
+    # 先写入临时文件再替换，正在运行的进程不会读到写了一半的 manifest
+    temporary = manifest_path.with_name(manifest_path.name + '.tmp')
+    temporary.write_text(json.dumps(manifest, indent=2, sort_keys=True), encoding='utf-8')
+    os.replace(temporary, manifest_path)
+    _remove_stale(output, set(manifest.values()) | set(previous.values()))
+    load_manifest.cache_clear()
+    return manifest
+
+
+def _remove_stale(output: Path, keep: set):
+    """删除既不属于本次构建、也不属于上一次构建的带哈希的文件和它们的预压缩文件"""
+    for path in output.rglob('*'):
+        if not path.is_file() or path.name == 'manifest.json':
+            continue
+        name = path.relative_to(output).as_posix()
+        original = next((name[:-len(suffix)] for _, suffix in ENCODINGS if name.endswith(suffix)), name)
+        if name not in keep and original not in keep:
+            path.unlink()
+
+
+def _write_compressed(target: Path, content: bytes) -> None:
+    # mtime=0 让相同的内容总是生成相同的 .gz 文件
+    variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(content, quality=11)
+    for suffix, compressed in variants.items():
+        # 压缩后反而更大的文件没有必要保留
+        if len(compressed) < len(content):
+            target.with_name(target.name + suffix).write_bytes(compressed)
+
+
+@lru_cache(maxsize=None)
+def load_manifest() -> Dict[str, str]:
+    return _read_manifest(MANIFEST_PATH)
+
+
+def static_url(path: str) -> str:
+    """模板中使用的静态文件 URL"""
+    hashed = load_manifest().get(path)
+    return DIST_URL + hashed if hashed is not None else STATIC_URL + path
+
+
+def _accepted_encodings(scope: Scope) -> set:
+    accept_encoding = Headers(scope=scope).get('accept-encoding', '')
+    accepted = set()
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        # 忽略 q=0，即客户端明确表示不接受的编码
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticAssets(StaticFiles):
+    """在 StaticFiles 的基础上增加预压缩文件的协商和 Cache-Control"""
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        # 直接请求预压缩文件时，会带着原文件的 Content-Type 而没有 Content-Encoding 返回压缩后的数据，按不存在处理
+        if path.endswith(tuple(suffix for _, suffix in ENCODINGS)):
+            raise HTTPException(status_code=404)
+        return await super().get_response(path, scope)
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        headers = {
+            'Cache-Control': IMMUTABLE if HASHED_NAME.search(str(full_path)) else REVALIDATE,
+            'Vary': 'Accept-Encoding',
+        }
+        media_type = mimetypes.guess_type(str(full_path))[0] or 'text/plain'
+        accepted = _accepted_encodings(scope)
+        for encoding, suffix in ENCODINGS:
+            if encoding not in accepted:
+                continue
+            try:
+                compressed_stat = os.stat(f'{full_path}{suffix}')
+            except FileNotFoundError:
+                continue
+            full_path, stat_result = f'{full_path}{suffix}', compressed_stat
+            headers['Content-Encoding'] = encoding
+            break
+
+        # FileResponse 根据 stat_result 生成 Content-Length、ETag 和 Last-Modified，压缩文件有自己的 ETag
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result,
+                                method=scope['method'], media_type=media_type, headers=headers)
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='构建带哈希文件名和预压缩文件的静态资源')
+    parser.add_argument('command', choices=['build'])
+    args = parser.parse_args()
+    if args.command == 'build':
+        result = build()
+        print(f'已构建 {len(result)} 个文件，manifest：{MANIFEST_PATH}')
@@ -0,0 +1,58 @@
+from typing import List, Optional
+from datetime import date
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from coronavirus import models, rollups, schemas
+from coronavirus.crud import bump_version, cache_city, city_cache, select_cities, select_data
+
+
+"""crud.py 中常用函数的异步版本，配合 AsyncSession 使用，查询语句和同步版本共用"""
+
+
+# 和同步版本共用同一个城市缓存，返回 schemas.ReadCity 快照
+async def get_city_by_name(db: AsyncSession, name: str):
+    city = city_cache.get(name)
+    if city is not None:
+        return city
+    db_city = (await db.execute(select(models.City).where(models.City.province == name))).scalars().first()
+    if db_city is None:
+        return None
+    return cache_city(db_city, db.sync_session)
+
+
+async def get_cities(db: AsyncSession, skip: int = 0, limit: int = 10, cursor: Optional[str] = None):
+    return (await db.execute(select_cities(skip=skip, limit=limit, cursor=cursor))).scalars().all()
+
+
+async def create_city(db: AsyncSession, city: schemas.CreateCity):
+    db_city = models.City(**city.dict())
+    db.add(db_city)
+    await db.run_sync(bump_version, 'city')
+    await db.commit()
+    await db.refresh(db_city)
+    cache_city(db_city)
+    return db_city
+
+
+# 异步会话不支持访问时懒加载关系属性，需要 d.city 时 load 要传 joined 或 selectin
+async def get_data(db: AsyncSession, city: str = None, skip: int = 0, limit: int = 10, load: str = 'raise',
+                   cursor: Optional[str] = None, start_date: Optional[date] = None, end_date: Optional[date] = None):
+    city_id = None
+    if city:
+        db_city = await get_city_by_name(db, name=city)
+        if db_city is None:
+            return []
+        city_id = db_city.id
+    stmt = select_data(city_id=city_id, skip=skip, limit=limit, load=load, cursor=cursor, start_date=start_date, end_date=end_date)
+    return (await db.execute(stmt)).scalars().all()
+
+
+async def create_city_data(db: AsyncSession, data: schemas.CreateData, city_id: int):
+    db_data = models.Data(**data.dict(), city_id=city_id)
+    db.add(db_data)
+    # 汇总表的更新是同步代码，用 run_sync 在异步会话底层的同步会话上执行，和数据在同一个事务中提交
+    await db.run_sync(rollups.apply_data_rows, [dict(data.dict(), city_id=city_id)])
+    await db.run_sync(bump_version, 'data')
+    await db.commit()
+    await db.refresh(db_data)
+    return db_data
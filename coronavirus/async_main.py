@@ -0,0 +1,77 @@
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from coronavirus import async_crud, crud, schemas
+from coronavirus.database import AsyncSessionLocal
+from coronavirus.main import serialize_city, serialize_data, set_next_cursor
+from coronavirus.serializers import FastJSONResponse, serialize_many
+from coronavirus.timing import TimedRoute
+from typing import List
+from datetime import date
+
+"""
+异步版本的新冠病毒疫情跟踪器接口，需要设置环境变量 CORONAVIRUS_ASYNC_ENABLED=true 才会在 run.py 中挂载到 /coronavirus/async 下。
+
+coronavirus/main.py 中的路由是普通的 def 函数，FastAPI 会把它们放到线程池中执行，每个请求在等待数据库返回期间都占用一个线程，
+并发量受限于线程池的大小（默认 40）。这里的路由用 async def 定义，使用 AsyncSession 和 await 等待数据库，
+等待期间事件循环可以处理其他请求，并发量只受数据库连接池大小的限制。
+"""
+
+async_application = APIRouter(route_class=TimedRoute)
+
+
+# 异步版本的 get_db，async with 退出时会自动关闭会话
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+@async_application.post("/create_city", response_model=schemas.ReadCity)
+async def create_city(city: schemas.CreateCity, db: AsyncSession = Depends(get_async_db)):
+    db_city = await async_crud.get_city_by_name(db, name=city.province)
+    if db_city:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="城市已存在/已注册！")
+    return await async_crud.create_city(db=db, city=city)
+
+
+@async_application.get("/get_city/{city}", response_model=schemas.ReadCity)
+async def get_city(city: str, db: AsyncSession = Depends(get_async_db)):
+    db_city = await async_crud.get_city_by_name(db, name=city)
+    if db_city is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="未找到该城市！")
+    return db_city
+
+
+@async_application.get("/get_cities", response_model=List[schemas.ReadCity], response_class=FastJSONResponse)
+async def get_cities(skip: int = 0, limit: int = 10, cursor: str = None,
+                     db: AsyncSession = Depends(get_async_db)):
+    try:
+        cities = await async_crud.get_cities(db=db, skip=skip, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    response = FastJSONResponse(serialize_many(serialize_city, cities))
+    if cursor is not None:
+        set_next_cursor(response, crud.next_city_cursor(cities, limit))
+    return response
+
+
+@async_application.post("/create_data", response_model=schemas.ReadData)
+async def create_data_for_city(city: str, data: schemas.CreateData, db: AsyncSession = Depends(get_async_db)):
+    db_city = await async_crud.get_city_by_name(db, name=city)
+    if db_city is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="未找到该城市！")
+    return await async_crud.create_city_data(db=db, data=data, city_id=db_city.id)
+
+
+@async_application.get("/get_data", response_model=List[schemas.ReadData], response_class=FastJSONResponse)
+async def get_data(city: str = None, skip: int = 0, limit: int = Query(default=10, ge=1, le=100),
+                   cursor: str = None, start_date: date = None, end_date: date = None,
+                   db: AsyncSession = Depends(get_async_db)):
+    try:
+        data = await async_crud.get_data(db=db, city=city, skip=skip, limit=limit, cursor=cursor,
+                                         start_date=start_date, end_date=end_date)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    response = FastJSONResponse(serialize_many(serialize_data, data))
+    if cursor is not None:
+        set_next_cursor(response, crud.next_data_cursor(data, limit))
+    return response
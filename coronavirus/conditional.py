@@ -0,0 +1,62 @@
+"""条件 GET：根据 ETag / Last-Modified 判断客户端缓存的内容是否仍然有效，有效时返回 304，不再查询和序列化数据"""
+
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional, Tuple
+
+from fastapi import Request, Response, status
+
+"""
+验证器由数据切片的 (max(updated_at), 行数) 和表的版本号（见 models.TableVersion）生成，只需要一条聚合查询：
+    ETag: W/"<版本号>-<行数>-<max(updated_at)，精确到微秒>"
+    Last-Modified: max(updated_at)
+updated_at 只精确到秒，同一秒内替换了窗口中的行时 max(updated_at) 和行数都可能不变，版本号在每次写入时都会改变。
+客户端再次请求时带上 If-None-Match（优先）或 If-Modified-Since，内容没有变化时返回 304 Not Modified，没有响应体。
+"""
+
+
+def validators(last_updated: Optional[datetime], count: int, version: int = 0) -> Tuple[str, Optional[str]]:
+    """返回 (ETag, Last-Modified)，数据库中的时间是 UTC 时间"""
+    if last_updated is None:
+        return f'W/"{version}-{count}-0"', None
+    last_updated = last_updated.replace(tzinfo=timezone.utc)
+    return (f'W/"{version}-{count}-{last_updated.strftime("%Y%m%d%H%M%S%f")}"',
+            format_datetime(last_updated, usegmt=True))
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == '*':
+        return True
+    # If-None-Match 使用弱比较，忽略 W/ 前缀
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[str]) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since is not None and last_modified is not None:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def set_validators(response: Response, etag: str, last_modified: Optional[str]) -> Response:
+    response.headers['ETag'] = etag
+    if last_modified is not None:
+        response.headers['Last-Modified'] = last_modified
+    return response
+
+
+def not_modified(etag: str, last_modified: Optional[str]) -> Response:
+    return set_validators(Response(status_code=status.HTTP_304_NOT_MODIFIED), etag, last_modified)
@@ -1,5 +1,13 @@
-from sqlalchemy.orm import Session
-from coronavirus import models, schemas
+import base64
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+from datetime import date, datetime
+from sqlalchemy import and_, bindparam, event, func, select, tuple_
+from sqlalchemy.sql import Select
+from sqlalchemy.orm import Session, joinedload, lazyload, raiseload, selectinload
+from coronavirus import models, rollups, schemas
+from coronavirus.cache import LRUCache
+from coronavirus.config import settings
 
 
 """
@@ -16,16 +24,154 @@ def get_city(db: Session, city_id: int): # 这里的 Session 类型表示与数
     return db.query(models.City).filter(models.City.id == city_id).first()
 
 
+"""
+城市缓存：city 表很小，但创建城市、查询城市、新建数据时都要按名称查询城市，这里把 省/直辖市名称 -> 城市 缓存在进程内。
+缓存的是 schemas.ReadCity 快照而不是 ORM 对象，ORM 对象绑定在某个会话上，不能在请求之间共享。
+写入城市的函数（create_city 等）会同步更新缓存，以后新增修改或删除城市的函数时，要调用 city_cache.invalidate(province) 使缓存失效。
+只缓存存在的城市，查不到的城市不缓存，否则其他进程新建的城市在这里会一直查不到。
+会话中有尚未提交的新建城市（create_cities_bulk）时，这个会话里查到的城市可能随事务回滚而不存在，
+先记在 session.info 中，事务提交之后才放入缓存，回滚时丢弃并使缓存中的同名条目失效。
+"""
+city_cache = LRUCache(maxsize=settings.city_cache_size)
+
+
+def cache_city(db_city: models.City, db: Optional[Session] = None) -> schemas.ReadCity:
+    city = schemas.ReadCity.from_orm(db_city)
+    if db is not None and db.info.get('uncommitted_cities'):
+        db.info.setdefault('pending_cities', {})[city.province] = city
+    else:
+        city_cache.put(city.province, city)
+    return city
+
+
+# 监听所有会话（包括 AsyncSession 内部的同步会话）的事务事件，只处理最外层的事务
+@event.listens_for(Session, 'after_commit')
+def cache_committed_cities(session: Session):
+    session.info.pop('uncommitted_cities', None)
+    for city in session.info.pop('pending_cities', {}).values():
+        city_cache.put(city.province, city)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def drop_uncommitted_cities(session: Session, transaction):
+    if transaction.parent is not None:
+        return
+    # 提交时 pending_cities 已经被取走，这里剩下的就是没有提交（回滚或直接关闭会话）的
+    session.info.pop('uncommitted_cities', None)
+    for name in session.info.pop('pending_cities', {}):
+        city_cache.invalidate(name)
+
+
+# 返回 schemas.ReadCity 快照，不存在时返回 None
 def get_city_by_name(db: Session, name: str):
-    return db.query(models.City).filter(models.City.province == name).first()
+    city = city_cache.get(name)
+    if city is not None:
+        return city
+    db_city = db.query(models.City).filter(models.City.province == name).first()
+    if db_city is None:
+        return None
+    return cache_city(db_city, db)
+
+
+# 启动时预先把城市加载到缓存中（最多 city_cache.maxsize 个），返回加载的数量
+def warm_city_cache(db: Session) -> int:
+    db_cities = db.query(models.City).order_by(models.City.id).limit(city_cache.maxsize).all()
+    for db_city in db_cities:
+        cache_city(db_city)
+    return len(db_cities)
+
+
+"""
+数据版本（见 models.TableVersion）：写入 data 或 city 表的函数调用 bump_version，和写入的数据在同一个事务中提交；
+条件 GET 的版本查询用 select_version 在同一条聚合查询中带出版本号。
+"""
+
+def bump_version(db: Session, name: str):
+    table = models.TableVersion.__table__
+    result = db.execute(table.update().where(table.c.name == name).values(version=table.c.version + 1))
+    if result.rowcount == 0:
+        db.execute(table.insert().values(name=name, version=1))
+
+
+def select_version(name: str):
+    table = models.TableVersion.__table__
+    return func.coalesce(select(table.c.version).where(table.c.name == name).scalar_subquery(), 0)
 
 
 # skip和limit是可以由用户自定义的参数。在这个函数中，skip表示要跳过的行数，而limit表示要返回的最大行数。如果用户不指定这些参数，则函数会使用默认值skip=0和limit=10。
 # .offset(skip) 方法用于设置查询偏移量，即跳过前 skip 条记录，这样可以支持分页查询。如果 skip 参数被省略，则默认为 0，从第一条记录开始查询。
 # .limit(limit) 方法用于限制查询结果的数量，即最多返回 limit 条记录。如果 limit 参数被省略，则默认为 10。
 # .all() 方法用于执行查询并返回查询结果的列表。
-def get_cities(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(models.City).offset(skip).limit(limit).all()
+def get_cities(db: Session, skip: int = 0, limit: int = 10, cursor: Optional[str] = None):
+    return db.execute(select_cities(skip=skip, limit=limit, cursor=cursor)).scalars().all()
+
+
+# 条件 GET 使用的城市列表版本：与 get_cities 参数相同的那一页城市的 (max(updated_at), 行数, city 表的版本号)
+def get_cities_version(db: Session, skip: int = 0, limit: int = 10,
+                       cursor: Optional[str] = None) -> Tuple[Optional[datetime], int, int]:
+    page = select_cities(skip=skip, limit=limit, cursor=cursor).subquery()
+    return tuple(db.execute(
+        select(func.max(page.c.updated_at), func.count(), select_version('city')).select_from(page)
+    ).one())
+
+
+# 生成查询城市列表的 select 语句，同步的 get_cities 和 async_crud 中的异步版本共用这个函数
+def select_cities(skip: int = 0, limit: int = 10, cursor: Optional[str] = None) -> Select:
+    stmt = select(models.City)
+    if cursor is not None:
+        # 游标分页：按 id 排序，从上一页最后一个城市的 id 之后开始取，直接走主键索引的范围扫描
+        stmt = stmt.order_by(models.City.id)
+        if cursor:
+            last_id, = decode_cursor(cursor, int)
+            stmt = stmt.where(models.City.id > last_id)
+        return stmt.limit(limit)
+    return stmt.offset(skip).limit(limit)
+
+
+"""
+游标（keyset）分页：offset(skip) 需要数据库先扫描并丢弃前 skip 行，skip 越大越慢；
+游标分页记住上一页最后一行的排序键，下一页用 WHERE (date, id) > (上一页最后的 date, id) 这样的范围条件配合索引直接定位。
+游标对客户端是不透明的字符串，内容是排序键的 JSON 经过 base64 编码，空字符串表示从第一页开始。
+"""
+
+def encode_cursor(*values) -> str:
+    raw = json.dumps([v.isoformat() if isinstance(v, date) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, *types: type) -> list:
+    """解析游标，types 是每个排序键的类型（int 或 date），个数或类型不对、格式不正确时都抛出 ValueError"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError(f'无效的游标：{cursor}')
+    if not isinstance(values, list) or len(values) != len(types):
+        raise ValueError(f'无效的游标：{cursor}')
+    result = []
+    for value, type_ in zip(values, types):
+        if type_ is date and isinstance(value, str):
+            try:
+                value = date.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f'无效的游标：{cursor}')
+        # bool 是 int 的子类，true/false 也不是合法的 id
+        if not isinstance(value, type_) or isinstance(value, bool):
+            raise ValueError(f'无效的游标：{cursor}')
+        result.append(value)
+    return result
+
+
+# 根据一页的查询结果生成下一页的游标，不足一页说明已经是最后一页，返回 None
+def next_city_cursor(cities: list, limit: int) -> Optional[str]:
+    if len(cities) < limit:
+        return None
+    return encode_cursor(cities[-1].id)
+
+
+def next_data_cursor(data: list, limit: int) -> Optional[str]:
+    if len(data) < limit:
+        return None
+    return encode_cursor(data[-1].date, data[-1].id)
 
 
 # 第二个参数city: schemas.CreateCity是一个Pydantic模型，包含了创建城市所需的数据，如城市名称，所属省份等。
@@ -34,27 +180,181 @@ def create_city(db: Session, city: schemas.CreateCity):
     db_city = models.City(**city.dict())
     # 使用db.add()将City对象添加到数据库会话中
     db.add(db_city)
+    bump_version(db, 'city')
     db.commit() # db.commit()提交对数据库的更改，将新创建的城市记录保存到数据库中
     # 使用db.refresh()刷新City对象，以获取由数据库自动生成的ID等任何缺少的字段。这是必要的，因为当我们添加City对象时，ID是从数据库中自动生成的，而不是在city对象中提供的。
     db.refresh(db_city)
+    # 写入缓存（write-through），之后按名称查询这个城市时不需要再查数据库
+    cache_city(db_city)
     # 返回新创建的City对象作为函数结果
     return db_city
 
 
-def get_data(db: Session, city: str = None, skip: int = 0, limit: int = 10):
+# 关系属性 Data.city 的加载策略，由调用方根据是否需要访问 d.city 显式选择
+RELATIONSHIP_LOADERS = {
+    'lazy': lazyload,  # 访问 d.city 时才逐行查询，100 行数据会多出 100 条 SQL（N+1 查询）
+    'joined': joinedload,  # 用 LEFT OUTER JOIN 在同一条 SQL 中把城市一起查出来
+    'selectin': selectinload,  # 查出数据后，再用一条 SELECT ... WHERE city.id IN (...) 批量加载城市
+    'raise': raiseload,  # 访问 d.city 时直接报错，用于确认不需要城市信息的接口不会意外触发查询
+}
+
+
+# city 为省/直辖市名称，start_date 和 end_date 为数据日期的闭区间，都是可选的。
+# 所有查询都按 (date, id) 排序并且一定会应用分页，单次查询返回的行数不会超过 limit。
+def get_data(db: Session, city: str = None, skip: int = 0, limit: int = 10, load: str = 'lazy', cursor: Optional[str] = None,
+             start_date: Optional[date] = None, end_date: Optional[date] = None):
+    city_id = None
     if city:
-    # 通过 db 进行查询，使用 filter 方法根据 city 所属的省/直辖市来筛选出符合条件的数据，
-    # models.Data.city.has(province=city)是一个过滤条件，表示查询Data表中的city字段的值，
-    # 如果该字段的province属性的值等于传入的city参数，就将该数据加入结果集。
-    # 其中has()方法表示查询Data表中的city字段，它是一个关系属性，
-    # 因此可以通过该方法来查询城市的省份属性。
-        return db.query(models.Data).filter(models.Data.city.has(province = city)).all()  # all() 方法会将查询结果封装为一个列表对象。
-    return db.query(models.Data).offset(skip).limit(limit).all()
+        # 先通过城市缓存（未命中时用 city 表上 province 的唯一索引）得到城市 ID，再用 data 表上 (city_id, date) 的联合索引过滤，
+        # 替代 models.Data.city.has(province=city) 生成的关联 EXISTS 子查询（它需要对 data 表的每一行执行一次子查询）。
+        db_city = get_city_by_name(db, name=city)
+        if db_city is None:
+            return []
+        city_id = db_city.id
+    stmt = select_data(city_id=city_id, skip=skip, limit=limit, load=load, cursor=cursor, start_date=start_date, end_date=end_date)
+    return db.execute(stmt).scalars().all()  # all() 方法会将查询结果封装为一个列表对象。
+
+
+# 条件 GET 使用的数据版本：与 get_data 参数相同的那一页数据的 (max(updated_at), 行数, data 表的版本号)，只执行一条聚合查询
+def get_data_version(db: Session, city: str = None, skip: int = 0, limit: int = 10, cursor: Optional[str] = None,
+                     start_date: Optional[date] = None,
+                     end_date: Optional[date] = None) -> Tuple[Optional[datetime], int, int]:
+    city_id = None
+    if city:
+        db_city = get_city_by_name(db, name=city)
+        if db_city is None:
+            return None, 0, 0
+        city_id = db_city.id
+    page = select_data(city_id=city_id, skip=skip, limit=limit, cursor=cursor, start_date=start_date, end_date=end_date).subquery()
+    return tuple(db.execute(
+        select(func.max(page.c.updated_at), func.count(), select_version('data')).select_from(page)
+    ).one())
+
+
+# 生成查询数据的 select 语句，同步的 get_data 和 async_crud 中的异步版本共用这个函数
+def select_data(city_id: Optional[int] = None, skip: int = 0, limit: int = 10, load: str = 'lazy', cursor: Optional[str] = None,
+                start_date: Optional[date] = None, end_date: Optional[date] = None) -> Select:
+    stmt = select(models.Data).options(RELATIONSHIP_LOADERS[load](models.Data.city))
+    if city_id is not None:
+        stmt = stmt.where(models.Data.city_id == city_id)
+    if start_date is not None:
+        stmt = stmt.where(models.Data.date >= start_date)
+    if end_date is not None:
+        stmt = stmt.where(models.Data.date <= end_date)
+    stmt = stmt.order_by(models.Data.date, models.Data.id)
+
+    if cursor is not None:
+        # 游标分页：在 (city_id, date) 或 (date, id) 联合索引上做范围扫描
+        if cursor:
+            last_date, last_id = decode_cursor(cursor, date, int)
+            stmt = stmt.where(tuple_(models.Data.date, models.Data.id) > tuple_(last_date, last_id))
+        return stmt.limit(limit)
+    return stmt.offset(skip).limit(limit)
+
+
+# 导出数据：只查询需要的列（不构造 ORM 对象），stream_results=True 使用服务端游标，
+# yield_per 每次从游标中取 batch_size 行，按批返回，内存占用与结果集大小无关
+def iter_data_export(db: Session, city_id: Optional[int] = None, start_date: Optional[date] = None,
+                     end_date: Optional[date] = None, batch_size: int = 1000) -> Iterable[list]:
+    data, city = models.Data.__table__, models.City.__table__
+    stmt = select(city.c.province, city.c.country, data.c.date, data.c.confirmed, data.c.deaths, data.c.recovered,
+                  data.c.updated_at).select_from(data.join(city))
+    if city_id is not None:
+        stmt = stmt.where(data.c.city_id == city_id)
+    if start_date is not None:
+        stmt = stmt.where(data.c.date >= start_date)
+    if end_date is not None:
+        stmt = stmt.where(data.c.date <= end_date)
+    stmt = stmt.order_by(data.c.date, data.c.id)
+    result = db.execute(stmt, execution_options={'stream_results': True})
+    yield from result.yield_per(batch_size).partitions()
 
 
 def create_city_data(db: Session, data: schemas.CreateData, city_id: int):
     db_data = models.Data(**data.dict(), city_id=city_id)
     db.add(db_data)
+    rollups.apply_data_rows(db, [dict(data.dict(), city_id=city_id)])  # 汇总表和数据在同一个事务中提交
+    bump_version(db, 'data')
     db.commit()
     db.refresh(db_data)
-    return db_data
\ No newline at end of file
+    return db_data
+
+
+"""批量操作：不在每一行之后 commit 和 refresh，由调用方决定何时提交事务"""
+
+# 一次性查询多个省/直辖市对应的城市，返回 {province: schemas.ReadCity} 字典，不存在的城市不在字典中。
+# 先查缓存，缓存中没有的城市用一条 IN 查询查出来并放入缓存
+def get_cities_by_names(db: Session, names: Iterable[str]) -> Dict[str, schemas.ReadCity]:
+    cities = {}
+    missing = []
+    for name in set(names):
+        city = city_cache.get(name)
+        if city is None:
+            missing.append(name)
+        else:
+            cities[name] = city
+    if missing:
+        for db_city in db.query(models.City).filter(models.City.province.in_(missing)).all():
+            cities[db_city.province] = cache_city(db_city, db)
+    return cities
+
+
+# 一次性解析多个省/直辖市对应的城市 ID，返回 {province: city_id} 字典
+def get_city_ids_by_names(db: Session, names: Iterable[str]) -> Dict[str, int]:
+    return {name: city.id for name, city in get_cities_by_names(db, names).items()}
+
+
+# 按 (国家, 省/直辖市名称) 解析城市 ID，只返回名称和国家都匹配的城市，返回 {(country, province): city_id} 字典。
+# 不同国家可能有同名的省/州（例如 JHU 数据中的 Unknown），只按名称查询会把它们当成同一个城市
+def get_city_ids_by_keys(db: Session, keys: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], int]:
+    keys = set(keys)
+    cities = get_cities_by_names(db, (province for _, province in keys))
+    return {(city.country, city.province): city.id for city in cities.values() if (city.country, city.province) in keys}
+
+
+# cities 是字典列表，每个字典包含 City 表的各个字段；使用 Core 的 insert 和 executemany 一次插入多行。
+# 插入的城市在事务提交之前不放入城市缓存，见上面 cache_city 的说明
+def create_cities_bulk(db: Session, cities: List[dict]):
+    if cities:
+        db.info['uncommitted_cities'] = True
+        db.execute(models.City.__table__.insert(), cities)
+        bump_version(db, 'city')
+
+
+# 删除给定的 (city_id, date) 组合对应的数据，用于同步时以新数据替换旧数据
+def delete_city_data_bulk(db: Session, keys: Iterable[Tuple[int, date]]):
+    params = [{'b_city_id': city_id, 'b_date': day} for city_id, day in keys]
+    if params:
+        table = models.Data.__table__
+        # 先把要删除的行从汇总表中减掉
+        existing = db.execute(
+            select(table.c.city_id, table.c.date, table.c.confirmed, table.c.deaths, table.c.recovered)
+            .where(tuple_(table.c.city_id, table.c.date).in_([(p['b_city_id'], p['b_date']) for p in params]))
+        ).mappings().all()
+        rollups.apply_data_rows(db, [dict(row) for row in existing], sign=-1)
+        db.execute(
+            table.delete().where(and_(table.c.city_id == bindparam('b_city_id'), table.c.date == bindparam('b_date'))),
+            params
+        )
+        bump_version(db, 'data')
+
+
+# rows 是字典列表，每个字典包含 city_id、date、confirmed、deaths、recovered 字段，返回插入的行数
+def create_data_bulk(db: Session, rows: List[dict]) -> int:
+    if rows:
+        db.execute(models.Data.__table__.insert(), rows)
+        rollups.apply_data_rows(db, rows)
+        bump_version(db, 'data')
+    return len(rows)
+
+
+# rows 中的数据可以属于多个城市，同一个块内的城市只查询一次，插入后提交一次事务。
+# 返回 (插入的行数, 不存在的城市列表)，只要有不存在的城市，整个块都不会插入
+def create_city_data_chunk(db: Session, rows: List[schemas.CreateCityData]) -> Tuple[int, List[str]]:
+    city_ids = get_city_ids_by_names(db, (row.city for row in rows))
+    missing = sorted({row.city for row in rows} - city_ids.keys())
+    if missing:
+        return 0, missing
+    inserted = create_data_bulk(db, [dict(row.dict(exclude={'city'}), city_id=city_ids[row.city]) for row in rows])
+    db.commit()
+    return inserted, []
@@ -0,0 +1,59 @@
+"""以 CSV 或 NDJSON 格式流式导出 data 表"""
+
+import csv
+import io
+import json
+from datetime import date
+from typing import Iterator, Optional
+
+from coronavirus import crud
+from coronavirus.config import settings
+from coronavirus.database import SessionLocal
+
+COLUMNS = ('city', 'country', 'date', 'confirmed', 'deaths', 'recovered', 'updated_at')
+
+MEDIA_TYPES = {
+    'csv': 'text/csv',  # Starlette 会为 text/ 类型自动加上 charset=utf-8
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def _isoformat(value):
+    # date 和 datetime 在两种格式中都输出 ISO 8601（datetime 的日期和时间之间是 T），str(datetime) 用的是空格
+    return value.isoformat() if isinstance(value, date) else value
+
+
+def _csv_chunks(batches) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for rows in batches:
+        writer.writerows([_isoformat(value) for value in row] for row in rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _ndjson_chunks(batches) -> Iterator[bytes]:
+    for rows in batches:
+        yield ''.join(
+            json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False, default=_isoformat) + '\n' for row in rows
+        ).encode()
+
+
+def export_data(fmt: str, city_id: Optional[int] = None, start_date: Optional[date] = None,
+                end_date: Optional[date] = None) -> Iterator[bytes]:
+    """
+    生成导出文件的内容，每次返回一批行编码后的字节，交给 StreamingResponse 边查询边发送。
+    响应在路由函数返回之后才开始发送，所以这里自己创建和关闭会话，不使用 get_db 的会话
+    """
+    db = SessionLocal()
+    try:
+        batches = crud.iter_data_export(db, city_id=city_id, start_date=start_date, end_date=end_date,
+                                        batch_size=settings.export_batch_size)
+        chunks = _csv_chunks(batches) if fmt == 'csv' else _ndjson_chunks(batches)
+        yield from chunks
+    finally:
+        db.close()
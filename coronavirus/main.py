@@ -1,29 +1,49 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+import os
+import json
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response, BackgroundTasks
 from sqlalchemy.orm import Session
-from coronavirus import crud, schemas, models
-from coronavirus.database import engine, Base, SessionLocal
+from coronavirus import conditional, crud, export, rendering, schemas, models, rollups, sync
+from coronavirus.config import settings
+from coronavirus.sessions import LazySession, SessionRoute
+from coronavirus.serializers import FastJSONResponse, compile_serializer, serialize_many
+from coronavirus.database import SessionLocal
 from coronavirus.models import City, Data
-from typing import List
-from fastapi.templating import Jinja2Templates
+from typing import List, AsyncIterator, Tuple
+from datetime import date
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 
 """集成和使用我们之前创建的所有其他部分"""
 
-models.Base.metadata.create_all(bind=engine)
+# SessionRoute 记录依赖项解析和序列化的耗时（见 timing.py），并在发送响应之前关闭请求中用过的数据库会话（见 sessions.py）
+application = APIRouter(route_class=SessionRoute)
 
-application = APIRouter()
-
-templates = Jinja2Templates('./coronavirus/templates')
-
-# get_db: 该函数实现了一个数据库连接的上下文管理器，它返回一个通过 SessionLocal() 函数创建的本地数据库连接。
+# get_db: 该函数实现了一个数据库连接的上下文管理器，它返回一个本地数据库会话。
 # 在这个示例中，使用了 yield 关键字来创建一个 Python 生成器对象，以便在请求处理期间使用数据库连接。
 # 当请求处理完毕后，将自动关闭该数据库连接。
+# 返回的 LazySession 在第一次使用时才调用 SessionLocal() 创建会话，提前返回（例如城市缓存命中）的请求不会创建会话，
+# 用过的会话在路由处理完毕后由 SessionRoute 立即关闭，不必等到响应发送完毕
 def get_db():
-    db = SessionLocal()
+    db = LazySession(SessionLocal)
     try:
         yield db
     finally:
         db.close()
 
+
+# 建表、预热城市缓存和初始化汇总表的启动事件见 startup.py，由 run.py 注册到应用上，只启用异步路由时同样需要它们
+
+# 列表接口使用的序列化函数，字段与 response_model 中的 schema 一致
+serialize_city = compile_serializer(schemas.ReadCity)
+serialize_data = compile_serializer(schemas.ReadData)
+
+
+def set_next_cursor(response: Response, next_cursor: str = None):
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+
 """
 在 FastAPI 中，HTTP 请求体中的数据可以通过请求处理函数（decorated function）的参数来获取。
 当我们在请求处理函数的参数中声明了一个 Pydantic 模型（例如这里的 `city: schemas.CreateCity`），
@@ -45,21 +65,48 @@ def create_city(city:schemas.CreateCity, db: Session = Depends(get_db)):
     return crud.create_city(db=db, city=city)
 
 
+"""
+读接口支持条件 GET：先用一条聚合查询（或城市缓存）得到数据的版本，生成 ETag 和 Last-Modified，
+客户端带着 If-None-Match 或 If-Modified-Since 请求且数据没有变化时直接返回 304，不查询数据、不序列化、不渲染模板，见 conditional.py
+"""
+
 @application.get("/get_city/{city}", response_model=schemas.ReadCity)
-def get_city(city: str, db: Session = Depends(get_db)):
+def get_city(request: Request, response: Response, city: str, db: Session = Depends(get_db)):
     db_city = crud.get_city_by_name(db=db, name=city)
     if db_city is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="未找到该城市！")
+    etag, last_modified = conditional.validators(db_city.updated_at, 1)
+    if conditional.is_not_modified(request, etag, last_modified):
+        return conditional.not_modified(etag, last_modified)
+    conditional.set_validators(response, etag, last_modified)
     return db_city
 
 
+@application.get("/cache_stats")
+def cache_stats():
+    """城市缓存和 home.html 表格行片段缓存的大小和命中/未命中次数"""
+    return {"city": crud.city_cache.stats(), "home_fragment": rendering.fragment_cache.stats()}
+
+
 # response_model=List[schemas.ReadCity] 表示响应将是一个 List 类型，其中包含多个 ReadCity 类型的对象。
 # List 是一个 Python 内置的类，可以用于包含多个相同类型的对象。
 # 在这里，我们将 List 应用于 ReadCity 类型，因此响应将是一个 ReadCity 对象列表
-@application.get("/get_cities", response_model=List[schemas.ReadCity])
-def get_cities(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    cities = crud.get_cities(db=db, skip=skip, limit=limit)
-    return cities
+# 传入 cursor 参数时使用游标分页（空字符串表示第一页），下一页的游标放在响应头 X-Next-Cursor 中，没有下一页时不返回该响应头；
+# 不传 cursor 时仍然使用原来的 skip/limit 分页。
+# 直接返回 FastJSONResponse，跳过 response_model 的校验和 jsonable_encoder，见 serializers.py
+@application.get("/get_cities", response_model=List[schemas.ReadCity], response_class=FastJSONResponse)
+def get_cities(request: Request, skip: int = 0, limit: int = 10, cursor: str = None, db: Session = Depends(get_db)):
+    try:
+        etag, last_modified = conditional.validators(*crud.get_cities_version(db=db, skip=skip, limit=limit, cursor=cursor))
+        if conditional.is_not_modified(request, etag, last_modified):
+            return conditional.not_modified(etag, last_modified)
+        cities = crud.get_cities(db=db, skip=skip, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    response = conditional.set_validators(FastJSONResponse(serialize_many(serialize_city, cities)), etag, last_modified)
+    if cursor is not None:
+        set_next_cursor(response, crud.next_city_cursor(cities, limit))
+    return response
 
 
 @application.post("/create_data", response_model=schemas.ReadData)
@@ -71,17 +118,185 @@ def create_data_for_city(city: str, data: schemas.CreateData, db: Session = Depe
     return data
 
 
-@application.get("/get_data")
-def get_data(city: str = None, skip: int = 0, limit: int = Query(default=10, ge=1, le=100), db: Session = Depends(get_db)):
-    data = crud.get_data(db=db, city=city, skip=skip, limit=limit)
-    return data
+class BulkRowError(ValueError):
+    """请求体中某一行不是合法的 JSON，line 为出错的行号（从 1 开始），与整个请求体有关的错误为 None"""
+
+    def __init__(self, line, error):
+        super().__init__(str(error))
+        self.line = line
+
+
+async def iter_bulk_rows(request: Request) -> AsyncIterator[Tuple[int, dict]]:
+    """
+    按行返回请求体中的 (行号, 原始数据)：Content-Type 为 application/x-ndjson 时边接收边解析，行号是请求体中的行号（空行也计数），
+    否则按 JSON 数组解析，行号是数组中的第几个元素。行号都从 1 开始，JSON 格式错误时抛出带行号的 BulkRowError
+    """
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        buffer = b""
+        number = 0
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                number += 1
+                if line.strip():
+                    yield number, parse_bulk_line(number, line)
+        if buffer.strip():
+            yield number + 1, parse_bulk_line(number + 1, buffer)
+    else:
+        try:
+            rows = await request.json()
+        except ValueError as e:
+            raise BulkRowError(None, e)
+        if not isinstance(rows, list):
+            raise BulkRowError(None, "请求体必须是 JSON 数组")
+        for number, row in enumerate(rows, 1):
+            yield number, row
+
+
+def parse_bulk_line(number: int, line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        raise BulkRowError(number, e)
+
+
+# 批量新建数据：请求体可以是 JSON 数组，也可以是 NDJSON（每行一个 JSON 对象）。每一行可以用 city 字段指定所属的省/直辖市，
+# 没有指定时使用查询参数 city。每 bulk_chunk_size 行为一个块，每个块校验后在一个事务中批量插入，返回每个块插入的行数。
+# 数据库操作是同步的，使用 run_in_threadpool 放到线程池中执行，不阻塞事件循环。
+@application.post("/create_data/bulk", response_model=schemas.BulkCreateResult)
+async def create_data_bulk(request: Request, city: str = None, db: Session = Depends(get_db)):
+    chunks = []
+    rows = []
+
+    async def save(rows: List[schemas.CreateCityData]):
+        inserted, missing = await run_in_threadpool(crud.create_city_data_chunk, db, rows)
+        if missing:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail={
+                "message": "未找到该城市！", "cities": missing, "committed_chunks": chunks,
+            })
+        chunks.append({"chunk": len(chunks), "inserted": inserted})
+
+    line = None
+    try:
+        async for line, row in iter_bulk_rows(request):
+            if city is not None and isinstance(row, dict):
+                row.setdefault("city", city)
+            rows.append(schemas.CreateCityData.parse_obj(row))
+            if len(rows) >= settings.bulk_chunk_size:
+                await save(rows)
+                rows = []
+    except (ValueError, ValidationError) as e:  # BulkRowError 和 pydantic 的 ValidationError 都是 ValueError 的子类
+        if isinstance(e, BulkRowError):
+            line = e.line
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail={
+            "message": f"数据格式错误：{e}", "line": line, "committed_chunks": chunks,
+        })
+    if rows:
+        await save(rows)
+    return {"inserted": sum(c["inserted"] for c in chunks), "chunks": chunks}
+
+
+@application.get("/get_data", response_model=List[schemas.ReadData], response_class=FastJSONResponse)
+def get_data(request: Request, city: str = None, skip: int = 0, limit: int = Query(default=10, ge=1, le=100),
+             cursor: str = None, start_date: date = None, end_date: date = None, db: Session = Depends(get_db)):
+    try:
+        etag, last_modified = conditional.validators(*crud.get_data_version(
+            db=db, city=city, skip=skip, limit=limit, cursor=cursor, start_date=start_date, end_date=end_date))
+        if conditional.is_not_modified(request, etag, last_modified):
+            return conditional.not_modified(etag, last_modified)
+        # 返回的 JSON 中不包含城市信息，不需要加载 Data.city
+        data = crud.get_data(db=db, city=city, skip=skip, limit=limit, load='raise', cursor=cursor,
+                             start_date=start_date, end_date=end_date)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    response = conditional.set_validators(FastJSONResponse(serialize_many(serialize_data, data)), etag, last_modified)
+    if cursor is not None:
+        set_next_cursor(response, crud.next_data_cursor(data, limit))
+    return response
+
+
+# 以 CSV 或 NDJSON 格式导出数据，可以按城市和日期范围过滤。数据从数据库游标中按批读取并直接写入响应，
+# 不受 get_data 每次最多 100 行的限制，内存占用与导出的行数无关
+@application.get("/export")
+def export_data(format: str = Query(default="csv", regex="^(csv|ndjson)$"), city: str = None,
+                start_date: date = None, end_date: date = None, db: Session = Depends(get_db)):
+    city_id = None
+    if city:
+        db_city = crud.get_city_by_name(db, name=city)
+        if db_city is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="未找到该城市！")
+        city_id = db_city.id
+    return StreamingResponse(
+        export.export_data(format, city_id=city_id, start_date=start_date, end_date=end_date),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="coronavirus_data.{format}"'},
+    )
+
+
+"""统计接口：只读取汇总表，不扫描 data 表"""
+
+@application.get("/stats/global", response_model=List[schemas.ReadGlobalDailyStats])
+def global_stats(start_date: date = None, end_date: date = None, limit: int = Query(default=100, ge=1, le=1000),
+                 db: Session = Depends(get_db)):
+    return rollups.get_global_stats(db, start_date=start_date, end_date=end_date, limit=limit)
+
+
+# 某一天（默认最新一天）各个国家的数据，按确诊数量倒序
+@application.get("/stats/countries", response_model=List[schemas.ReadCountryDailyStats])
+def countries_stats(day: date = None, limit: int = Query(default=100, ge=1, le=1000), db: Session = Depends(get_db)):
+    return rollups.get_countries_stats(db, day=day, limit=limit)
+
+
+@application.get("/stats/countries/{country}", response_model=List[schemas.ReadCountryDailyStats])
+def country_stats(country: str, start_date: date = None, end_date: date = None,
+                  limit: int = Query(default=100, ge=1, le=1000), db: Session = Depends(get_db)):
+    return rollups.get_country_stats(db, country=country, start_date=start_date, end_date=end_date, limit=limit)
 
 
 @application.get('/')
-def coronavirus(request: Request, city: str = None, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    data = crud.get_data(db=db, city=city, skip=skip, limit=limit)
-    return templates.TemplateResponse("home.html", {
+def coronavirus(request: Request, city: str = None, skip: int = 0, limit: int = Query(default=100, ge=1, le=1000),
+                start_date: date = None, end_date: date = None, db: Session = Depends(get_db)):
+    version = crud.get_data_version(db=db, city=city, skip=skip, limit=limit, start_date=start_date, end_date=end_date)
+    etag, last_modified = conditional.validators(*version)
+    if conditional.is_not_modified(request, etag, last_modified):
+        return conditional.not_modified(etag, last_modified)
+    context = {
         "request": request,
-        "data": data,
         "sync_data_url": "/coronavirus/sync_coronavirus_data/jhu"
-    })
\ No newline at end of file
+    }
+    # version 中包含 data 表的版本号，任何写入（包括同步和批量新建）之后都不会再命中旧的片段
+    key = (city, skip, limit, start_date, end_date, *version)
+    rows = rendering.fragment_cache.get(key)
+    if rows is not None:
+        # 片段缓存命中，不需要查询数据，也不需要渲染表格行
+        context["rows"] = [rows]
+        response = rendering.template_response("home.html", context)
+        return conditional.set_validators(response, etag, last_modified)
+
+    # home.html 中每一行都会访问 d.city.province，用 JOIN 一次性加载城市，避免 N+1 查询
+    data = crud.get_data(db=db, city=city, skip=skip, limit=limit, load='joined', start_date=start_date, end_date=end_date)
+    context["rows"] = rendering.render_rows(data, key)
+    if len(data) >= settings.home_stream_min_rows:
+        response = rendering.stream_template("home.html", context)
+    else:
+        response = rendering.template_response("home.html", context)
+    return conditional.set_validators(response, etag, last_modified)
+
+
+def bg_task(path: str):
+    """这里注意一个坑，不要在后台任务的参数中 db: Session = Depends(get_db) 这样导入依赖，后台任务需要自己创建和关闭会话"""
+    db = SessionLocal()
+    try:
+        sync.sync_jhu_data(db=db, path=path, batch_size=settings.sync_batch_size)
+    finally:
+        db.close()
+
+
+@application.get("/sync_coronavirus_data/jhu")
+def sync_coronavirus_data(background_tasks: BackgroundTasks):
+    """从本地 JHU 格式的 CSV 文件（单个每日报告文件或目录）同步新冠病毒疫情数据"""
+    if not os.path.exists(settings.jhu_data_path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="未找到 JHU 数据文件！")
+    background_tasks.add_task(bg_task, settings.jhu_data_path)
+    return {"message": "正在后台同步数据..."}
@@ -0,0 +1,325 @@
+"""进程内的指标注册表，以 Prometheus 文本格式通过 /metrics 暴露，不依赖任何外部服务"""
+
+import abc
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import anyio
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+"""
+热路径上不加锁：每个线程把观测值累加到自己的分片（threading.local）上，只有第一次在某个线程中使用时才加锁登记分片，
+抓取 /metrics 时再把所有分片加起来。路由函数运行在线程池的多个线程中，中间件运行在事件循环线程中，彼此不会竞争同一个分片。
+
+暴露的指标：
+    http_request_duration_seconds：按路由模板、方法和状态码统计的请求耗时直方图（直到响应体发送完毕）
+    http_requests_in_flight：正在处理的请求数
+    threadpool_*：同步路由和依赖项使用的线程池（anyio 默认限流器）的容量、占用数和排队数
+    db_pool_*：SQLAlchemy 连接池的连接数、取得连接的等待时间和连接被占用的时间
+    db_sessions_total：get_db 提供的会话按结果计数：从未使用、提前归还连接、到清理时才关闭，见 sessions.py
+    cache_*：城市缓存和 home.html 片段缓存的大小和命中率
+"""
+
+# 请求耗时直方图的桶（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 连接池等待/占用时间直方图的桶（秒）
+POOL_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Sharded(abc.ABC):
+    """
+    每个线程一个分片（标签值 -> 累加值），只有登记新分片时加锁。
+    anyio 的工作线程空闲一段时间后会退出，之后再创建新线程，所以登记新分片和抓取时都会把已经退出的线程的分片
+    合并到 _base 中再删除，分片的数量不超过存活的线程数。
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: List[Tuple[threading.Thread, dict]] = []
+        self._base: dict = {}
+        self._lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire_dead()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_dead(self):
+        # 调用方持有 _lock；线程已经退出，不会再修改它的分片
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                self._merge(self._base, shard)
+        self._shards = alive
+
+    @abc.abstractmethod
+    def _merge(self, totals: dict, shard: dict):
+        """把一个分片中的值累加到 totals 上，由 Counter 和 Histogram 按各自的值的格式实现"""
+
+    def _totals(self) -> dict:
+        with self._lock:
+            self._retire_dead()
+            shards = [shard for _, shard in self._shards]
+            totals: dict = {}
+            self._merge(totals, self._base)
+        # 其他线程可能正在往自己的分片中插入新的标签值，先复制一份再合并
+        for shard in shards:
+            self._merge(totals, dict(shard))
+        return totals
+
+
+class Counter(_Sharded):
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__()
+        self.name, self.documentation, self.labelnames = name, documentation, labelnames
+
+    def inc(self, *labels, amount: float = 1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge(self, totals: dict, shard: dict):
+        for labels, value in shard.items():
+            totals[labels] = totals.get(labels, 0) + value
+
+    def collect(self) -> Iterator[str]:
+        totals = self._totals()
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in sorted(totals.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+
+
+class Histogram(_Sharded):
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__()
+        self.name, self.documentation, self.labelnames = name, documentation, labelnames
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        shard = self._shard()
+        # 每个标签值对应 [各个桶的计数..., +Inf 的计数, 总和]，桶的计数不是累计的，输出时再累加
+        series = shard.get(labels)
+        if series is None:
+            series = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def _merge(self, totals: dict, shard: dict):
+        for labels, series in shard.items():
+            total = totals.setdefault(labels, [0] * len(series))
+            for i, value in enumerate(series):
+                total[i] += value
+
+    def collect(self) -> Iterator[str]:
+        totals = self._totals()
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, series in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(series[-1])}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}'
+
+
+class Gauge:
+    """抓取时才调用 function 计算当前值，function 返回 [(标签值, 数值), ...]"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...], function: Callable[[], list]):
+        self.name, self.documentation, self.labelnames, self.function = name, documentation, labelnames, function
+
+    def collect(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} gauge'
+        for labels, value in self.function():
+            yield f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def exposition(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUEST_DURATION = registry.register(Histogram(
+    'http_request_duration_seconds', '请求处理耗时（秒）', ('route', 'method', 'status')))
+# 正在处理的请求数只在事件循环线程中增减，不需要分片
+_in_flight = [0]
+registry.register(Gauge('http_requests_in_flight', '正在处理的请求数', (), lambda: [((), _in_flight[0])]))
+
+POOL_WAIT = registry.register(Histogram(
+    'db_pool_checkout_wait_seconds', '从连接池取得连接的等待时间（秒），包括新建连接的时间', ('engine',), POOL_BUCKETS))
+POOL_HOLD = registry.register(Histogram(
+    'db_pool_checkout_duration_seconds', '连接从取出到归还连接池的占用时间（秒）', ('engine',), POOL_BUCKETS))
+POOL_TIMEOUTS = registry.register(Counter('db_pool_checkout_errors_total', '取得连接失败（例如等待超时）的次数', ('engine',)))
+DB_SESSIONS = registry.register(Counter(
+    'db_sessions_total', 'get_db 提供的会话数量，outcome 为 unused、released_early 或 teardown', ('outcome',)))
+
+
+def _threadpool_stats() -> list:
+    # anyio 的默认限流器决定了 run_in_threadpool 的最大并发数（默认 40），必须在事件循环中读取
+    try:
+        limiter = anyio.to_thread.current_default_thread_limiter()
+    except RuntimeError:
+        return []
+    statistics = limiter.statistics()
+    return [
+        (('capacity',), limiter.total_tokens),
+        (('busy',), statistics.borrowed_tokens),
+        (('waiting',), statistics.tasks_waiting),
+    ]
+
+
+registry.register(Gauge('threadpool_threads', '线程池的容量（capacity）、占用数（busy）和排队等待的任务数（waiting）',
+                        ('state',), _threadpool_stats))
+
+
+_engines = {}
+_caches = {}
+
+
+def _pool_stats() -> list:
+    stats = []
+    for name, engine in _engines.items():
+        # NullPool 等连接池没有 size、overflow 等方法
+        for state in ('size', 'checkedin', 'checkedout', 'overflow'):
+            method = getattr(engine.pool, state, None)
+            if method is not None:
+                stats.append(((name, state), method()))
+    return stats
+
+
+def _cache_stats() -> list:
+    stats = []
+    for name, cache in _caches.items():
+        values = cache.stats()
+        stats.extend(((name, key), values[key]) for key in ('size', 'maxsize', 'hits', 'misses', 'hit_ratio'))
+    return stats
+
+
+registry.register(Gauge('db_pool_connections', '连接池的大小（size）、空闲（checkedin）、已取出（checkedout）和溢出（overflow）的连接数',
+                        ('engine', 'state'), _pool_stats))
+registry.register(Gauge('cache_stats', '缓存的大小、最大条目数、命中次数、未命中次数和命中率', ('cache', 'stat'), _cache_stats))
+
+
+def route_name(scope: Scope) -> str:
+    """用路由模板（例如 /coronavirus/get_city/{city}）而不是实际路径作为标签，避免标签值无限增长"""
+    route = scope.get('route')
+    if route is not None:
+        return getattr(route, 'path_format', None) or route.path
+    # 挂载的应用（例如静态文件）没有 route，使用挂载路径
+    root_path = scope.get('root_path', '')
+    app_root = scope.get('app_root_path', '')
+    if root_path and root_path != app_root:
+        return root_path[len(app_root):] + '/{path}'
+    return '<unmatched>'
+
+
+class MetricsMiddleware:
+    """纯 ASGI 中间件，记录每个请求的耗时和状态码，以及正在处理的请求数"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter_ns()
+        status_code = [500]
+
+        async def send_with_status(message: Message):
+            if message['type'] == 'http.response.start':
+                status_code[0] = message['status']
+            await send(message)
+
+        _in_flight[0] += 1
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _in_flight[0] -= 1
+            REQUEST_DURATION.observe((time.perf_counter_ns() - start) / 1e9,
+                                     route_name(scope), scope['method'], str(status_code[0]))
+
+
+def instrument_engine(engine, name: str):
+    """记录连接池的等待时间和占用时间，并把连接池的状态加入 db_pool_connections"""
+    from sqlalchemy import event
+
+    pool = engine.pool
+    connect = pool.connect
+
+    # 连接池没有“开始等待”的事件，所以包装 pool.connect，engine.dispose() 重建连接池后需要重新调用本函数
+    def timed_connect():
+        start = time.perf_counter_ns()
+        try:
+            return connect()
+        except Exception:
+            POOL_TIMEOUTS.inc(name)
+            raise
+        finally:
+            POOL_WAIT.observe((time.perf_counter_ns() - start) / 1e9, name)
+
+    pool.connect = timed_connect
+
+    @event.listens_for(pool, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info['checkout_ns'] = time.perf_counter_ns()
+
+    @event.listens_for(pool, 'checkin')
+    def on_checkin(dbapi_connection, connection_record):
+        start = connection_record.info.pop('checkout_ns', None)
+        if start is not None:
+            POOL_HOLD.observe((time.perf_counter_ns() - start) / 1e9, name)
+
+    _engines[name] = engine
+
+
+def register_cache(name: str, cache):
+    """把 cache.LRUCache 的统计信息加入 cache_stats"""
+    _caches[name] = cache
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(registry.exposition(), media_type='text/plain; version=0.0.4')
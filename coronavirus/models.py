@@ -1,4 +1,4 @@
-from sqlalchemy import Column, ForeignKey, Integer, BigInteger, String, DateTime, Date,func
+from sqlalchemy import Column, ForeignKey, Integer, BigInteger, String, DateTime, Date, Index, func
 from sqlalchemy.orm import relationship
 
 from .database import Base
@@ -22,6 +22,13 @@ class Data(Base):
     # 获取到这张表的数据让其能够排序
     # __mapper_args__ = {"order_by": date.desc()} # 倒序则加上.desc()方法
 
+    # (date, id) 联合索引，用于按日期的游标分页：WHERE (date, id) > (?, ?) ORDER BY date, id
+    # (city_id, date) 联合索引，用于查询某个城市一段时间内的数据：WHERE city_id = ? AND date BETWEEN ? AND ? ORDER BY date
+    __table_args__ = (
+        Index('ix_data_date_id', 'date', 'id'),
+        Index('ix_data_city_id_date', 'city_id', 'date'),
+    )
+
     def __repr__(self):
         return f'{repr(self.date)}: 确诊{self.confirmed}'
         # return f'{self.country}_{self.province}'
@@ -49,6 +56,53 @@ class City(Base):
         return f'{self.country}_{self.province}'
 
 
+
+"""
+汇总表：由 coronavirus/rollups.py 在通过 crud 写入 Data 时增量维护，/coronavirus/stats/... 接口只读取这两张表，
+不需要对 data 表做 GROUP BY，查询耗时与 data 表的大小无关。
+"""
+
+# 每个国家每天的累计确诊、死亡、痊愈数量（该国家所有省/直辖市当天数据之和）
+class CountryDailyStats(Base):
+    __tablename__ = 'country_daily_stats'
+
+    country = Column(String(100), primary_key=True, comment='国家')
+    date = Column(Date, primary_key=True, comment='数据日期')
+    confirmed = Column(BigInteger, default=0, nullable=False, comment='确诊数量')
+    deaths = Column(BigInteger, default=0, nullable=False, comment='死亡数量')
+    recovered = Column(BigInteger, default=0, nullable=False, comment='痊愈数量')
+
+    def __repr__(self):
+        return f'{self.country}_{repr(self.date)}: 确诊{self.confirmed}'
+
+
+# 全球每天的累计确诊、死亡、痊愈数量
+class GlobalDailyStats(Base):
+    __tablename__ = 'global_daily_stats'
+
+    date = Column(Date, primary_key=True, comment='数据日期')
+    confirmed = Column(BigInteger, default=0, nullable=False, comment='确诊数量')
+    deaths = Column(BigInteger, default=0, nullable=False, comment='死亡数量')
+    recovered = Column(BigInteger, default=0, nullable=False, comment='痊愈数量')
+
+    def __repr__(self):
+        return f'{repr(self.date)}: 确诊{self.confirmed}'
+
+"""
+数据版本：通过 crud 写入 data 或 city 表时，在同一个事务中把对应表的版本号加一。条件 GET 的 ETag 和 home.html 的表格行片段缓存
+都带上这个版本号，同一秒内的多次写入（updated_at 只精确到秒）、替换窗口内的行而行数不变的写入，也会得到不同的 ETag。
+"""
+
+class TableVersion(Base):
+    __tablename__ = 'table_version'
+
+    name = Column(String(100), primary_key=True, comment='表名')
+    version = Column(BigInteger, default=0, nullable=False, comment='版本号，每次写入加一')
+
+    def __repr__(self):
+        return f'{self.name}: {self.version}'
+
+
 """
 在Python中，__repr__方法是一个特殊方法，用于返回一个对象的字符串表示形式。这个方法会在调用内置函数repr()时自动调用。它通常返回一个可打印的字符串，表示当前对象的属性值。
 
@@ -0,0 +1,185 @@
+"""按需的请求性能分析：抽样或指定的请求用 cProfile 记录调用树，保存为 .prof 文件"""
+
+import cProfile
+import json
+import pstats
+import random
+import secrets
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+import anyio
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.responses import FileResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from coronavirus.config import settings
+from coronavirus.metrics import route_name
+
+"""
+默认关闭，设置以下环境变量后启用：
+    CORONAVIRUS_PROFILING_ENABLED=true
+    CORONAVIRUS_PROFILING_TOKEN=<管理员令牌>
+    CORONAVIRUS_PROFILING_SAMPLE_RATE=0.01（可选，按比例随机抽样，默认 0 即不抽样）
+带有请求头 X-Profile: <管理员令牌> 的请求一定会被分析，响应头 X-Profile-Id 是保存的文件名。
+
+分析结果保存在 CORONAVIRUS_PROFILING_DIR 目录下，每个请求一个 .prof 文件，index.jsonl 中记录了文件名、路由、状态码和耗时：
+    GET /admin/profiles（请求头 X-Admin-Token: <管理员令牌>）列出最近的分析结果
+    GET /admin/profiles/{profile_id} 下载 .prof 文件，可以用 python -m pstats、snakeviz 或 flameprof 查看（后两者需要单独安装）
+
+cProfile 只记录启用它的线程：中间件在事件循环线程中启用一个分析器，同步路由函数在线程池中执行时，
+TimedRoute 通过 profile_thread() 在工作线程中再启用一个，请求结束时把两者合并。
+同一时间只分析一个请求，事件循环线程中的分析器也会记录到同时处理的其他异步请求，所以抽样比例不宜过大。
+"""
+
+# 同时只分析一个请求，正在分析时其他请求不会被抽中
+_busy = threading.Lock()
+_index_lock = threading.Lock()
+
+# 当前请求的分析器列表，线程池中的工作线程通过它找到当前请求
+active_profile: ContextVar = ContextVar('active_profile', default=None)
+
+
+class RequestProfile:
+    def __init__(self):
+        self.id = f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}'
+        self.profilers: List[cProfile.Profile] = []
+        self.lock = threading.Lock()
+
+    def add(self, profiler: cProfile.Profile):
+        with self.lock:
+            self.profilers.append(profiler)
+
+
+@contextmanager
+def profile_thread() -> Iterator[None]:
+    """在线程池的工作线程中分析当前请求，当前请求没有被选中分析时什么也不做"""
+    profile = active_profile.get()
+    if profile is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12 以后 cProfile 基于 sys.monitoring，事件循环线程中的分析器已经覆盖了所有线程
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profile.add(profiler)
+
+
+def profile_dir() -> Path:
+    return Path(settings.profiling_dir)
+
+
+def _authorized(token: Optional[str]) -> bool:
+    return bool(settings.profiling_token) and token is not None and secrets.compare_digest(token, settings.profiling_token)
+
+
+def _header(scope: Scope, name: bytes) -> Optional[str]:
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def save(profile: RequestProfile, entry: dict):
+    """合并各个线程的分析结果，写入 .prof 文件并追加到 index.jsonl，在线程池中执行"""
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    stats = pstats.Stats(profile.profilers[0])
+    for profiler in profile.profilers[1:]:
+        stats.add(profiler)
+    stats.dump_stats(str(directory / f'{profile.id}.prof'))
+    with _index_lock, open(directory / 'index.jsonl', 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+class ProfilingMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    def _selected(self, scope: Scope) -> bool:
+        requested = _header(scope, b'x-profile')
+        if requested is not None:
+            return _authorized(requested)
+        return settings.profiling_sample_rate > 0 and random.random() < settings.profiling_sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http' or not settings.profiling_enabled or not self._selected(scope):
+            await self.app(scope, receive, send)
+            return
+        if not _busy.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile()
+        status_code = [500]
+
+        async def send_with_profile_id(message: Message):
+            if message['type'] == 'http.response.start':
+                status_code[0] = message['status']
+                message = {**message, 'headers': list(message.get('headers', [])) + [(b'x-profile-id', profile.id.encode())]}
+            await send(message)
+
+        profiler = cProfile.Profile()
+        token = active_profile.set(profile)
+        start = time.perf_counter_ns()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.disable()
+            duration_ms = (time.perf_counter_ns() - start) / 1e6
+            active_profile.reset(token)
+            _busy.release()
+            profile.add(profiler)
+            entry = {
+                'id': profile.id,
+                'method': scope['method'],
+                'route': route_name(scope),
+                'path': scope['path'],
+                'status': status_code[0],
+                'duration_ms': round(duration_ms, 3),
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            }
+            await anyio.to_thread.run_sync(save, profile, entry)
+
+
+def require_admin_token(x_admin_token: Optional[str] = Header(None)):
+    if not settings.profiling_enabled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='未启用性能分析')
+    if not _authorized(x_admin_token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='管理员令牌错误')
+
+
+profiling_application = APIRouter(dependencies=[Depends(require_admin_token)])
+
+
+@profiling_application.get('/')
+def list_profiles(limit: int = Query(default=100, ge=1, le=1000)):
+    """最近的分析结果，最新的在前"""
+    index = profile_dir() / 'index.jsonl'
+    if not index.exists():
+        return []
+    with open(index, encoding='utf-8') as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    return entries[::-1][:limit]
+
+
+@profiling_application.get('/{profile_id}')
+def get_profile(profile_id: str):
+    path = profile_dir() / f'{profile_id}.prof'
+    # profile_id 只能是文件名，不能包含路径
+    if path.parent != profile_dir() or not path.is_file():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='未找到该分析结果')
+    return FileResponse(path, media_type='application/octet-stream', filename=path.name)
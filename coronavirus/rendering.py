@@ -0,0 +1,65 @@
+"""home.html 页面的渲染：表格行片段缓存和大页面的流式输出"""
+
+from typing import Iterable, Iterator, List
+
+from fastapi.templating import Jinja2Templates
+from markupsafe import Markup
+from starlette.responses import StreamingResponse
+
+from coronavirus import timing
+from coronavirus.assets import static_url
+from coronavirus.cache import LRUCache
+from coronavirus.config import BASE_DIR, settings
+
+"""
+页面中最耗时的是表格行的渲染，所以把 <tbody> 中的行拆成单独的模板 _data_rows.html：
+    1、渲染好的行片段按 (city, skip, limit, start_date, end_date, 数据版本) 缓存，数据版本是条件 GET 查询的
+       (max(updated_at), 行数, data 表的版本号)，每次写入 data 表版本号都会加一（见 models.TableVersion），
+       旧的片段不会再被命中，最终被 LRU 淘汰；命中缓存时不需要查询数据，也不需要渲染行；
+    2、行数不少于 settings.home_stream_min_rows 的页面通过模板的 generate() 流式输出，
+       页面头部和已经渲染好的行先发送给客户端，不必等整个表格渲染完，渲染结束后再把行片段放入缓存。
+"""
+
+templates = Jinja2Templates(str(BASE_DIR / 'templates'))
+# 模板中用 static_url(...) 生成带内容哈希的静态文件 URL，见 assets.py
+templates.env.globals['static_url'] = static_url
+
+fragment_cache = LRUCache(settings.home_fragment_cache_size)
+
+# 流式输出时攒够这么多字符再发送一次，避免 Jinja 的每个小片段都变成一次 ASGI 消息
+STREAM_BUFFER_SIZE = 16 * 1024
+
+
+def template_response(name: str, context: dict):
+    """TemplateResponse 在创建时就渲染整个模板，渲染时间计入 Server-Timing 的 template 阶段"""
+    with timing.phase('template'):
+        return templates.TemplateResponse(name, context)
+
+
+def render_rows(data: list, key) -> Iterator[Markup]:
+    """边渲染边返回表格行，全部渲染完之后放入片段缓存"""
+    parts: List[str] = []
+    for part in templates.get_template('_data_rows.html').generate(data=data):
+        parts.append(part)
+        # generate() 返回的已经是转义过的 HTML，用 Markup 包装，避免在 home.html 中被再次转义
+        yield Markup(part)
+    fragment_cache.put(key, Markup(''.join(parts)))
+
+
+def _buffered(chunks: Iterable[str], size: int = STREAM_BUFFER_SIZE) -> Iterator[bytes]:
+    buffer: List[str] = []
+    length = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffer).encode('utf-8')
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def stream_template(name: str, context: dict) -> StreamingResponse:
+    """与 TemplateResponse 相同的模板和上下文，但通过 generate() 分块发送"""
+    chunks = templates.get_template(name).generate(context)
+    return StreamingResponse(_buffered(chunks), media_type='text/html; charset=utf-8')
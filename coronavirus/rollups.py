@@ -0,0 +1,147 @@
+"""增量维护国家每日汇总表和全球每日汇总表"""
+
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+from datetime import date
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import Session
+
+from coronavirus import models
+
+"""
+Data 中每一行是某个省/直辖市某一天的累计数量，国家（全球）某一天的累计数量就是它下面所有省/直辖市当天数据之和。
+通过 crud 插入 Data 时，把新行的数量按 (国家, 日期) 和 日期 累加到汇总表上；同步时替换旧数据，先把旧行的数量减掉。
+汇总表的更新和 Data 的写入在同一个事务中提交，两者始终一致。如果直接修改了数据库，可以用下面的命令重建汇总表：
+
+    python -m coronavirus.rollups rebuild
+"""
+
+# 多行 VALUES 的 INSERT 每条语句包含的最大行数，避免超过 SQLite 单条语句的参数个数限制
+UPSERT_CHUNK_SIZE = 500
+
+COUNTS = ('confirmed', 'deaths', 'recovered')
+
+
+def _insert(db: Session, table):
+    """根据数据库选择支持 ON CONFLICT DO UPDATE 的 insert，SQLite 和 PostgreSQL 的用法相同"""
+    if db.bind.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(table)
+
+
+def _upsert(db: Session, model, keys: Tuple[str, ...], rows: List[dict]):
+    """把 rows 中的数量累加到汇总表上，不存在的行会被插入"""
+    table = model.__table__
+    for i in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        stmt = _insert(db, table).values(rows[i:i + UPSERT_CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={name: table.c[name] + stmt.excluded[name] for name in COUNTS},
+        )
+        db.execute(stmt)
+
+
+def _city_countries(db: Session, city_ids: Iterable[int]) -> Dict[int, str]:
+    city_ids = set(city_ids)
+    if not city_ids:
+        return {}
+    return dict(db.execute(select(models.City.id, models.City.country).where(models.City.id.in_(city_ids))).all())
+
+
+def apply_data_rows(db: Session, rows: List[dict], sign: int = 1):
+    """
+    rows 是 Data 行的字典列表（包含 city_id、date、confirmed、deaths、recovered），
+    sign=1 表示这些行被插入，sign=-1 表示这些行被删除。不会提交事务，由调用方和 Data 的写入一起提交
+    """
+    if not rows:
+        return
+    countries = _city_countries(db, (row['city_id'] for row in rows))
+    by_country = defaultdict(lambda: [0, 0, 0])
+    by_date = defaultdict(lambda: [0, 0, 0])
+    for row in rows:
+        for totals in (by_country[countries[row['city_id']], row['date']], by_date[row['date']]):
+            for i, name in enumerate(COUNTS):
+                totals[i] += sign * (row.get(name) or 0)
+
+    _upsert(db, models.CountryDailyStats, ('country', 'date'), [
+        dict(country=country, date=day, **dict(zip(COUNTS, totals))) for (country, day), totals in by_country.items()
+    ])
+    _upsert(db, models.GlobalDailyStats, ('date',), [
+        dict(date=day, **dict(zip(COUNTS, totals))) for day, totals in by_date.items()
+    ])
+
+
+def rebuild(db: Session):
+    """清空并根据 data 表重新计算汇总表"""
+    data, city = models.Data.__table__, models.City.__table__
+    sums = [func.sum(data.c[name]) for name in COUNTS]
+    db.execute(models.CountryDailyStats.__table__.delete())
+    db.execute(models.GlobalDailyStats.__table__.delete())
+    db.execute(insert(models.CountryDailyStats.__table__).from_select(
+        ['country', 'date', *COUNTS],
+        select(city.c.country, data.c.date, *sums).select_from(data.join(city)).group_by(city.c.country, data.c.date),
+    ))
+    db.execute(insert(models.GlobalDailyStats.__table__).from_select(
+        ['date', *COUNTS],
+        select(data.c.date, *sums).group_by(data.c.date),
+    ))
+    db.commit()
+
+
+def rebuild_if_empty(db: Session) -> bool:
+    """汇总表为空而 data 表有数据时（例如新建汇总表之后第一次启动）重建汇总表"""
+    if db.execute(select(models.GlobalDailyStats.date).limit(1)).first() is not None:
+        return False
+    if db.execute(select(models.Data.id).limit(1)).first() is None:
+        return False
+    rebuild(db)
+    return True
+
+
+# 汇总表的查询，/coronavirus/stats/... 接口使用
+def get_global_stats(db: Session, start_date: date = None, end_date: date = None, limit: int = 100):
+    stmt = select(models.GlobalDailyStats)
+    if start_date is not None:
+        stmt = stmt.where(models.GlobalDailyStats.date >= start_date)
+    if end_date is not None:
+        stmt = stmt.where(models.GlobalDailyStats.date <= end_date)
+    return db.execute(stmt.order_by(models.GlobalDailyStats.date).limit(limit)).scalars().all()
+
+
+def get_country_stats(db: Session, country: str, start_date: date = None, end_date: date = None, limit: int = 100):
+    stmt = select(models.CountryDailyStats).where(models.CountryDailyStats.country == country)
+    if start_date is not None:
+        stmt = stmt.where(models.CountryDailyStats.date >= start_date)
+    if end_date is not None:
+        stmt = stmt.where(models.CountryDailyStats.date <= end_date)
+    return db.execute(stmt.order_by(models.CountryDailyStats.date).limit(limit)).scalars().all()
+
+
+# 某一天所有国家的数据，day 为空时取最新的一天
+def get_countries_stats(db: Session, day: date = None, limit: int = 100):
+    if day is None:
+        day = db.execute(select(func.max(models.GlobalDailyStats.date))).scalar()
+        if day is None:
+            return []
+    stmt = select(models.CountryDailyStats).where(models.CountryDailyStats.date == day)
+    return db.execute(stmt.order_by(models.CountryDailyStats.confirmed.desc()).limit(limit)).scalars().all()
+
+
+if __name__ == '__main__':
+    import argparse
+    from coronavirus import schema
+    from coronavirus.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description='维护新冠病毒疫情数据的汇总表')
+    parser.add_argument('command', choices=['rebuild'], help='rebuild：根据 data 表重建汇总表')
+    parser.parse_args()
+
+    schema.create_schema()
+    session = SessionLocal()
+    try:
+        rebuild(session)
+    finally:
+        session.close()
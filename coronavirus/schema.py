@@ -0,0 +1,28 @@
+"""创建数据库的表和索引：不在导入 main.py 时执行，由应用的启动事件或部署时的命令行显式执行"""
+
+from sqlalchemy.engine import Engine
+
+from coronavirus import models
+from coronavirus.database import engine as default_engine
+
+"""
+原来 main.py 在导入时就执行 create_all，每个 worker、每次 reload 都要先连接数据库并检查所有的表和索引，
+导入 main.py 的脚本和基准测试也会因此修改数据库。现在：
+    1、CORONAVIRUS_SCHEMA_AUTO_CREATE=true（默认）时，由 main.py 的 startup 事件在第一个启动事件中执行，方便开发；
+    2、生产环境多个 worker 同时启动时，建议设为 false，在部署时先执行一次：
+
+    python -m coronavirus.schema
+"""
+
+
+def create_schema(bind: Engine = default_engine):
+    models.Base.metadata.create_all(bind=bind)
+    # create_all 只会创建不存在的表，已存在的表上新增的索引需要单独创建
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+
+if __name__ == '__main__':
+    create_schema()
+    print(f'已创建 {default_engine.url.render_as_string(hide_password=True)} 中缺少的表和索引')
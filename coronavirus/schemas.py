@@ -1,6 +1,7 @@
 from pydantic import BaseModel
 from datetime import date as date_
 from datetime import datetime
+from typing import List
 
 """建立与模型类对应的数据格式类"""
 
@@ -35,4 +36,41 @@ class ReadCity(CreateCity):
     created_at: datetime
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+
+# 批量新建数据时每一行的输入格式，比 CreateData 多了所属的省/直辖市
+class CreateCityData(CreateData):
+    city: str
+
+# 批量新建数据时每个块（一个事务）的处理结果
+class BulkChunkResult(BaseModel):
+    chunk: int
+    inserted: int
+
+# 批量新建数据的返回格式，只返回数量，不返回插入的数据
+class BulkCreateResult(BaseModel):
+    inserted: int
+    chunks: List[BulkChunkResult]
+
+
+# 国家每日汇总数据的返回格式
+class ReadCountryDailyStats(BaseModel):
+    country: str
+    date: date_
+    confirmed: int
+    deaths: int
+    recovered: int
+
+    class Config:
+        orm_mode = True
+
+# 全球每日汇总数据的返回格式
+class ReadGlobalDailyStats(BaseModel):
+    date: date_
+    confirmed: int
+    deaths: int
+    recovered: int
+
+    class Config:
+        orm_mode = True
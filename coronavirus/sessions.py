@@ -0,0 +1,104 @@
+"""按需创建的数据库会话：第一次使用时才创建 Session，路由处理完毕后、发送响应之前就归还连接"""
+
+from contextvars import ContextVar
+from typing import Callable, List, Optional
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from coronavirus import metrics
+from coronavirus.timing import TimedRoute
+
+"""
+依赖 get_db 的路由每个请求都会创建一个 Session，即使路由函数提前返回（城市缓存命中、条件 GET 返回 304、参数校验失败）；
+而 yield 依赖项的清理代码要等响应发送完毕才执行，在这之前会话一直占着连接池中的连接，流式响应、慢客户端会让占用时间更长。
+
+    1、LazySession 是 Session 的代理，访问它的任意属性（query、execute、add 等）时才创建真正的 Session，从未使用就不会创建；
+    2、SessionRoute 在路由处理函数返回响应（路由函数已执行完、响应已序列化）之后、发送响应之前，关闭本次请求中已创建的会话，
+       把连接还给连接池，yield 依赖项的清理代码里再次 close() 什么也不做；
+    3、每个会话在清理时按结果计数（db_sessions_total）：unused 表示从未使用，released_early 表示由 SessionRoute 提前关闭，
+       teardown 表示到清理时才关闭（没有使用 SessionRoute 的路由，或提前关闭之后又被使用）。
+
+注意：提前关闭之后，会话加载的对象都处于分离（detached）状态，已加载的属性可以正常读取，但不能再懒加载关系或过期的属性，
+所以路由函数返回的 ORM 对象在序列化时用到的属性必须已经加载好，流式响应的生成器也不能再通过请求的会话查询数据库。
+"""
+
+# 本次请求中创建的 LazySession，由 SessionRoute 放入一个列表，get_db 在线程池中执行时拿到的是同一个列表对象
+request_sessions: ContextVar = ContextVar('request_sessions', default=None)
+
+
+class LazySession:
+    def __init__(self, factory: Callable[[], Session]):
+        self._factory = factory
+        self._session: Optional[Session] = None
+        self._released = False
+        self._closed = False
+        sessions = request_sessions.get()
+        if sessions is not None:
+            sessions.append(self)
+
+    @property
+    def opened(self) -> bool:
+        return self._session is not None
+
+    @property
+    def session(self) -> Session:
+        if self._session is None:
+            self._session = self._factory()
+        return self._session
+
+    def __getattr__(self, name):
+        # 只有 LazySession 自身没有的属性才会走到这里，即 Session 的方法和属性
+        return getattr(self.session, name)
+
+    def release(self) -> bool:
+        """关闭已创建的会话并归还连接，之后再使用会重新创建会话；返回是否关闭了会话"""
+        if self._session is None:
+            return False
+        session, self._session = self._session, None
+        session.close()
+        self._released = True
+        return True
+
+    def close(self):
+        """清理时调用：关闭会话并记录它的使用情况，重复调用什么也不做"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._session is not None:
+            outcome = 'teardown'
+            self._session.close()
+            self._session = None
+        elif self._released:
+            outcome = 'released_early'
+        else:
+            outcome = 'unused'
+        metrics.DB_SESSIONS.inc(outcome)
+
+    def __repr__(self):
+        return f'<LazySession opened={self.opened} released={self._released}>'
+
+
+def release_sessions(sessions: List[LazySession]):
+    for session in sessions:
+        session.release()
+
+
+class SessionRoute(TimedRoute):
+    """路由处理函数返回响应之后立即关闭本次请求中创建的 LazySession：APIRouter(route_class=SessionRoute)"""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def session_handler(request):
+            sessions = []
+            token = request_sessions.set(sessions)
+            try:
+                return await handler(request)
+            finally:
+                request_sessions.reset(token)
+                # 关闭会话要执行 ROLLBACK，是阻塞的数据库操作，只有真正创建了会话时才放到线程池中执行
+                if any(session.opened for session in sessions):
+                    await run_in_threadpool(release_sessions, sessions)
+
+        return session_handler
@@ -0,0 +1,34 @@
+"""应用启动时的数据库准备工作：建表、预热城市缓存、初始化汇总表，同步和异步路由共用，由 run.py 注册到应用上"""
+
+from coronavirus import crud, rollups, schema
+from coronavirus.config import settings
+from coronavirus.database import SessionLocal, engine
+
+
+# 建表和建索引不在导入时执行，放在第一个启动事件中，后面的启动事件依赖这些表；生产环境可以关闭它，改为部署时执行 python -m coronavirus.schema
+def init_schema():
+    if settings.schema_auto_create:
+        schema.create_schema(engine)
+
+
+# 应用启动时预先把城市加载到缓存中
+def warm_city_cache():
+    if settings.city_cache_warm:
+        db = SessionLocal()
+        try:
+            crud.warm_city_cache(db)
+        finally:
+            db.close()
+
+
+# 新建汇总表之后第一次启动时，根据已有的数据计算汇总表
+def init_rollups():
+    db = SessionLocal()
+    try:
+        rollups.rebuild_if_empty(db)
+    finally:
+        db.close()
+
+
+# 按顺序执行，后面的函数依赖 init_schema 创建的表
+STARTUP_HANDLERS = (init_schema, warm_city_cache, init_rollups)
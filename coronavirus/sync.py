@@ -0,0 +1,200 @@
+"""从本地 JHU（约翰斯·霍普金斯大学）格式的 CSV 文件同步新冠病毒疫情数据"""
+
+import csv
+import re
+from collections import defaultdict
+from datetime import date
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+from sqlalchemy.orm import Session
+
+from coronavirus import crud
+
+"""
+JHU 的每日报告（csse_covid_19_daily_reports）每个文件对应一天，文件名格式为 MM-DD-YYYY.csv，例如 03-22-2020.csv。
+文件中每一行是一个省/州（美国的文件中还会细分到县，即同一个省/州会出现多行）在当天的累计确诊、死亡、痊愈数量。
+
+同步流程：
+    1、逐个文件、逐行流式读取 CSV，不会把整个文件读入内存；
+    2、同一天同一个国家的同一个省/州的多行数据在内存中累加，内存占用只和省/州的数量有关，和行数无关；
+    3、每 batch_size 个省/州为一批：用一条 IN 查询解析城市，缺失的城市批量创建，
+       先删除这些城市当天的旧数据，再用 executemany 批量插入新数据，每批只提交一次事务。
+
+不同国家会出现同名的省/州（例如 Unknown、Diamond Princess），而 city 表的 province 是唯一的，所以城市按 (国家, 省/州) 区分：
+名称没有被其他国家使用时，直接用省/州的名称作为城市名称，否则城市名称为 "<省/州> (<国家>)"，例如 Unknown (Peru)。
+"""
+
+# JHU 每日报告的文件名格式
+DAILY_REPORT_NAME = re.compile(r'^(\d{2})-(\d{2})-(\d{4})\.csv$')
+
+# 不同时期的 JHU 每日报告表头不一致，这里列出每个字段可能出现的列名
+COLUMN_ALIASES = {
+    'province': ('Province_State', 'Province/State'),
+    'country': ('Country_Region', 'Country/Region'),
+    'confirmed': ('Confirmed',),
+    'deaths': ('Deaths',),
+    'recovered': ('Recovered',),
+}
+
+
+def report_date(path: Path) -> date:
+    """从每日报告的文件名中解析出数据日期"""
+    match = DAILY_REPORT_NAME.match(path.name)
+    if match is None:
+        raise ValueError(f'不是 JHU 每日报告的文件名（MM-DD-YYYY.csv）：{path.name}')
+    month, day, year = match.groups()
+    return date(int(year), int(month), int(day))
+
+
+def iter_report_files(path) -> Iterator[Tuple[date, Path]]:
+    """path 可以是单个每日报告文件，也可以是目录；目录下的每日报告按日期顺序返回，其他文件会被忽略"""
+    path = Path(path)
+    if path.is_file():
+        yield report_date(path), path
+        return
+    files = [(report_date(p), p) for p in path.iterdir() if DAILY_REPORT_NAME.match(p.name)]
+    yield from sorted(files)
+
+
+def _to_int(value) -> int:
+    # JHU 数据里的数量列可能为空，也可能是 "12.0" 这样的浮点数格式
+    return int(float(value)) if value else 0
+
+
+def iter_jhu_rows(path) -> Iterator[dict]:
+    """逐行读取一个每日报告文件，返回统一字段名后的字典"""
+    # utf-8-sig 可以去掉部分 JHU 文件开头的 BOM
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        index = {}
+        for field, aliases in COLUMN_ALIASES.items():
+            for alias in aliases:
+                if alias in header:
+                    index[field] = header.index(alias)
+                    break
+        if 'country' not in index or 'confirmed' not in index:
+            raise ValueError(f'{path} 不是 JHU 每日报告格式的 CSV 文件')
+
+        for row in reader:
+            values = {field: row[i].strip() if i < len(row) else '' for field, i in index.items()}
+            # 没有省/州的国家，用国家名称作为省/直辖市
+            yield {
+                'province': values.get('province') or values['country'],
+                'country': values['country'],
+                'confirmed': _to_int(values.get('confirmed')),
+                'deaths': _to_int(values.get('deaths')),
+                'recovered': _to_int(values.get('recovered')),
+            }
+
+
+def _aggregate(rows: Iterator[dict]) -> Dict[Tuple[str, str], dict]:
+    """把同一个国家的同一个省/州的多行（例如美国各县）累加为一条记录"""
+    records = {}
+    for row in rows:
+        key = (row['country'], row['province'])
+        record = records.get(key)
+        if record is None:
+            records[key] = row
+        else:
+            record['confirmed'] += row['confirmed']
+            record['deaths'] += row['deaths']
+            record['recovered'] += row['recovered']
+    return records
+
+
+def _chunks(items: list, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def qualified_name(province: str, country: str) -> str:
+    """省/州的名称被其他国家的城市占用时使用的城市名称"""
+    return f'{province} ({country})'
+
+
+def _resolve_cities(db: Session, records: List[dict]) -> Dict[Tuple[str, str], int]:
+    """返回 {(国家, 省/州): city_id}，先按带国家的名称、再按原名称查找，两者都不存在时创建城市"""
+    keys = {(r['country'], r['province']) for r in records}
+    found = crud.get_city_ids_by_keys(db, [(c, qualified_name(p, c)) for c, p in keys] + list(keys))
+    city_ids = {}
+    missing = []
+    for country, province in keys:
+        city_id = found.get((country, qualified_name(province, country)), found.get((country, province)))
+        if city_id is None:
+            missing.append((country, province))
+        else:
+            city_ids[country, province] = city_id
+    if missing:
+        # 原名称已经被其他国家的城市占用，或者本批中有多个国家使用同一个名称时，使用带国家的名称
+        taken = crud.get_city_ids_by_names(db, (p for _, p in missing)).keys()
+        countries = defaultdict(set)
+        for country, province in missing:
+            countries[province].add(country)
+        names = {
+            (c, p): qualified_name(p, c) if p in taken or len(countries[p]) > 1 else p for c, p in missing
+        }
+        crud.create_cities_bulk(db, [{
+            'province': name,
+            'country': country,
+            'country_code': '',  # JHU 每日报告中没有国家代码和人口，先用默认值占位
+            'country_population': 0,
+        } for (country, _), name in names.items()])
+        created = crud.get_city_ids_by_keys(db, ((c, name) for (c, _), name in names.items()))
+        for (country, province), name in names.items():
+            city_ids[country, province] = created[country, name]
+    return city_ids
+
+
+def _save_batch(db: Session, day: date, records: List[dict]) -> int:
+    city_ids = _resolve_cities(db, records)
+    rows = [{
+        'city_id': city_ids[r['country'], r['province']],
+        'date': day,
+        'confirmed': r['confirmed'],
+        'deaths': r['deaths'],
+        'recovered': r['recovered'],
+    } for r in records]
+    crud.delete_city_data_bulk(db, ((row['city_id'], day) for row in rows))
+    return crud.create_data_bulk(db, rows)
+
+
+def sync_jhu_data(db: Session, path, batch_size: int = 1000) -> dict:
+    """把 path 下的 JHU 每日报告同步到数据库，已存在的同一城市同一天的数据会被替换，返回同步的统计信息"""
+    summary = {'files': 0, 'rows': 0}
+    for day, file in iter_report_files(path):
+        records = _aggregate(iter_jhu_rows(file))
+        for chunk in _chunks(list(records.values()), batch_size):
+            summary['rows'] += _save_batch(db, day, chunk)
+            db.commit()
+        summary['files'] += 1
+    return summary
+
+
+if __name__ == '__main__':
+    # 也可以在命令行中直接同步：python -m coronavirus.sync /path/to/csse_covid_19_daily_reports
+    import argparse
+    from coronavirus import schema
+    from coronavirus.config import settings
+    from coronavirus.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description='从 JHU 格式的 CSV 文件同步新冠病毒疫情数据')
+    parser.add_argument('path', nargs='?', default=settings.jhu_data_path, help='每日报告文件或目录')
+    parser.add_argument('--batch-size', type=int, default=settings.sync_batch_size)
+    args = parser.parse_args()
+
+    # 命令行中执行时不会经过应用的启动事件，先创建缺少的表和索引
+    schema.create_schema()
+    session = SessionLocal()
+    try:
+        print(sync_jhu_data(session, args.path, batch_size=args.batch_size))
+    finally:
+        session.close()
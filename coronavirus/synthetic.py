@@ -0,0 +1,192 @@
+"""生成确定性的合成疫情数据并批量导入数据库，用于压测 city 和 data 表"""
+
+import math
+import random
+import time
+from collections import deque
+from datetime import date, datetime, timedelta
+from itertools import islice
+from typing import Iterator, List, Tuple
+
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from coronavirus import crud, models, rollups
+
+"""
+用 crud.create_city / crud.create_city_data 逐条创建、逐条提交，一百万行需要几个小时。这里：
+    1、每个城市用独立的随机数生成器（种子由 seed 和城市序号决定），同样的参数总是生成同样的数据，与城市数量和生成顺序无关；
+    2、每个城市的新增病例是一条带随机波动的钟形曲线，确诊、死亡、痊愈都是只增不减的累计值，且死亡 + 痊愈不超过确诊；
+    3、导入前删除 data 表的二级索引，用 DBAPI 的 executemany 批量插入元组，每 transaction_rows 行提交一次，全部导入后再重建索引和汇总表；
+    4、SQLite 在导入期间关闭同步写盘（synchronous=OFF），数据库文件只在导入中途断电时才可能损坏，重新导入即可。
+
+    python -m coronavirus.synthetic --cities 2000 --days 1000
+    python -m coronavirus.synthetic --cities 2000 --days 1000 --replace --database-url sqlite:////tmp/load.sqlite3
+"""
+
+COUNTRIES = ('China', 'US', 'Italy', 'Spain', 'Germany', 'France', 'Iran', 'United Kingdom', 'India', 'Brazil')
+START_DATE = date(2020, 1, 22)
+# 确诊之后大约多少天痊愈
+RECOVERY_LAG = 14
+
+
+def city_name(prefix: str, index: int) -> str:
+    return f'{prefix}-{index:06d}'
+
+
+def generate_series(rng: random.Random, days: int) -> Iterator[Tuple[int, int, int]]:
+    """一个城市每天的 (累计确诊, 累计死亡, 累计痊愈)"""
+    peak_day = rng.randrange(days)
+    width = days * (0.05 + rng.random() * 0.2) + 1
+    peak = rng.lognormvariate(4, 1.5)
+    death_rate = 0.005 + rng.random() * 0.045
+    recovery_rate = 0.8 + rng.random() * 0.15
+
+    confirmed = deaths = recovered = 0
+    history = deque(maxlen=RECOVERY_LAG)
+    for day in range(days):
+        new = int(peak * math.exp(-0.5 * ((day - peak_day) / width) ** 2) * (0.5 + rng.random()))
+        confirmed += new
+        deaths += int(new * death_rate)
+        history.append(confirmed)
+        # 痊愈数跟随 RECOVERY_LAG 天前的确诊数，confirmed - deaths 不会减小，所以 recovered 也只增不减
+        if len(history) == RECOVERY_LAG:
+            recovered = max(recovered, min(int(history[0] * recovery_rate), confirmed - deaths))
+        yield confirmed, deaths, recovered
+
+
+def generate_rows(city_ids: List[Tuple[int, int]], days: int, seed: int, dialect: str) -> Iterator[tuple]:
+    """city_ids 是 (城市序号, 城市 id) 的列表，返回 data 表的行，列的顺序与 INSERT 语句一致"""
+    now = datetime.utcnow().replace(microsecond=0)
+    # SQLite 的 DATE/DATETIME 以字符串存储，直接传字符串，省去驱动逐个转换
+    if dialect == 'sqlite':
+        dates = [(START_DATE + timedelta(days=day)).isoformat() for day in range(days)]
+        now = now.strftime('%Y-%m-%d %H:%M:%S')
+    else:
+        dates = [START_DATE + timedelta(days=day) for day in range(days)]
+    for index, city_id in city_ids:
+        rng = random.Random(seed * 1000003 + index)
+        for day, (confirmed, deaths, recovered) in zip(dates, generate_series(rng, days)):
+            yield city_id, day, confirmed, deaths, recovered, now, now
+
+
+def _insert_sql(engine: Engine) -> str:
+    marker = '?' if engine.dialect.paramstyle == 'qmark' else '%s'
+    columns = ('city_id', 'date', 'confirmed', 'deaths', 'recovered', 'created_at', 'updated_at')
+    return f'INSERT INTO data ({", ".join(columns)}) VALUES ({", ".join([marker] * len(columns))})'
+
+
+def _create_cities(conn: Connection, cities: int, prefix: str, seed: int) -> List[Tuple[int, int]]:
+    rng = random.Random(seed)
+    conn.execute(models.City.__table__.insert(), [{
+        'province': city_name(prefix, i),
+        'country': COUNTRIES[i % len(COUNTRIES)],
+        'country_code': '',
+        'country_population': rng.randint(10 ** 6, 10 ** 9),
+    } for i in range(1, cities + 1)])
+    city = models.City.__table__
+    ids = dict(conn.execute(select(city.c.province, city.c.id).where(city.c.province.like(f'{prefix}-%'))).all())
+    return [(i, ids[city_name(prefix, i)]) for i in range(1, cities + 1)]
+
+
+def _delete_existing(conn: Connection, prefix: str) -> int:
+    city, data = models.City.__table__, models.Data.__table__
+    existing = select(city.c.id).where(city.c.province.like(f'{prefix}-%'))
+    conn.execute(data.delete().where(data.c.city_id.in_(existing)))
+    return conn.execute(city.delete().where(city.c.province.like(f'{prefix}-%'))).rowcount
+
+
+def load(engine: Engine, cities: int, days: int, seed: int = 0, prefix: str = 'Synthetic', replace: bool = False,
+         batch_size: int = 50000, transaction_rows: int = 1000000) -> dict:
+    """生成 cities 个城市、每个城市 days 天的数据并导入，返回导入的统计信息"""
+    start = time.perf_counter()
+    data = models.Data.__table__
+    models.Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as conn:
+        city = models.City.__table__
+        exists = conn.execute(select(city.c.id).where(city.c.province.like(f'{prefix}-%')).limit(1)).first()
+        if exists and not replace:
+            raise ValueError(f'数据库中已经有名称以 {prefix}- 开头的城市，使用 --replace 替换或用 --prefix 换一个前缀')
+        if exists:
+            _delete_existing(conn, prefix)
+        city_ids = _create_cities(conn, cities, prefix, seed)
+        # 先删除二级索引，导入时不用逐行维护索引，导入完成后一次性排序建立索引更快
+        for index in data.indexes:
+            index.drop(bind=conn, checkfirst=True)
+
+    sql = _insert_sql(engine)
+    rows = generate_rows(city_ids, days, seed, engine.dialect.name)
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            inserted = 0
+            while inserted < transaction_rows:
+                batch = list(islice(rows, min(batch_size, transaction_rows - inserted)))
+                if not batch:
+                    break
+                conn.exec_driver_sql(sql, batch)
+                inserted += len(batch)
+        total += inserted
+        if inserted < transaction_rows:
+            break
+    load_seconds = time.perf_counter() - start
+
+    with engine.begin() as conn:
+        for index in data.indexes:
+            index.create(bind=conn, checkfirst=True)
+    index_seconds = time.perf_counter() - start - load_seconds
+
+    with Session(engine) as db:
+        # 直接用 SQL 导入，没有经过 crud 的写入函数，在这里更新数据版本，和汇总表一起提交
+        crud.bump_version(db, 'city')
+        crud.bump_version(db, 'data')
+        rollups.rebuild(db)
+
+    return {
+        'cities': cities,
+        'rows': total,
+        'load_seconds': round(load_seconds, 2),
+        'index_seconds': round(index_seconds, 2),
+        'total_seconds': round(time.perf_counter() - start, 2),
+        'rows_per_second': round(total / load_seconds) if load_seconds else total,
+    }
+
+
+def create_load_engine(database_url: str) -> Engine:
+    """导入专用的引擎：不输出 SQL 日志，SQLite 关闭同步写盘并加大页缓存"""
+    is_sqlite = database_url.startswith('sqlite')
+    engine = create_engine(database_url, connect_args={'check_same_thread': False} if is_sqlite else {})
+    if is_sqlite:
+        @event.listens_for(engine, 'connect')
+        def on_connect(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA synchronous=OFF')
+            cursor.execute('PRAGMA cache_size=-262144')
+            cursor.execute('PRAGMA temp_store=MEMORY')
+            cursor.close()
+    return engine
+
+
+if __name__ == '__main__':
+    import argparse
+    from coronavirus.config import settings
+
+    parser = argparse.ArgumentParser(description='生成确定性的合成疫情数据并批量导入数据库')
+    parser.add_argument('--cities', type=int, default=1000, help='城市（省/州）数量')
+    parser.add_argument('--days', type=int, default=365, help='每个城市的天数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--prefix', default='Synthetic', help='城市名称的前缀，城市名称为 <前缀>-000001')
+    parser.add_argument('--replace', action='store_true', help='删除已有的同一前缀的城市及其数据后重新导入')
+    parser.add_argument('--batch-size', type=int, default=50000, help='每次 executemany 的行数')
+    parser.add_argument('--transaction-rows', type=int, default=1000000, help='每个事务的行数')
+    parser.add_argument('--database-url', default=settings.database_url)
+    args = parser.parse_args()
+
+    load_engine = create_load_engine(args.database_url)
+    try:
+        print(load(load_engine, args.cities, args.days, seed=args.seed, prefix=args.prefix, replace=args.replace,
+                   batch_size=args.batch_size, transaction_rows=args.transaction_rows))
+    finally:
+        load_engine.dispose()
@@ -0,0 +1,160 @@
+"""请求耗时统计：纯 ASGI 的计时中间件、Server-Timing 响应头和各阶段耗时的记录"""
+
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, Iterator
+
+from fastapi.routing import APIRoute
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from coronavirus import profiling
+
+"""
+@app.middleware('http') 基于 BaseHTTPMiddleware，每个请求都要多创建任务和内存流，流式响应也要经过它转发；
+TimingMiddleware 是纯 ASGI 中间件，只包装 send，在 http.response.start 消息中加入响应头，对响应体不做任何处理。
+
+一次请求的耗时分为以下阶段（单位毫秒），写入标准的 Server-Timing 响应头，浏览器开发者工具的 Timing 面板可以直接显示：
+    deps：解析请求体和依赖项（包括等待线程池），即路由函数开始执行之前的时间，见 TimedRoute
+    db：执行 SQL 的时间，由 database.py 中的 before/after_cursor_execute 事件累加
+    serialize：序列化响应的时间，包括 FastAPI 的 response_model 校验和编码，以及 serializers.py 中的快速序列化
+    template：渲染模板的时间，流式输出的页面在发送响应头之后才渲染，不计入
+    total：从收到请求到开始发送响应的总时间，X-Process-Time 同样是这个时间（单位秒），保留用于兼容
+所有时间都用单调的 time.perf_counter_ns() 测量，不受系统时钟调整的影响。
+"""
+
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+
+
+class RequestTimings:
+    """一次请求中各阶段累计的纳秒数"""
+
+    def __init__(self):
+        self.phases: Dict[str, int] = {}
+
+    def add(self, name: str, duration_ns: int):
+        self.phases[name] = self.phases.get(name, 0) + duration_ns
+
+
+# 中间件在请求开始时放入 StatementCounter 和 RequestTimings，请求处理过程中（包括线程池中执行的同步路由）都累加到它们上面。
+# ContextVar 会随着 asyncio 任务和 run_in_threadpool 复制到子任务和线程中，所以不同请求之间的计数互不影响。
+statement_counter: ContextVar = ContextVar('statement_counter', default=None)
+request_timings: ContextVar = ContextVar('request_timings', default=None)
+
+# Server-Timing 中各阶段的输出顺序
+PHASES = ('deps', 'db', 'serialize', 'template')
+
+
+def record(name: str, duration_ns: int):
+    timings = request_timings.get()
+    if timings is not None:
+        timings.add(name, duration_ns)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """统计 with 语句块的耗时，不在请求中（例如命令行脚本）时什么也不做"""
+    if request_timings.get() is None:
+        yield
+        return
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter_ns() - start)
+
+
+def server_timing(timings: RequestTimings, total_ns: int) -> str:
+    metrics = [f'{name};dur={timings.phases[name] / 1e6:.3f}' for name in PHASES if name in timings.phases]
+    metrics.append(f'total;dur={total_ns / 1e6:.3f}')
+    return ', '.join(metrics)
+
+
+class TimingMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter_ns()
+        counter = StatementCounter()
+        timings = RequestTimings()
+
+        async def send_with_timing(message: Message):
+            if message['type'] == 'http.response.start':
+                total = time.perf_counter_ns() - start
+                headers = list(message.get('headers', []))
+                headers.append((b'x-process-time', str(total / 1e9).encode('latin-1')))
+                # 本次请求执行的 SQL 语句数量，可以在测试中断言它来发现 N+1 查询
+                headers.append((b'x-sql-statements', str(counter.count).encode('latin-1')))
+                headers.append((b'server-timing', server_timing(timings, total).encode('latin-1')))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        counter_token = statement_counter.set(counter)
+        timings_token = request_timings.set(timings)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_timings.reset(timings_token)
+            statement_counter.reset(counter_token)
+
+
+class TimedRoute(APIRoute):
+    """
+    记录 deps 和 serialize 阶段的路由类：APIRouter(route_class=TimedRoute)。
+    包装路由函数记录它开始和结束的时间，路由处理函数开始到路由函数开始之前是 deps，路由函数结束到处理函数返回是 serialize。
+    """
+
+    def get_route_handler(self) -> Callable:
+        endpoint = self.dependant.call
+        marks = ContextVar('endpoint_marks')
+
+        # 包装后的函数保持同步/异步不变，FastAPI 据此决定是否放到线程池中执行
+        if asyncio.iscoroutinefunction(endpoint):
+            @wraps(endpoint)
+            async def timed_endpoint(**values):
+                mark = marks.get()
+                mark.append(time.perf_counter_ns())
+                try:
+                    return await endpoint(**values)
+                finally:
+                    mark.append(time.perf_counter_ns())
+        else:
+            @wraps(endpoint)
+            def timed_endpoint(**values):
+                mark = marks.get()
+                mark.append(time.perf_counter_ns())
+                try:
+                    # 同步路由函数在线程池中执行，被选中做性能分析的请求需要在工作线程中单独启用分析器
+                    with profiling.profile_thread():
+                        return endpoint(**values)
+                finally:
+                    mark.append(time.perf_counter_ns())
+
+        # FastAPI 在每次请求时调用 dependant.call，所以直接替换它；OpenAPI 文档使用的 self.endpoint 不受影响
+        self.dependant.call = timed_endpoint
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            start = time.perf_counter_ns()
+            # 线程池中的路由函数拿到的是 Context 的副本，所以放入一个列表，在两边共享同一个对象
+            mark = []
+            token = marks.set(mark)
+            try:
+                return await handler(request)
+            finally:
+                marks.reset(token)
+                if len(mark) == 2:
+                    record('deps', mark[0] - start)
+                    record('serialize', time.perf_counter_ns() - mark[1])
+
+        return timed_handler
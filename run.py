@@ -1,10 +1,11 @@
 # 首先，导入 FastAPI 和 Uvicorn 库。
+import os
 from fastapi import FastAPI, requests, Request
-from fastapi.staticfiles import StaticFiles
 import uvicorn
-from tutorial import app03, app04, app05, app06, app07, app08
-from coronavirus import application
-import time
+from coronavirus.assets import StaticAssets, STATIC_DIR
+from coronavirus.config import settings as coronavirus_settings
+from coronavirus import metrics, profiling
+from coronavirus.timing import TimingMiddleware
 from fastapi.middleware.cors import CORSMiddleware
 
 
@@ -22,16 +23,20 @@ app = FastAPI(
 
 """FastAPI项目的静态文件配置【见run.py文件】"""
 # mount挂载的概念：表示将某个目录下的一个完全独立的应用给挂载过来，这个不会在API交互文档中显示
-app.mount(path='/coronavirus/static', app=StaticFiles(directory='./coronavirus/static'), name='static') # .mount()不要在分路由APIRouter().mount调用，模板会报错
+# StaticAssets 在 StaticFiles 的基础上返回预压缩文件并设置 Cache-Control，先执行 python -m coronavirus.assets build 生成带哈希的文件
+app.mount(path='/coronavirus/static', app=StaticAssets(directory=STATIC_DIR), name='static') # .mount()不要在分路由APIRouter().mount调用，模板会报错
 
-# @app.middleware('http')：使用FastAPI应用程序实例的middleware方法，将此函数注册为中间件，并指定在HTTP请求上执行。
-@app.middleware('http')
-async def add_process_time_header(request: Request, call_next):   # 这是一个异步函数，它接收两个参数：请求对象request和一个名为call_next的回调函数，它将处理请求并返回响应对象。
-    start_time = time.time() # 记录当前时间，作为请求处理开始的时间。
-    response = await call_next(request)  # 调用回调函数call_next，将请求对象作为参数传递给它，并等待其返回响应对象。这个语句实际上是执行整个请求处理过程，也就是调用FastAPI路由器并处理路由器返回的响应。
-    processtime = time.time() - start_time  # 计算请求处理的总时间，这个时间是当前时间减去开始时间。
-    response.headers['X-Process-Time'] = str(processtime)  # 将计算得到的处理时间值添加到响应头中，使用名为“X-Process-Time”的键。注意这个键名以“X-”开头，这表示它是一个自定义头部。
-    return response  # 返回更新后的响应对象，以完成整个中间件的操作。
+# 性能分析中间件：启用后，带有 X-Profile 请求头或被随机抽中的请求会用 cProfile 分析，结果通过 /admin/profiles 查看，见 coronavirus/profiling.py
+# 后添加的中间件在外层，它最先添加，所以只分析路由本身，不包括下面的计时和指标中间件
+app.add_middleware(profiling.ProfilingMiddleware)
+
+# 计时中间件：记录每个请求的总耗时和各阶段耗时，写入 X-Process-Time、X-SQL-Statements 和 Server-Timing 响应头。
+# 它是纯 ASGI 中间件，不像 @app.middleware('http')（BaseHTTPMiddleware）那样为每个请求创建额外的任务，也不会转发流式响应的每一块，见 coronavirus/timing.py
+app.add_middleware(TimingMiddleware)
+
+# 指标中间件：记录每个路由、每个状态码的请求耗时和正在处理的请求数，和连接池、缓存的状态一起通过 /metrics 以 Prometheus 文本格式暴露
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_route('/metrics', metrics.metrics_endpoint, include_in_schema=False)
 
 # 配置CORS跨域中间件
 app.add_middleware(
@@ -46,17 +51,66 @@ app.add_middleware(
 )
 
 
+"""
+挂载的路由：名称 -> (模块, 路由对象, 路由前缀, 标签)，按这里的顺序挂载。路由模块只在启用时才导入，
+环境变量 ROUTERS 用逗号分隔指定要启用的路由，例如 ROUTERS=coronavirus 只导入和挂载新冠病毒疫情跟踪器，
+不会导入第六章的 passlib、bcrypt 和 jose，worker 启动和 reload 更快；不设置时启用全部路由。
+各路由的导入耗时见 python -m benchmarks.startup_time。
+"""
 # app03 表示一个 Router 对象，它包含了第三章中的多个路由。prefix='/chatpter03' 是一个可选参数，
 # 用于指定将该路由器中的所有端点路由到应用程序中的某个子路径上。
 # 例如，如果 prefix='/chatpter03'，则该路由器中的所有端点将被路由到应用程序的路径 '/chatpter03' 下。
 # tags=['第三章 请求参数和验证'] 也是一个可选参数，用于为路由器中的所有端点指定一个或多个标签，以便于 OpenAPI 文档的生成和分类。
-app.include_router(app03, prefix='/chatpter03', tags=['第三章 请求参数和验证'])
-app.include_router(app04, prefix='/chatpter04', tags=['第四章 响应处理和FASTAPI配置'])
-app.include_router(app05, prefix='/chatpter05', tags=['第五章 FastAPI的依赖注入系统'])
-app.include_router(app06, prefix='/chatpter06', tags=['第六章 安全、认证和授权'])
-app.include_router(app07, prefix='/chatpter07', tags=['第七章 FastAPI的数据库和多应用的目录结构设计'])
-app.include_router(application, prefix='/coronavirus', tags=['新冠病毒疫情跟踪器API'])
-app.include_router(app08, prefix='/chatpter08', tags=['第八章 中间件、CORS跨域、后台任务、测试用例'])
+ROUTERS = {
+    'chapter03': ('tutorial.chapter03', 'app03', '/chatpter03', ['第三章 请求参数和验证']),
+    'chapter04': ('tutorial.chapter04', 'app04', '/chatpter04', ['第四章 响应处理和FASTAPI配置']),
+    'chapter05': ('tutorial.chapter05', 'app05', '/chatpter05', ['第五章 FastAPI的依赖注入系统']),
+    'chapter06': ('tutorial.chapter06', 'app06', '/chatpter06', ['第六章 安全、认证和授权']),
+    'chapter07': ('tutorial.chapter07', 'app07', '/chatpter07', ['第七章 FastAPI的数据库和多应用的目录结构设计']),
+    'coronavirus': ('coronavirus.main', 'application', '/coronavirus', ['新冠病毒疫情跟踪器API']),
+    # 异步数据库引擎和路由是可选的，设置环境变量 CORONAVIRUS_ASYNC_ENABLED=true 后才启用
+    'coronavirus_async': ('coronavirus.async_main', 'async_application', '/coronavirus/async', ['新冠病毒疫情跟踪器API（异步）']),
+    # 设置环境变量 CORONAVIRUS_PROFILING_ENABLED=true 后才启用
+    'profiling': ('coronavirus.profiling', 'profiling_application', '/admin/profiles', ['性能分析']),
+    'chapter08': ('tutorial.chapter08', 'app08', '/chatpter08', ['第八章 中间件、CORS跨域、后台任务、测试用例']),
+}
+
+
+def enabled_routers() -> list:
+    names = [name.strip() for name in os.environ.get('ROUTERS', '').split(',') if name.strip()] or list(ROUTERS)
+    unknown = [name for name in names if name not in ROUTERS]
+    if unknown:
+        raise ValueError(f'未知的路由：{", ".join(unknown)}，可选值为 {", ".join(ROUTERS)}')
+    if not coronavirus_settings.async_enabled:
+        names = [name for name in names if name != 'coronavirus_async']
+    if not coronavirus_settings.profiling_enabled:
+        names = [name for name in names if name != 'profiling']
+    # 按 ROUTERS 中的顺序挂载，与环境变量中的顺序无关
+    return [name for name in ROUTERS if name in names]
+
+
+routers = enabled_routers()
+for name in routers:
+    module, router, prefix, tags = ROUTERS[name]
+    # 用 __import__ 而不是 importlib.import_module，后者不经过解释器的导入入口，python -X importtime 中看不到这些模块
+    app.include_router(getattr(__import__(module, fromlist=[router]), router), prefix=prefix, tags=tags)
+
+# 数据库的启动事件（建表、预热城市缓存、初始化汇总表）和连接池、缓存的指标，同步和异步的新冠病毒疫情跟踪器路由都需要，
+# 只启用了其他路由时不注册（也不导入 SQLAlchemy 和数据库引擎）
+if {'coronavirus', 'coronavirus_async'} & set(routers):
+    from coronavirus import crud as coronavirus_crud, database as coronavirus_database, startup
+
+    for handler in startup.STARTUP_HANDLERS:
+        app.add_event_handler('startup', handler)
+
+    metrics.instrument_engine(coronavirus_database.engine, 'sync')
+    if coronavirus_database.async_engine is not None:
+        metrics.instrument_engine(coronavirus_database.async_engine.sync_engine, 'async')
+    metrics.register_cache('city', coronavirus_crud.city_cache)
+    if 'coronavirus' in routers:
+        from coronavirus import rendering
+
+        metrics.register_cache('home_fragment', rendering.fragment_cache)
 
 # 使用了 Uvicorn 的 run 方法来启动应用程序。
 # run 方法接受一个字符串参数，指定了应用程序的入口点（在这里是 run.py 文件中的 app 实例），以及一些其他参数。
@@ -0,0 +1,27 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# coronavirus 包在导入时就根据环境变量创建数据库引擎，所以在导入任何测试模块之前指向临时目录中的新数据库，不修改项目中的数据库
+_directory = Path(tempfile.mkdtemp(prefix='coronavirus-tests-'))
+os.environ.setdefault('CORONAVIRUS_DATABASE_URL', f'sqlite:///{_directory / "tests.sqlite3"}')
+os.environ.setdefault('CORONAVIRUS_DB_PROFILE', 'prod')
+# 第四章的上传接口同样在导入时读取保存目录
+os.environ.setdefault('UPLOAD_DIR', str(_directory / 'uploads'))
+
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def client():
+    from fastapi.testclient import TestClient
+    from run import app
+
+    # with 语句会执行启动事件（建表、预热缓存）和关闭事件
+    with TestClient(app) as client:
+        yield client
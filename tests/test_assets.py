@@ -0,0 +1,81 @@
+"""静态文件的构建和托管：带哈希的文件名、sourceMappingURL、保留上一次构建的文件、预压缩文件的协商，见 coronavirus/assets.py"""
+
+import gzip
+import json
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from coronavirus import assets
+
+SCRIPT = b'var answer = 42;\n' * 200
+
+
+def write_sources(source, script: bytes = SCRIPT):
+    (source / 'js').mkdir(parents=True, exist_ok=True)
+    (source / 'js' / 'app.min.js').write_bytes(script + b'//# sourceMappingURL=app.min.js.map\n')
+    (source / 'js' / 'app.min.js.map').write_text('{"version":3,"sources":["app.js"],"mappings":""}')
+    (source / 'logo.png').write_bytes(b'\x89PNG' + bytes(range(256)))
+
+
+def test_build_writes_manifest_into_output(tmp_path):
+    source, output = tmp_path / 'static', tmp_path / 'out'
+    write_sources(source)
+    manifest = assets.build(source, output)
+    assert json.loads((output / 'manifest.json').read_text()) == manifest
+    assert set(manifest) == {'js/app.min.js', 'js/app.min.js.map', 'logo.png'}
+    for original, hashed in manifest.items():
+        assert assets.HASHED_NAME.search(hashed)
+        assert (output / hashed).is_file()
+    assert (output / manifest['logo.png']).read_bytes() == (source / 'logo.png').read_bytes()
+    # 压缩后更小的文本文件才有 .gz
+    assert gzip.decompress((output / (manifest['js/app.min.js'] + '.gz')).read_bytes()).startswith(SCRIPT)
+
+
+def test_source_map_url_points_at_hashed_map(tmp_path):
+    source, output = tmp_path / 'static', tmp_path / 'out'
+    write_sources(source)
+    manifest = assets.build(source, output)
+    script = (output / manifest['js/app.min.js']).read_bytes()
+    map_name = manifest['js/app.min.js.map'].split('/')[-1]
+    assert script.endswith(f'//# sourceMappingURL={map_name}\n'.encode())
+
+
+def test_rebuild_keeps_previous_build(tmp_path):
+    source, output = tmp_path / 'static', tmp_path / 'out'
+    write_sources(source)
+    first = assets.build(source, output)
+    write_sources(source, b'var answer = 43;\n' * 200)
+    second = assets.build(source, output)
+    assert second['js/app.min.js'] != first['js/app.min.js']
+    # 客户端缓存的旧页面还在引用上一次构建的文件
+    assert (output / first['js/app.min.js']).is_file()
+    assert (output / (first['js/app.min.js'] + '.gz')).is_file()
+
+    write_sources(source, b'var answer = 44;\n' * 200)
+    third = assets.build(source, output)
+    assert not (output / first['js/app.min.js']).exists()
+    assert not (output / (first['js/app.min.js'] + '.gz')).exists()
+    assert (output / second['js/app.min.js']).is_file() and (output / third['js/app.min.js']).is_file()
+    assert (output / third['logo.png']).is_file()
+
+
+def test_serve_precompressed_and_hide_compressed_files(tmp_path):
+    source, output = tmp_path / 'static', tmp_path / 'out'
+    write_sources(source)
+    manifest = assets.build(source, output)
+    app = FastAPI()
+    app.mount('/static', assets.StaticAssets(directory=output))
+    client = TestClient(app)
+
+    url = '/static/' + manifest['js/app.min.js']
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.headers['cache-control'] == assets.IMMUTABLE
+    assert response.headers['content-type'].startswith(('application/javascript', 'text/javascript'))
+    assert response.content.startswith(SCRIPT)
+
+    plain = client.get(url, headers={'Accept-Encoding': 'identity'})
+    assert 'content-encoding' not in plain.headers
+    assert client.get(url + '.gz').status_code == 404
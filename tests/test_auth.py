@@ -0,0 +1,53 @@
+"""第六章的 JWT 认证：密码校验池和已验证令牌的缓存，见 tutorial/chapter06.py"""
+
+import asyncio
+
+import pytest
+
+from tutorial import chapter06
+
+
+def login(client, username: str = 'johnsnow', password: str = 'secret') -> dict:
+    response = client.post('/chatpter06/jwt/token', data={'username': username, 'password': password})
+    assert response.status_code == 200, response.text
+    return {'Authorization': f'Bearer {response.json()["access_token"]}'}
+
+
+def test_password_pool_usable_from_several_event_loops():
+    pool = chapter06.PasswordHasherPool(workers=2)
+    # 导入模块、创建池时不在事件循环中，不能创建 CapacityLimiter
+    assert pool._limiter is None
+    for _ in range(2):
+        # 每次 asyncio.run 都是一个新的事件循环
+        assert asyncio.run(pool.run(sum, [1, 2])) == 3
+    assert pool.stats()['completed'] == 2
+
+
+def test_password_pool_rejects_when_queue_is_full():
+    pool = chapter06.PasswordHasherPool(workers=1, max_waiting=0)
+    with pytest.raises(chapter06.PasswordPoolBusy):
+        asyncio.run(pool.run(sum, [1]))
+    assert pool.stats()['rejected'] == 1
+
+
+def test_password_pool_stats_require_login(client):
+    assert client.get('/chatpter06/jwt/password_pool').status_code == 401
+    response = client.get('/chatpter06/jwt/password_pool', headers=login(client))
+    assert response.status_code == 200
+    assert response.json()['completed'] >= 1
+
+
+def test_disabled_user_token_rejected_immediately(client, monkeypatch):
+    monkeypatch.setitem(chapter06.fake_users_db, 'disable-me', dict(
+        chapter06.fake_users_db['johnsnow'], username='disable-me', email='disable-me@example.com'))
+    headers = login(client, 'disable-me')
+    for _ in range(2):
+        # 第二次请求命中已验证令牌的缓存
+        response = client.get('/chatpter06/jwt/users/me', headers=headers)
+        assert response.status_code == 200
+        assert response.json()['username'] == 'disable-me'
+
+    assert client.post('/chatpter06/jwt/users/me/disable', headers=headers).status_code == 200
+    response = client.get('/chatpter06/jwt/users/me', headers=headers)
+    assert response.status_code == 400
+    assert response.json()['detail'] == 'Inactive user'
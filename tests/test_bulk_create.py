@@ -0,0 +1,81 @@
+"""批量新建数据：JSON 数组和 NDJSON 两种请求体，出错时返回从 1 开始的行号，见 coronavirus/main.py 中的 create_data_bulk"""
+
+import json
+
+import pytest
+
+from coronavirus import main
+
+CITY = 'Bulk-1'
+NDJSON = {'Content-Type': 'application/x-ndjson'}
+
+
+def row(day: int, **extra) -> dict:
+    return {'date': f'2020-06-{day:02d}', 'confirmed': day, 'deaths': 0, 'recovered': 0, **extra}
+
+
+def ndjson(*lines) -> str:
+    return '\n'.join(line if isinstance(line, str) else json.dumps(line) for line in lines)
+
+
+@pytest.fixture(scope='module')
+def city(client):
+    response = client.post('/coronavirus/create_city', json={
+        'province': CITY, 'country': 'China', 'country_code': 'CN', 'country_population': 1000,
+    })
+    assert response.status_code == 200, response.text
+    return CITY
+
+
+def post_ndjson(client, body: str):
+    return client.post('/coronavirus/create_data/bulk', params={'city': CITY}, content=body, headers=NDJSON)
+
+
+def test_ndjson_and_json_array(client, city, monkeypatch):
+    monkeypatch.setattr(main.settings, 'bulk_chunk_size', 2)
+    response = post_ndjson(client, ndjson(row(1), '', row(2), row(3)) + '\n')
+    assert response.status_code == 200, response.text
+    assert response.json() == {'inserted': 3, 'chunks': [{'chunk': 0, 'inserted': 2}, {'chunk': 1, 'inserted': 1}]}
+
+    response = client.post('/coronavirus/create_data/bulk', json=[row(4, city=CITY), row(5, city=CITY)])
+    assert response.status_code == 200, response.text
+    assert response.json()['inserted'] == 2
+
+
+@pytest.mark.parametrize('lines, line', [
+    ((row(10), '{bad json'), 2),
+    (('{bad json', row(10)), 1),
+    ((row(10), {'date': 'not a date'}), 2),
+    ((row(10), '', '{bad json'), 3),  # 空行也计入行号
+    ((row(10), '', {'confirmed': 1}), 3),
+])
+def test_ndjson_errors_report_line(client, city, lines, line):
+    response = post_ndjson(client, ndjson(*lines))
+    assert response.status_code == 422
+    assert response.json()['detail']['line'] == line
+
+
+def test_json_array_errors_report_element(client, city):
+    response = client.post('/coronavirus/create_data/bulk', params={'city': CITY}, json=[row(11), {'date': 'bad'}])
+    assert response.status_code == 422
+    assert response.json()['detail']['line'] == 2
+
+    response = client.post('/coronavirus/create_data/bulk', content='[{', headers={'Content-Type': 'application/json'})
+    assert response.status_code == 422
+    assert response.json()['detail']['line'] is None
+
+
+def test_error_after_committed_chunk(client, city, monkeypatch):
+    monkeypatch.setattr(main.settings, 'bulk_chunk_size', 1)
+    response = post_ndjson(client, ndjson(row(20), row(21), '{bad json'))
+    assert response.status_code == 422
+    detail = response.json()['detail']
+    assert detail['line'] == 3
+    # 出错之前的块已经提交
+    assert detail['committed_chunks'] == [{'chunk': 0, 'inserted': 1}, {'chunk': 1, 'inserted': 1}]
+
+
+def test_missing_city(client, city):
+    response = client.post('/coronavirus/create_data/bulk', json=[row(12, city='Bulk-missing')])
+    assert response.status_code == 404
+    assert response.json()['detail']['cities'] == ['Bulk-missing']
@@ -0,0 +1,46 @@
+"""城市缓存：新建城市时写入缓存，事务中新建的城市在提交之后才放入缓存，见 coronavirus/crud.py 中的 city_cache"""
+
+from coronavirus import crud
+from coronavirus.database import SessionLocal
+
+
+def city_row(name: str) -> dict:
+    return {'province': name, 'country': 'China', 'country_code': 'CN', 'country_population': 1000}
+
+
+def test_created_city_is_served_from_cache(client):
+    response = client.post('/coronavirus/create_city', json=city_row('Cache-1'))
+    assert response.status_code == 200, response.text
+    assert crud.city_cache.get('Cache-1').id == response.json()['id']
+
+    cached = client.get('/coronavirus/get_city/Cache-1')
+    assert cached.status_code == 200
+    assert cached.json()['id'] == response.json()['id']
+    # 命中缓存时不查询数据库
+    assert cached.headers['x-sql-statements'] == '0'
+
+
+def test_rolled_back_city_is_not_cached(client):
+    db = SessionLocal()
+    try:
+        crud.create_cities_bulk(db, [city_row('Cache-ghost')])
+        # 同一个事务中可以查到新建的城市，但它还没有提交，不能放入进程共享的缓存
+        assert 'Cache-ghost' in crud.get_city_ids_by_names(db, ['Cache-ghost'])
+        assert crud.city_cache.get('Cache-ghost') is None
+        db.rollback()
+    finally:
+        db.close()
+    assert crud.city_cache.get('Cache-ghost') is None
+    assert client.get('/coronavirus/get_city/Cache-ghost').status_code == 404
+
+
+def test_committed_bulk_city_is_cached(client):
+    db = SessionLocal()
+    try:
+        crud.create_cities_bulk(db, [city_row('Cache-bulk')])
+        city_id = crud.get_city_ids_by_names(db, ['Cache-bulk'])['Cache-bulk']
+        assert crud.city_cache.get('Cache-bulk') is None
+        db.commit()
+    finally:
+        db.close()
+    assert crud.city_cache.get('Cache-bulk').id == city_id
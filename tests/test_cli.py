@@ -0,0 +1,28 @@
+"""命令行入口在空数据库上也能直接执行：它们不经过应用的启动事件，需要自己创建缺少的表"""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+HEADER = 'Province_State,Country_Region,Last_Update,Confirmed,Deaths,Recovered\n'
+
+
+def run_module(tmp_path, *args) -> subprocess.CompletedProcess:
+    env = dict(os.environ, CORONAVIRUS_DATABASE_URL=f'sqlite:///{tmp_path / "cli.sqlite3"}')
+    return subprocess.run([sys.executable, '-m', *args], cwd=ROOT, env=env, capture_output=True, text=True)
+
+
+def test_sync_cli_on_empty_database(tmp_path):
+    reports = tmp_path / 'reports'
+    reports.mkdir()
+    (reports / '03-22-2020.csv').write_text(HEADER + 'Hubei,China,,10,1,0\nBeijing,China,,5,0,0\nChile,Chile,,3,0,0\n')
+    result = run_module(tmp_path, 'coronavirus.sync', str(reports))
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == "{'files': 1, 'rows': 3}"
+
+
+def test_rollups_cli_on_empty_database(tmp_path):
+    result = run_module(tmp_path, 'coronavirus.rollups', 'rebuild')
+    assert result.returncode == 0, result.stderr
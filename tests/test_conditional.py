@@ -0,0 +1,78 @@
+"""读接口的条件 GET：数据没有变化时返回 304，任何写入之后（包括同一秒内的写入）都返回 200 和新的 ETag，见 coronavirus/conditional.py"""
+
+import time
+
+import pytest
+
+CITY = 'Conditional-1'
+
+
+def wait_for_next_second():
+    # updated_at 只精确到秒，从一秒的开头开始，确保下面的两次写入落在同一秒内
+    time.sleep(1 - time.time() % 1 + 0.01)
+
+
+def create_data(client, day: str, confirmed: int):
+    response = client.post('/coronavirus/create_data', params={'city': CITY},
+                           json={'date': day, 'confirmed': confirmed, 'deaths': 0, 'recovered': 0})
+    assert response.status_code == 200, response.text
+
+
+@pytest.fixture(scope='module')
+def city(client):
+    response = client.post('/coronavirus/create_city', json={
+        'province': CITY, 'country': 'China', 'country_code': 'CN', 'country_population': 1000,
+    })
+    assert response.status_code == 200, response.text
+    return CITY
+
+
+def test_get_data_not_modified_until_written(client, city):
+    wait_for_next_second()
+    for day in ('2020-02-02', '2020-02-03', '2020-02-04'):
+        create_data(client, day, 1)
+    params = {'city': CITY, 'limit': 3}
+    first = client.get('/coronavirus/get_data', params=params)
+    assert first.status_code == 200
+    etag = first.headers['etag']
+
+    cached = client.get('/coronavirus/get_data', params=params, headers={'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.headers['etag'] == etag
+
+    # 同一秒内插入一行日期更早的数据：窗口中的行数和 max(updated_at) 都不变，但内容变了
+    create_data(client, '2020-02-01', 999)
+    changed = client.get('/coronavirus/get_data', params=params, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['etag'] != etag
+    assert [row['confirmed'] for row in changed.json()] == [999, 1, 1]
+
+
+def test_get_cities_not_modified_until_city_created(client):
+    params = {'cursor': '', 'limit': 1000}
+    etag = client.get('/coronavirus/get_cities', params=params).headers['etag']
+    assert client.get('/coronavirus/get_cities', params=params, headers={'If-None-Match': etag}).status_code == 304
+
+    response = client.post('/coronavirus/create_city', json={
+        'province': 'Conditional-2', 'country': 'China', 'country_code': 'CN', 'country_population': 1000,
+    })
+    assert response.status_code == 200, response.text
+    changed = client.get('/coronavirus/get_cities', params=params, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert 'Conditional-2' in [city['province'] for city in changed.json()]
+
+
+def test_home_fragment_cache_invalidated_by_same_second_write(client, city):
+    params = {'city': CITY, 'limit': 3}
+    wait_for_next_second()
+    create_data(client, '2020-01-30', 5)
+    first = client.get('/coronavirus/', params=params)
+    assert first.status_code == 200
+    cached = client.get('/coronavirus/', params=params)
+    assert cached.headers['x-sql-statements'] == '1'
+
+    # 同一秒内再插入一行更早的数据，页面必须重新查询和渲染，而不是返回缓存中的旧片段
+    create_data(client, '2020-01-29', 777)
+    changed = client.get('/coronavirus/', params=params)
+    assert changed.headers['x-sql-statements'] == '2'
+    assert '777' in changed.text
@@ -0,0 +1,13 @@
+"""数据库引擎的预设方案，见 coronavirus/config.py 中的 DB_PROFILES"""
+
+from coronavirus.config import Settings
+
+
+def test_default_profile_does_not_echo_sql(monkeypatch):
+    monkeypatch.delenv('CORONAVIRUS_DB_PROFILE', raising=False)
+    monkeypatch.delenv('CORONAVIRUS_DB_ECHO', raising=False)
+    assert Settings().db_profile == 'dev'
+    assert Settings().db_options()['echo'] is False
+    # 需要调试 SQL 时单独打开
+    monkeypatch.setenv('CORONAVIRUS_DB_ECHO', 'true')
+    assert Settings().db_options()['echo'] is True
@@ -0,0 +1,38 @@
+"""游标分页：游标往返和格式不正确的游标，见 coronavirus/crud.py 中的 encode_cursor / decode_cursor"""
+
+import pytest
+
+from coronavirus.crud import encode_cursor
+
+CITY_CURSORS = ['not base64!', encode_cursor('a', 2), encode_cursor(1, 2), encode_cursor('1'), encode_cursor(True),
+                encode_cursor(), 'eyJpZCI6IDF9']
+DATA_CURSORS = [encode_cursor('2020-01-01'), encode_cursor('2020-01-01', '1'), encode_cursor('2020-13-01', 1),
+                encode_cursor(20200101, 1), encode_cursor('2020-01-01', 1, 2), encode_cursor(None, None)]
+
+
+@pytest.mark.parametrize('cursor', CITY_CURSORS)
+def test_malformed_city_cursor(client, cursor):
+    response = client.get('/coronavirus/get_cities', params={'cursor': cursor})
+    assert response.status_code == 400
+    assert response.json()['detail'] == f'无效的游标：{cursor}'
+
+
+@pytest.mark.parametrize('cursor', DATA_CURSORS)
+def test_malformed_data_cursor(client, cursor):
+    response = client.get('/coronavirus/get_data', params={'cursor': cursor})
+    assert response.status_code == 400
+    assert response.json()['detail'] == f'无效的游标：{cursor}'
+
+
+def test_cursor_pages(client):
+    for i in range(3):
+        client.post('/coronavirus/create_city', json={
+            'province': f'Cursor-{i}', 'country': 'China', 'country_code': 'CN', 'country_population': 1000,
+        })
+    seen, cursor = [], ''
+    while cursor is not None:
+        response = client.get('/coronavirus/get_cities', params={'cursor': cursor, 'limit': 2})
+        assert response.status_code == 200
+        seen += [city['id'] for city in response.json()]
+        cursor = response.headers.get('x-next-cursor')
+    assert seen == sorted(seen) and len(seen) == len(set(seen)) >= 3
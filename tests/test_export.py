@@ -0,0 +1,48 @@
+"""数据导出：CSV 和 NDJSON 的列和值一致，日期时间都是 ISO 8601 格式，见 coronavirus/export.py"""
+
+import csv
+import io
+import json
+from datetime import datetime
+
+import pytest
+
+CITY = 'Export-1'
+
+
+@pytest.fixture(scope='module')
+def city(client):
+    response = client.post('/coronavirus/create_city', json={
+        'province': CITY, 'country': 'China', 'country_code': 'CN', 'country_population': 1000,
+    })
+    assert response.status_code == 200, response.text
+    rows = [{'date': f'2020-05-0{day}', 'confirmed': day * 10, 'deaths': day, 'recovered': 0} for day in (2, 1, 3)]
+    response = client.post('/coronavirus/create_data/bulk', params={'city': CITY}, json=rows)
+    assert response.status_code == 200, response.text
+    return CITY
+
+
+def export(client, fmt: str, **params):
+    response = client.get('/coronavirus/export', params={'format': fmt, 'city': CITY, **params})
+    assert response.status_code == 200
+    assert f'coronavirus_data.{fmt}' in response.headers['content-disposition']
+    return response
+
+
+def test_csv_and_ndjson_match(client, city):
+    csv_rows = list(csv.DictReader(io.StringIO(export(client, 'csv').text)))
+    ndjson_rows = [json.loads(line) for line in export(client, 'ndjson').text.splitlines()]
+    assert [row['date'] for row in ndjson_rows] == ['2020-05-01', '2020-05-02', '2020-05-03']
+    assert [row['confirmed'] for row in ndjson_rows] == [10, 20, 30]
+    assert len(csv_rows) == len(ndjson_rows)
+    for csv_row, ndjson_row in zip(csv_rows, ndjson_rows):
+        assert csv_row == {name: str(value) for name, value in ndjson_row.items()}
+        assert 'T' in csv_row['updated_at']
+        datetime.fromisoformat(csv_row['updated_at'])
+
+
+def test_export_filters(client, city):
+    text = export(client, 'ndjson', start_date='2020-05-02', end_date='2020-05-02').text
+    assert [json.loads(line)['confirmed'] for line in text.splitlines()] == [20]
+    assert client.get('/coronavirus/export', params={'city': 'Export-missing'}).status_code == 404
+    assert client.get('/coronavirus/export', params={'format': 'xml'}).status_code == 422
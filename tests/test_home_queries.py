@@ -0,0 +1,35 @@
+"""/coronavirus/ 首页执行的 SQL 语句数量不随行数增长（N+1 查询的回归测试），见 coronavirus/timing.py 中的 X-SQL-Statements"""
+
+from datetime import date, timedelta
+
+CITIES = [f'Home-{i}' for i in range(5)]
+
+
+def add_day(client, day: date):
+    rows = [{'city': city, 'date': day.isoformat(), 'confirmed': 10, 'deaths': 1, 'recovered': 2} for city in CITIES]
+    response = client.post('/coronavirus/create_data/bulk', json=rows)
+    assert response.status_code == 200, response.text
+
+
+def test_home_statement_count_is_constant(client):
+    for i, city in enumerate(CITIES):
+        response = client.post('/coronavirus/create_city', json={
+            'province': city, 'country': 'China', 'country_code': 'CN', 'country_population': 1000 + i,
+        })
+        assert response.status_code == 200, response.text
+
+    start = date(2020, 3, 1)
+    sizes = []
+    for day in range(3):
+        add_day(client, start + timedelta(days=day))
+        response = client.get('/coronavirus/', params={'limit': 1000})
+        assert response.status_code == 200
+        # 一条查询数据版本（ETag），一条 JOIN 城市查询数据，与行数无关
+        assert response.headers['x-sql-statements'] == '2'
+        sizes.append(response.text.count('<tr'))
+        # 数据没有变化时，表格行来自片段缓存，只剩查询数据版本的一条
+        cached = client.get('/coronavirus/', params={'limit': 1000})
+        assert cached.headers['x-sql-statements'] == '1'
+        assert cached.text == response.text
+    # 确认每一轮确实多渲染了 len(CITIES) 行
+    assert sizes[1] - sizes[0] == sizes[2] - sizes[1] == len(CITIES)
@@ -0,0 +1,86 @@
+"""第四章可续传的分块上传：创建会话、按偏移量 PATCH、HEAD 查询偏移量、冲突、块校验和最终的 sha256 校验，见 tutorial/chapter04.py"""
+
+import hashlib
+
+from tutorial import chapter04
+
+CONTENT = b'0123456789' * 1000
+
+
+def create(client, content: bytes = CONTENT, **extra) -> str:
+    response = client.post('/chatpter04/uploads', json={'filename': 'data.bin', 'size': len(content), **extra})
+    assert response.status_code == 201, response.text
+    assert response.headers['upload-offset'] == '0'
+    return response.json()['id']
+
+
+def patch(client, upload_id: str, offset: int, body: bytes, **headers):
+    return client.patch(f'/chatpter04/uploads/{upload_id}', content=body, headers={'Upload-Offset': str(offset), **headers})
+
+
+def offset_of(client, upload_id: str) -> int:
+    response = client.head(f'/chatpter04/uploads/{upload_id}')
+    assert response.status_code == 200
+    return int(response.headers['upload-offset'])
+
+
+def test_resume_and_finalize(client):
+    upload_id = create(client, sha256=hashlib.sha256(CONTENT).hexdigest())
+    assert patch(client, upload_id, 0, CONTENT[:4000]).status_code == 204
+    assert offset_of(client, upload_id) == 4000
+
+    # 断开之后客户端从 HEAD 返回的偏移量继续上传
+    response = patch(client, upload_id, offset_of(client, upload_id), CONTENT[4000:])
+    assert response.status_code == 204
+    assert response.headers['upload-offset'] == str(len(CONTENT))
+
+    finalized = client.post(f'/chatpter04/uploads/{upload_id}/finalize')
+    assert finalized.status_code == 200, finalized.text
+    assert finalized.json()['status'] == 'complete'
+    assert finalized.json()['sha256'] == hashlib.sha256(CONTENT).hexdigest()
+    assert (chapter04.UPLOAD_DIR / finalized.json()['stored_as']).read_bytes() == CONTENT
+
+
+def test_wrong_offset_conflicts(client):
+    upload_id = create(client)
+    assert patch(client, upload_id, 0, CONTENT[:100]).status_code == 204
+    response = patch(client, upload_id, 0, CONTENT[:100])
+    assert response.status_code == 409
+    assert response.headers['upload-offset'] == '100'
+    finalize = client.post(f'/chatpter04/uploads/{upload_id}/finalize')
+    assert finalize.status_code == 409
+
+
+def test_concurrent_patch_does_not_write(client):
+    upload_id = create(client)
+    # 模拟另一个正在写入的请求持有租约
+    lease = chapter04._claim_session(upload_id, 0)
+    assert lease is not None
+    response = patch(client, upload_id, 0, b'x' * 100)
+    assert response.status_code == 409
+    stored = chapter04.UPLOAD_DIR / client.get(f'/chatpter04/uploads/{upload_id}').json()['stored_as']
+    assert stored.read_bytes() == b'\0' * len(CONTENT)
+
+    chapter04._release_session(upload_id, lease)
+    assert patch(client, upload_id, 0, CONTENT[:100]).status_code == 204
+
+
+def test_chunk_checksum(client):
+    upload_id = create(client)
+    chunk = CONTENT[:1000]
+    bad = patch(client, upload_id, 0, chunk, **{'Upload-Checksum': 'sha256 ' + hashlib.sha256(b'other').hexdigest()})
+    assert bad.status_code == 460
+    assert offset_of(client, upload_id) == 0
+    good = patch(client, upload_id, 0, chunk, **{'Upload-Checksum': 'sha256 ' + hashlib.sha256(chunk).hexdigest()})
+    assert good.status_code == 204
+    assert offset_of(client, upload_id) == 1000
+
+
+def test_declared_size_and_sha256_enforced(client):
+    upload_id = create(client, sha256='0' * 64)
+    assert patch(client, upload_id, 0, CONTENT + b'extra').status_code == 413
+    assert patch(client, upload_id, 0, CONTENT).status_code == 204
+    finalize = client.post(f'/chatpter04/uploads/{upload_id}/finalize')
+    assert finalize.status_code == 422
+    assert client.get(f'/chatpter04/uploads/{upload_id}').json()['status'] == 'corrupt'
+    assert client.post('/chatpter04/uploads', json={'filename': 'a', 'size': -1}).status_code == 422
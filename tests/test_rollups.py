@@ -0,0 +1,54 @@
+"""国家和全球每日汇总表：写入数据时增量更新，同步替换旧数据时减掉旧值，结果与重建一致，见 coronavirus/rollups.py"""
+
+from coronavirus import rollups, sync
+from coronavirus.database import SessionLocal
+
+COUNTRY = 'Rollupland'
+DAY = '1999-01-01'
+
+
+def create_city(client, name: str):
+    response = client.post('/coronavirus/create_city', json={
+        'province': name, 'country': COUNTRY, 'country_code': 'RL', 'country_population': 1000,
+    })
+    assert response.status_code == 200, response.text
+
+
+def stats(client) -> dict:
+    country, = client.get(f'/coronavirus/stats/countries/{COUNTRY}').json()
+    world, = client.get('/coronavirus/stats/global', params={'start_date': DAY, 'end_date': DAY}).json()
+    return {'country': country['confirmed'], 'global': world['confirmed']}
+
+
+def test_rollups_follow_writes(client, tmp_path):
+    create_city(client, 'Rollup-1')
+    create_city(client, 'Rollup-2')
+    response = client.post('/coronavirus/create_data', params={'city': 'Rollup-1'},
+                           json={'date': DAY, 'confirmed': 10, 'deaths': 1, 'recovered': 0})
+    assert response.status_code == 200, response.text
+    response = client.post('/coronavirus/create_data/bulk', json=[
+        {'city': 'Rollup-2', 'date': DAY, 'confirmed': 5, 'deaths': 0, 'recovered': 0},
+    ])
+    assert response.status_code == 200, response.text
+    assert stats(client) == {'country': 15, 'global': 15}
+
+    # 同步会替换 Rollup-2 当天的数据，汇总表先减掉旧值再加上新值
+    header = 'Province_State,Country_Region,Last_Update,Confirmed,Deaths,Recovered\n'
+    (tmp_path / '01-01-1999.csv').write_text(header + f'Rollup-2,{COUNTRY},,7,0,0\n')
+    db = SessionLocal()
+    try:
+        sync.sync_jhu_data(db, tmp_path)
+    finally:
+        db.close()
+    assert stats(client) == {'country': 17, 'global': 17}
+
+    countries = client.get('/coronavirus/stats/countries', params={'day': DAY}).json()
+    assert [c['country'] for c in countries] == [COUNTRY]
+
+    # 重建的结果与增量维护的结果一致
+    db = SessionLocal()
+    try:
+        rollups.rebuild(db)
+    finally:
+        db.close()
+    assert stats(client) == {'country': 17, 'global': 17}
@@ -0,0 +1,47 @@
+"""启动耗时预算：在新的子进程中导入 run 并执行启动事件，见 benchmarks/startup_time.py"""
+
+import os
+import subprocess
+import sys
+
+from benchmarks.startup_time import ROOT, measure
+
+# 预算可以用环境变量覆盖，慢的 CI 机器上可以适当放宽
+IMPORT_BUDGET_MS = float(os.environ.get('STARTUP_IMPORT_BUDGET_MS', '1500'))
+STARTUP_BUDGET_MS = float(os.environ.get('STARTUP_EVENTS_BUDGET_MS', '1000'))
+
+
+def app_env(tmp_path, **extra) -> dict:
+    env = dict(os.environ, CORONAVIRUS_DATABASE_URL=f'sqlite:///{tmp_path / "startup.sqlite3"}')
+    env.update(extra)
+    return env
+
+
+def test_import_and_startup_within_budget(tmp_path):
+    # 取三次中最快的一次，排除机器上其他进程的干扰
+    samples = [measure(app_env(tmp_path)) for _ in range(3)]
+    import_ms = min(s['import_ms'] for s in samples)
+    startup_ms = min(s['startup_ms'] for s in samples)
+    assert import_ms <= IMPORT_BUDGET_MS, f'import run 耗时 {import_ms:.1f}ms，超出预算 {IMPORT_BUDGET_MS:.1f}ms'
+    assert startup_ms <= STARTUP_BUDGET_MS, f'启动事件耗时 {startup_ms:.1f}ms，超出预算 {STARTUP_BUDGET_MS:.1f}ms'
+
+
+def test_selected_router_does_not_import_others(tmp_path):
+    sample = measure(app_env(tmp_path, ROUTERS='chapter03'))
+    assert list(sample['routers']) == ['chapter03']
+    modules = {name for name, _ in sample['slowest']}
+    # 第六章的密码哈希和 JWT 库、新冠病毒疫情跟踪器的 SQLAlchemy 都不应该被导入
+    assert not modules & {'passlib', 'jose', 'sqlalchemy', 'coronavirus.main', 'tutorial.chapter06'}
+
+
+def test_async_only_router_creates_schema(tmp_path):
+    code = (
+        'from fastapi.testclient import TestClient\n'
+        'import run\n'
+        'with TestClient(run.app) as client:\n'
+        '    response = client.get("/coronavirus/async/get_cities")\n'
+        '    assert response.status_code == 200, response.text\n'
+    )
+    env = app_env(tmp_path, ROUTERS='coronavirus_async', CORONAVIRUS_ASYNC_ENABLED='true')
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr[-2000:]
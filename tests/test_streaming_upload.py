@@ -0,0 +1,71 @@
+"""第四章的流式上传：边接收边写入磁盘并计算 sha256，超过大小限制或请求体被截断时删除已写入的文件，见 tutorial/chapter04.py"""
+
+import hashlib
+
+import pytest
+
+from tutorial import chapter04
+
+BOUNDARY = 'test-boundary'
+CONTENT = b'streamed upload ' * 4096
+
+
+def multipart(*parts, end: bool = True) -> bytes:
+    body = b''
+    for name, filename, content in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else '')
+        body += f'--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n'.encode() + content + b'\r\n'
+    if end:
+        body += f'--{BOUNDARY}--\r\n'.encode()
+    return body
+
+
+def post(client, path: str, body: bytes):
+    return client.post(path, content=body, headers={'Content-Type': f'multipart/form-data; boundary={BOUNDARY}'})
+
+
+@pytest.fixture
+def stored_files():
+    """返回一个函数，列出上传目录中的上传文件（不包括上传会话的数据库）"""
+    chapter04.UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    return lambda: {p.name for p in chapter04.UPLOAD_DIR.iterdir() if not p.name.startswith('upload_sessions')}
+
+
+def test_stream_upload_hashes_and_stores(client, stored_files):
+    before = stored_files()
+    response = post(client, '/chatpter04/upload/stream', multipart(('note', None, b'hello'), ('file', 'a.txt', CONTENT)))
+    assert response.status_code == 200, response.text
+    meta, = response.json()['files']
+    assert meta['size'] == len(CONTENT)
+    assert meta['sha256'] == hashlib.sha256(CONTENT).hexdigest()
+    assert response.json()['fields'] == {'note': 'hello'}
+    assert stored_files() - before == {meta['stored_as']}
+    assert (chapter04.UPLOAD_DIR / meta['stored_as']).read_bytes() == CONTENT
+
+
+def test_too_large_file_is_removed(client, stored_files, monkeypatch):
+    monkeypatch.setattr(chapter04, 'UPLOAD_MAX_FILE_SIZE', 1024)
+    before = stored_files()
+    response = post(client, '/chatpter04/upload/stream', multipart(('file', 'big.bin', CONTENT)))
+    assert response.status_code == 413
+    assert stored_files() == before
+
+
+def test_truncated_body_is_rejected_and_removed(client, stored_files):
+    before = stored_files()
+    body = multipart(('file', 'a.txt', CONTENT), end=False)[:-100]
+    response = post(client, '/chatpter04/upload/stream', body)
+    assert response.status_code == 400
+    assert stored_files() == before
+
+
+def test_file_endpoint_streams_and_keeps_nothing(client, stored_files, monkeypatch):
+    before = stored_files()
+    response = post(client, '/chatpter04/file', multipart(('file', 'a.txt', CONTENT)))
+    assert response.status_code == 200, response.text
+    assert response.json() == {'file_size': len(CONTENT), 'sha256': hashlib.sha256(CONTENT).hexdigest()}
+    assert stored_files() == before
+
+    monkeypatch.setattr(chapter04, 'UPLOAD_MAX_FILE_SIZE', 1024)
+    assert post(client, '/chatpter04/file', multipart(('file', 'a.txt', CONTENT))).status_code == 413
+    assert stored_files() == before
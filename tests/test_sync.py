@@ -0,0 +1,46 @@
+"""JHU 每日报告的同步：不同国家的同名省/州是不同的城市，见 coronavirus/sync.py"""
+
+from coronavirus import rollups, sync
+from coronavirus.database import SessionLocal
+from coronavirus.models import City
+
+HEADER = 'Province_State,Country_Region,Last_Update,Confirmed,Deaths,Recovered\n'
+
+
+def write_report(directory, name: str, rows: str):
+    path = directory / name
+    path.write_text(HEADER + rows, encoding='utf-8')
+    return path
+
+
+def test_same_province_in_different_countries(client, tmp_path):
+    write_report(tmp_path, '03-22-2020.csv', 'Unknown,Chile,,10,1,0\nUnknown,Peru,,20,2,0\nUnknown,Chile,,5,0,0\n')
+    db = SessionLocal()
+    try:
+        assert sync.sync_jhu_data(db, tmp_path) == {'files': 1, 'rows': 2}
+        cities = {c.country: c.province for c in db.query(City).filter(City.country.in_(['Chile', 'Peru']))}
+        assert cities == {'Chile': 'Unknown (Chile)', 'Peru': 'Unknown (Peru)'}
+        assert [s.confirmed for s in rollups.get_country_stats(db, 'Chile')] == [15]
+        assert [s.confirmed for s in rollups.get_country_stats(db, 'Peru')] == [20]
+
+        # 之后只有一个国家出现这个名称时，仍然同步到之前创建的城市，不会再创建新城市
+        (tmp_path / '03-22-2020.csv').unlink()
+        write_report(tmp_path, '03-23-2020.csv', 'Unknown,Peru,,25,2,0\n')
+        assert sync.sync_jhu_data(db, tmp_path) == {'files': 1, 'rows': 1}
+        assert db.query(City).filter(City.country == 'Peru').count() == 1
+        assert [s.confirmed for s in rollups.get_country_stats(db, 'Peru')] == [20, 25]
+    finally:
+        db.close()
+
+
+def test_province_taken_by_another_country(client, tmp_path):
+    write_report(tmp_path, '04-01-2020.csv', 'Diamond Princess,Canada,,3,0,0\n')
+    write_report(tmp_path, '04-02-2020.csv', 'Diamond Princess,Australia,,7,0,0\nDiamond Princess,Canada,,4,0,0\n')
+    db = SessionLocal()
+    try:
+        assert sync.sync_jhu_data(db, tmp_path) == {'files': 2, 'rows': 3}
+        cities = {c.country: c.province for c in db.query(City).filter(City.province.like('Diamond Princess%'))}
+        assert cities == {'Canada': 'Diamond Princess', 'Australia': 'Diamond Princess (Australia)'}
+        assert [s.confirmed for s in rollups.get_country_stats(db, 'Canada')] == [3, 4]
+    finally:
+        db.close()
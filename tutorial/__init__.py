@@ -1,6 +1,17 @@
-from .chapter03 import app03
-from .chapter04 import app04
-from .chapter05 import app05
-from .chapter06 import app06
-from .chapter07 import app07
-from .chapter08 import app08
\ No newline at end of file
+# 各章的路由在第一次访问时才导入（PEP 562 模块级 __getattr__），from tutorial import app06 只会导入 chapter06，
+# 不会连带导入其他章节及其依赖（例如 chapter06 的 passlib、bcrypt 和 jose）
+_routers = {
+    'app03': 'chapter03',
+    'app04': 'chapter04',
+    'app05': 'chapter05',
+    'app06': 'chapter06',
+    'app07': 'chapter07',
+    'app08': 'chapter08',
+}
+
+
+def __getattr__(name):
+    if name in _routers:
+        # 用 __import__ 而不是 importlib.import_module，python -X importtime 中才能看到这些模块
+        return getattr(__import__(f'{__name__}.{_routers[name]}', fromlist=[name]), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
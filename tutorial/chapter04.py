@@ -1,7 +1,8 @@
 """本章讲解：响应模型示例"""
 
+import hashlib
 from fastapi import APIRouter,status, Form, File, UploadFile
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, conint
 from typing import Optional, List, Union
 
 
@@ -93,10 +94,8 @@ async def login(username: str=Form(...), password: str = Form(...)):
 """Request Files 单文件、多文件上传以及参数详解"""
 
 # 需要从fastapi中导入File, UploadFile
-@app04.post("/file")
-async def file_(file: bytes = File(...)): # 如果要上传多个文件 files: List[bytes] = File(...)
-    """使用File类，文件内容会以bytes的形式读入内存，适合于上传小文件"""
-    return {"file_size": len(file)}
+# 最简单的写法是 file: bytes = File(...)（多个文件 files: List[bytes] = File(...)），文件内容会以 bytes 的形式读入内存，
+# 只适合于上传小文件；/file 接口现在使用下面的流式上传，定义在 /upload/stream 之后
 
 
 @app04.post("/upload_files")
@@ -111,13 +110,464 @@ async def upload_files(files:List[UploadFile] = File(...)): # 如果要上传单
     """
     results = []
     for file in files:
-        contents = await file.read()
-        print(contents)
-    # return {"filename": files[0].filename, "content_type": files[0].content_type}
-        results.append({"filename": file.filename, "content_type": file.content_type, "contents": contents, "size": file.size})
+        # 分块读取并计算摘要，不把整个文件读入内存，也不把文件内容放进响应里
+        digest = hashlib.sha256()
+        size = 0
+        while chunk := await file.read(1024 * 1024):  # 每次读取 1MB
+            digest.update(chunk)
+            size += len(chunk)
+        results.append({"filename": file.filename, "content_type": file.content_type, "size": size, "sha256": digest.hexdigest()})
     return results
 
 
+"""流式上传：边接收边写入磁盘"""
+# File(...) 和 UploadFile 都要等整个请求体解析完之后才会调用路由函数：bytes 把整个文件读入内存，
+# UploadFile 超过 1MB 后会写入临时文件，但文件大小的限制也只能在全部接收之后才能检查。
+# /upload/stream 直接读取 request.stream()，用 python-multipart 的底层解析器逐块解析 multipart/form-data：
+#     1、每个文件按块写入 UPLOAD_DIR 下的新文件，同时计算 sha256，内存占用只和块大小有关，和文件大小、并发上传数无关；
+#     2、先检查 Content-Length，再在接收过程中检查单个文件和整个请求的大小，超过限制立即返回 413，并删除已经写入的部分文件；
+#     3、写文件和计算摘要放到线程池中执行，不阻塞事件循环；响应中只返回文件的元数据。
+# 通过环境变量配置：UPLOAD_DIR、UPLOAD_MAX_FILE_SIZE、UPLOAD_MAX_REQUEST_SIZE（字节）
+import os
+import tempfile
+import uuid
+from pathlib import Path
+from fastapi import HTTPException, Request
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", Path(tempfile.gettempdir()) / "fastapi_tutorial_uploads"))
+UPLOAD_MAX_FILE_SIZE = int(os.getenv("UPLOAD_MAX_FILE_SIZE", 1024 ** 3))  # 默认单个文件 1 GiB
+UPLOAD_MAX_REQUEST_SIZE = int(os.getenv("UPLOAD_MAX_REQUEST_SIZE", 4 * 1024 ** 3))  # 默认整个请求 4 GiB
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# 普通表单字段（不是文件）保存在内存中，限制它们的总大小
+UPLOAD_MAX_FIELDS_SIZE = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadIncomplete(Exception):
+    pass
+
+
+class StreamedFile:
+    def __init__(self, field: str, filename: str, content_type: str):
+        self.field = field
+        self.filename = filename
+        self.content_type = content_type
+        # 不使用客户端提供的文件名作为路径，避免路径穿越，只保留扩展名
+        self.stored_as = uuid.uuid4().hex + "".join(Path(filename).suffixes[-1:])
+        self.path = UPLOAD_DIR / self.stored_as
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self.file = open(self.path, "wb")
+
+    def write(self, data: bytes):
+        self.digest.update(data)
+        self.file.write(data)
+
+    def metadata(self) -> dict:
+        return {"field": self.field, "filename": self.filename, "content_type": self.content_type,
+                "stored_as": self.stored_as, "size": self.size, "sha256": self.digest.hexdigest()}
+
+
+class StreamingUpload:
+    """把 MultipartParser 的回调转换为事件列表，每喂入一块数据后在 process() 中按顺序处理"""
+
+    def __init__(self, boundary: bytes):
+        self.events = []
+        self.files = []
+        self.fields = {}
+        self.fields_size = 0
+        self.received = 0
+        self._header_field = b""
+        self._header_value = b""
+        self._headers = {}
+        self._current = None
+        # 收到结束分隔符（on_end）时为 True；请求体在结束分隔符或某个部分结束之前被截断时，不能当作完整的上传
+        self.finished = False
+        self.parser = MultipartParser(boundary, {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": lambda: self.events.append(("begin", dict(self._headers))),
+            "on_part_data": lambda data, start, end: self.events.append(("data", bytes(data[start:end]))),
+            "on_part_end": lambda: self.events.append(("end", None)),
+            "on_end": self.on_end,
+        })
+
+    def on_part_begin(self):
+        self._headers = {}
+
+    def on_end(self):
+        self.finished = True
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field, self._header_value = b"", b""
+
+    async def feed(self, chunk: bytes):
+        self.received += len(chunk)
+        if self.received > UPLOAD_MAX_REQUEST_SIZE:
+            raise UploadTooLarge(f"请求体超过 {UPLOAD_MAX_REQUEST_SIZE} 字节")
+        self.parser.write(chunk)
+        events, self.events = self.events, []
+        for kind, value in events:
+            await self.process(kind, value)
+
+    async def process(self, kind: str, value):
+        if kind == "begin":
+            _, options = parse_options_header(value.get(b"content-disposition", b""))
+            field = options.get(b"name", b"").decode("utf-8", "replace")
+            if b"filename" in options:
+                filename = options[b"filename"].decode("utf-8", "replace")
+                content_type = value.get(b"content-type", b"application/octet-stream").decode("latin-1")
+                self._current = await run_in_threadpool(StreamedFile, field, filename, content_type)
+                self.files.append(self._current)
+            else:
+                self._current = field
+                self.fields[field] = b""
+        elif kind == "data":
+            if isinstance(self._current, StreamedFile):
+                self._current.size += len(value)
+                if self._current.size > UPLOAD_MAX_FILE_SIZE:
+                    raise UploadTooLarge(f"文件 {self._current.filename} 超过 {UPLOAD_MAX_FILE_SIZE} 字节")
+                await run_in_threadpool(self._current.write, value)
+            else:
+                self.fields_size += len(value)
+                if self.fields_size > UPLOAD_MAX_FIELDS_SIZE:
+                    raise UploadTooLarge(f"表单字段超过 {UPLOAD_MAX_FIELDS_SIZE} 字节")
+                self.fields[self._current] += value
+        elif kind == "end":
+            if isinstance(self._current, StreamedFile):
+                await run_in_threadpool(self._current.file.close)
+            self._current = None
+
+    def check_complete(self):
+        # _current 不为 None 说明最后一个部分没有收到 on_part_end
+        if not self.finished or self._current is not None:
+            raise UploadIncomplete("没有收到结束分隔符，请求体可能被截断")
+
+    def close(self, remove: bool):
+        """关闭所有文件，出错时删除已经写入的文件"""
+        for streamed in self.files:
+            streamed.file.close()
+            if remove:
+                streamed.path.unlink(missing_ok=True)
+
+
+async def receive_upload(request: Request) -> StreamingUpload:
+    """把 multipart/form-data 请求体中的文件流式写入 UPLOAD_DIR，出错时删除已经写入的文件并抛出 HTTPException"""
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="请使用 multipart/form-data 上传文件")
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() and int(content_length) > UPLOAD_MAX_REQUEST_SIZE:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"请求体超过 {UPLOAD_MAX_REQUEST_SIZE} 字节")
+
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    upload = StreamingUpload(options[b"boundary"])
+    try:
+        async for chunk in request.stream():
+            await upload.feed(chunk)
+        upload.parser.finalize()
+        upload.check_complete()
+    except UploadTooLarge as e:
+        upload.close(remove=True)
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except (MultipartParseError, UploadIncomplete) as e:
+        # 分隔符不对、格式错误或者被截断的请求体是客户端的错误
+        upload.close(remove=True)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"multipart 请求体格式错误：{e}")
+    except BaseException:
+        upload.close(remove=True)
+        raise
+    upload.close(remove=False)
+    return upload
+
+
+@app04.post("/upload/stream")
+async def upload_stream(request: Request):
+    """流式上传 multipart/form-data 格式的一个或多个文件，文件保存在 UPLOAD_DIR 中，只返回元数据"""
+    upload = await receive_upload(request)
+    return {
+        "files": [streamed.metadata() for streamed in upload.files],
+        "fields": {name: value.decode("utf-8", "replace") for name, value in upload.fields.items()},
+        "received": upload.received,
+    }
+
+
+@app04.post("/file")
+async def file_(request: Request):
+    """
+    上传表单字段 file 中的一个文件，返回文件的大小和 sha256。和 /upload/stream 一样边接收边写入临时文件，
+    不把整个文件读入内存，大小超过限制时返回 413；文件不需要保存，返回之前删除
+    """
+    upload = await receive_upload(request)
+    await run_in_threadpool(upload.close, True)
+    files = [streamed for streamed in upload.files if streamed.field == "file"]
+    if not files:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="缺少文件字段 file")
+    return {"file_size": files[0].size, "sha256": files[0].digest.hexdigest()}
+
+
+"""可续传的分块上传"""
+# 网络不稳定时，几个 GB 的文件传到一半断开就要从头再传。这里提供一组上传会话接口（与 tus 协议的思路相同）：
+#     POST   /uploads                   创建会话，声明文件名、大小和（可选的）sha256，服务器预先分配同样大小的文件
+#     HEAD   /uploads/{upload_id}       查询已经接收的字节数，响应头 Upload-Offset；GET 返回同样信息的 JSON
+#     PATCH  /uploads/{upload_id}       请求头 Upload-Offset 必须等于服务器记录的偏移量，请求体从这个位置开始直接写入文件；
+#                                       可选的请求头 Upload-Checksum: sha256 <十六进制摘要> 用于校验本次上传的这一块
+#     POST   /uploads/{upload_id}/finalize  所有字节都接收之后，校验整个文件的 sha256，不再复制或拼接文件
+# 断开之后客户端先 HEAD 查询偏移量，再从这个偏移量继续 PATCH。
+# 会话状态保存在 UPLOAD_DIR 下的 SQLite 数据库中，多个工作进程共享同一个目录即可由任意一个进程继续同一个会话；
+# 同一个会话同一时间只能有一个 PATCH 写入：PATCH 在写文件之前先用条件更新（偏移量未变、没有其他请求持有租约）领取租约，
+# 领取失败的请求直接返回 409，不会写入任何字节；之后推进偏移量也要求仍然持有租约。
+# 租约在 UPLOAD_LEASE_SECONDS 秒后过期，写入过程中定期续期，持有租约的进程崩溃后会话不会一直被锁住。
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, Optional
+from fastapi import Header, Response
+
+UPLOAD_SESSIONS_DB = UPLOAD_DIR / "upload_sessions.sqlite3"
+# PATCH 过程中每写入这么多字节就保存一次偏移量，连接中途断开时已经写入的部分不用重传
+UPLOAD_CHECKPOINT_SIZE = 8 * 1024 * 1024
+UPLOAD_LEASE_SECONDS = 60
+
+
+class CreateUploadSession(BaseModel):
+    filename: str
+    size: conint(ge=0)
+    content_type: str = "application/octet-stream"
+    sha256: Optional[str] = None
+
+
+@contextmanager
+def _sessions_db() -> Iterator[sqlite3.Connection]:
+    """每次操作打开一个新连接，with 语句块正常结束时提交事务，最后关闭连接"""
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(UPLOAD_SESSIONS_DB, timeout=10)
+    conn.row_factory = sqlite3.Row
+    try:
+        with conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS upload_sessions ("
+                " id TEXT PRIMARY KEY, filename TEXT NOT NULL, content_type TEXT NOT NULL, stored_as TEXT NOT NULL,"
+                " size INTEGER NOT NULL, \"offset\" INTEGER NOT NULL DEFAULT 0, sha256 TEXT, status TEXT NOT NULL,"
+                " lease TEXT, lease_expires REAL, created_at TEXT NOT NULL, updated_at TEXT NOT NULL)"
+            )
+            yield conn
+    finally:
+        conn.close()
+
+
+def _get_session(upload_id: str) -> Optional[dict]:
+    with _sessions_db() as conn:
+        row = conn.execute("SELECT * FROM upload_sessions WHERE id = ?", (upload_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def _create_session(data: CreateUploadSession) -> dict:
+    upload_id = uuid.uuid4().hex
+    stored_as = upload_id + "".join(Path(data.filename).suffixes[-1:])
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    # 预先分配文件：支持 posix_fallocate 的系统上真正分配磁盘空间，空间不足时在创建会话时就报错；其他系统退回到稀疏文件
+    with open(UPLOAD_DIR / stored_as, "wb") as f:
+        if data.size and hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(f.fileno(), 0, data.size)
+        else:
+            f.truncate(data.size)
+    now = datetime.utcnow().isoformat(timespec="seconds")
+    with _sessions_db() as conn:
+        conn.execute(
+            "INSERT INTO upload_sessions (id, filename, content_type, stored_as, size, \"offset\", sha256, status, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?, ?)",
+            (upload_id, data.filename, data.content_type, stored_as, data.size, data.sha256 and data.sha256.lower(),
+             "complete" if data.size == 0 else "uploading", now, now),
+        )
+    return _get_session(upload_id)
+
+
+def _claim_session(upload_id: str, offset: int) -> Optional[str]:
+    """偏移量仍然是 offset 且没有其他请求持有有效的租约时领取租约，返回租约 ID，领取失败返回 None"""
+    lease, now = uuid.uuid4().hex, time.time()
+    with _sessions_db() as conn:
+        cursor = conn.execute(
+            "UPDATE upload_sessions SET lease = ?, lease_expires = ?, updated_at = ?"
+            " WHERE id = ? AND \"offset\" = ? AND status = 'uploading' AND (lease IS NULL OR lease_expires < ?)",
+            (lease, now + UPLOAD_LEASE_SECONDS, datetime.utcnow().isoformat(timespec="seconds"), upload_id, offset, now),
+        )
+    return lease if cursor.rowcount == 1 else None
+
+
+def _renew_lease(upload_id: str, lease: str) -> bool:
+    with _sessions_db() as conn:
+        cursor = conn.execute("UPDATE upload_sessions SET lease_expires = ? WHERE id = ? AND lease = ?",
+                              (time.time() + UPLOAD_LEASE_SECONDS, upload_id, lease))
+    return cursor.rowcount == 1
+
+
+def _release_session(upload_id: str, lease: str):
+    with _sessions_db() as conn:
+        conn.execute("UPDATE upload_sessions SET lease = NULL, lease_expires = NULL WHERE id = ? AND lease = ?", (upload_id, lease))
+
+
+def _advance_offset(upload_id: str, lease: str, old: int, new: int) -> bool:
+    """仍然持有租约且偏移量仍然是 old 时才推进到 new（同时续期租约），返回是否成功"""
+    with _sessions_db() as conn:
+        cursor = conn.execute(
+            "UPDATE upload_sessions SET \"offset\" = ?, lease_expires = ?, updated_at = ?"
+            " WHERE id = ? AND lease = ? AND \"offset\" = ? AND status = 'uploading'",
+            (new, time.time() + UPLOAD_LEASE_SECONDS, datetime.utcnow().isoformat(timespec="seconds"), upload_id, lease, old),
+        )
+    return cursor.rowcount == 1
+
+
+def _set_status(upload_id: str, status_: str):
+    with _sessions_db() as conn:
+        conn.execute("UPDATE upload_sessions SET status = ?, updated_at = ? WHERE id = ?",
+                     (status_, datetime.utcnow().isoformat(timespec="seconds"), upload_id))
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _session_metadata(session: dict) -> dict:
+    return {key: session[key] for key in ("id", "filename", "content_type", "stored_as", "size", "offset", "sha256", "status")}
+
+
+async def _load_session(upload_id: str) -> dict:
+    session = await run_in_threadpool(_get_session, upload_id)
+    if session is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="上传会话不存在")
+    return session
+
+
+@app04.post("/uploads", status_code=status.HTTP_201_CREATED)
+async def create_upload(data: CreateUploadSession, response: Response):
+    if data.size > UPLOAD_MAX_FILE_SIZE:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"文件大小不能超过 {UPLOAD_MAX_FILE_SIZE} 字节")
+    session = await run_in_threadpool(_create_session, data)
+    response.headers["Location"] = f"/chatpter04/uploads/{session['id']}"
+    response.headers["Upload-Offset"] = "0"
+    return _session_metadata(session)
+
+
+@app04.head("/uploads/{upload_id}")
+async def upload_offset(upload_id: str):
+    session = await _load_session(upload_id)
+    return Response(headers={"Upload-Offset": str(session["offset"]), "Upload-Length": str(session["size"]), "Cache-Control": "no-store"})
+
+
+@app04.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str, response: Response):
+    session = await _load_session(upload_id)
+    response.headers["Upload-Offset"] = str(session["offset"])
+    response.headers["Cache-Control"] = "no-store"
+    return _session_metadata(session)
+
+
+@app04.patch("/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def upload_chunk(upload_id: str, request: Request, upload_offset: int = Header(..., alias="Upload-Offset"),
+                       upload_checksum: Optional[str] = Header(None, alias="Upload-Checksum")):
+    session = await _load_session(upload_id)
+    if session["status"] != "uploading":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"上传会话的状态为 {session['status']}，不能继续上传")
+    if upload_offset != session["offset"]:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload-Offset 与服务器记录的偏移量不一致",
+                            headers={"Upload-Offset": str(session["offset"])})
+    expected_checksum = None
+    if upload_checksum is not None:
+        algorithm, _, expected_checksum = upload_checksum.partition(" ")
+        if algorithm.lower() != "sha256" or not expected_checksum:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Upload-Checksum 的格式为 sha256 <十六进制摘要>")
+        expected_checksum = expected_checksum.strip().lower()
+
+    # 先领取租约再写文件，同时到达的另一个 PATCH 领取失败，不会覆盖这个请求写入的数据
+    lease = await run_in_threadpool(_claim_session, upload_id, session["offset"])
+    if lease is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="该上传会话正在被另一个请求写入",
+                            headers={"Upload-Offset": str(session["offset"])})
+    try:
+        return await _write_chunk(upload_id, session, lease, request, expected_checksum)
+    finally:
+        await run_in_threadpool(_release_session, upload_id, lease)
+
+
+async def _write_chunk(upload_id: str, session: dict, lease: str, request: Request, expected_checksum: Optional[str]) -> Response:
+    # 有块校验时，只有整块校验通过才推进偏移量；没有块校验时，每写入 UPLOAD_CHECKPOINT_SIZE 字节保存一次偏移量
+    digest = hashlib.sha256() if expected_checksum else None
+    committed = offset = session["offset"]
+    renewed = time.monotonic()
+    f = await run_in_threadpool(open, UPLOAD_DIR / session["stored_as"], "r+b")
+    try:
+        await run_in_threadpool(f.seek, offset)
+        async for chunk in request.stream():
+            if offset + len(chunk) > session["size"]:
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="上传的数据超过了声明的文件大小")
+            # 租约过期之前续期，续期失败（租约已经过期并被其他请求领取）时立即停止写入
+            if time.monotonic() - renewed > UPLOAD_LEASE_SECONDS / 3:
+                if not await run_in_threadpool(_renew_lease, upload_id, lease):
+                    raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="上传会话的租约已过期")
+                renewed = time.monotonic()
+            await run_in_threadpool(f.write, chunk)
+            if digest is not None:
+                digest.update(chunk)
+            offset += len(chunk)
+            if digest is None and offset - committed >= UPLOAD_CHECKPOINT_SIZE:
+                await run_in_threadpool(f.flush)
+                if not await run_in_threadpool(_advance_offset, upload_id, lease, committed, offset):
+                    raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="上传会话的租约已过期")
+                committed, renewed = offset, time.monotonic()
+    except ClientDisconnect:
+        # 连接中途断开：已经写入的部分在下面保存偏移量，客户端重新连接后从这里继续
+        if digest is not None:
+            return Response(status_code=status.HTTP_204_NO_CONTENT)
+    finally:
+        await run_in_threadpool(f.close)
+
+    if digest is not None and digest.hexdigest() != expected_checksum:
+        # 460 是 tus 协议中的 Checksum Mismatch
+        raise HTTPException(status_code=460, detail="本块数据的 sha256 校验失败，请从原偏移量重新上传",
+                            headers={"Upload-Offset": str(committed)})
+    if offset != committed and not await run_in_threadpool(_advance_offset, upload_id, lease, committed, offset):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="上传会话的租约已过期")
+    return Response(status_code=status.HTTP_204_NO_CONTENT, headers={"Upload-Offset": str(offset)})
+
+
+@app04.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str):
+    session = await _load_session(upload_id)
+    if session["offset"] != session["size"]:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"文件尚未上传完成：{session['offset']}/{session['size']}",
+                            headers={"Upload-Offset": str(session["offset"])})
+    sha256 = await run_in_threadpool(_file_sha256, UPLOAD_DIR / session["stored_as"])
+    if session["sha256"] and sha256 != session["sha256"]:
+        await run_in_threadpool(_set_status, upload_id, "corrupt")
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="文件的 sha256 与创建会话时声明的不一致")
+    await run_in_threadpool(_set_status, upload_id, "complete")
+    session.update(status="complete", sha256=sha256)
+    return _session_metadata(session)
+
+
 """FastAPI项目的静态文件配置【见run.py文件】"""
 
 
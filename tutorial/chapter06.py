@@ -144,7 +144,9 @@ class Token(BaseModel):
 # 指定哈希算法为 bcrypt，并将其作为参数传递给 schemes 参数。 bcrypt 是一种常用的密码哈希算法，可以生成安全且不可逆的哈希值。
 # 将 deprecated 参数设置为 "auto"，表示使用所有已弃用的哈希算法，并在必要时自动迁移到更强大和更安全的哈希算法。
 # 这样可以确保系统中使用的密码哈希算法始终是最新和最安全的。
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt 的计算成本（2 的 BCRYPT_ROUNDS 次方轮），提高成本后，旧的哈希会在用户下次登录时自动用新的成本重新计算，见 jwt_authenticate_user
+BCRYPT_ROUNDS = 12
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/chatpter06/jwt/token")
 
@@ -161,15 +163,134 @@ def jwt_get_user(db, username: str):
         user_dict = db[username]
         return UserInDB(**user_dict)
     
+"""在事件循环之外执行 bcrypt"""
+# 每次 bcrypt 校验需要几十到几百毫秒的 CPU 时间，直接在 async def 的路由中调用会阻塞整个事件循环，登录高峰时其他所有路由都会卡住。
+# PasswordHasherPool 把校验和哈希放到单独的线程池（bcrypt 计算时会释放 GIL）或进程池中执行：
+#     1、同时执行的任务数不超过池的大小，多出来的任务排队，排队的任务超过 max_waiting 时直接返回 503，避免请求无限堆积；
+#     2、记录正在执行、正在排队、已完成、被拒绝的任务数和累计的排队/执行时间，通过 /jwt/password_pool 查看。
+# 通过环境变量配置：PASSWORD_POOL=thread|process，PASSWORD_POOL_WORKERS（默认为 CPU 核数），PASSWORD_POOL_MAX_WAITING（默认 100）
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import anyio
+
+
+class PasswordPoolBusy(Exception):
+    pass
+
+
+class PasswordHasherPool:
+    def __init__(self, kind: str = "thread", workers: Optional[int] = None, max_waiting: int = 100):
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        self.max_waiting = max_waiting
+        if kind == "process":
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        # 限制同时执行的任务数，在第一次 run() 时才创建：asyncio.Semaphore 会绑定第一次使用它的事件循环，
+        # 换一个事件循环（新的 TestClient、reload、基准测试中先进程内再 uvicorn）使用时会报 RuntimeError，所以使用 anyio 的
+        # CapacityLimiter；anyio 3.x 需要在事件循环中才能创建 CapacityLimiter，不能在导入模块时创建
+        self._limiter: Optional[anyio.CapacityLimiter] = None
+        # 以下计数只在事件循环线程中修改，不需要加锁
+        self.running = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    async def run(self, function, *args):
+        if self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise PasswordPoolBusy()
+        if self._limiter is None:
+            self._limiter = anyio.CapacityLimiter(self.workers)
+        queued = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._limiter.acquire()
+        finally:
+            self.waiting -= 1
+        started = time.perf_counter()
+        self.wait_seconds += started - queued
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self.run_seconds += time.perf_counter() - started
+            self._limiter.release()
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "max_waiting": self.max_waiting,
+            "running": self.running,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.wait_seconds / self.completed * 1000, 3) if self.completed else 0.0,
+            "avg_run_ms": round(self.run_seconds / self.completed * 1000, 3) if self.completed else 0.0,
+        }
+
+
+password_pool = PasswordHasherPool(
+    kind=os.getenv("PASSWORD_POOL", "thread"),
+    workers=int(os.getenv("PASSWORD_POOL_WORKERS", "0")) or None,
+    max_waiting=int(os.getenv("PASSWORD_POOL_MAX_WAITING", "100")),
+)
+
+
+# 在池中执行的函数必须定义在模块顶层，进程池需要通过 pickle 按名称找到它们
+def _verify_and_update(plain_password: str, hashed_password: str):
+    # 校验通过且哈希使用的成本已经过时的时候，第二个返回值是用当前成本重新计算的哈希，否则为 None
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+def _hash_password(plain_password: str) -> str:
+    return pwd_context.hash(plain_password)
+
+
+async def get_password_hash(plain_password: str) -> str:
+    return await password_pool.run(_hash_password, plain_password)
+
+
+# 用户不存在时也要校验一次同样成本的哈希，让“用户不存在”和“密码错误”的响应时间相同，避免通过响应时间探测用户名。
+# 这个哈希在应用启动时计算（见下面 app06 的 startup 事件），否则第一个不存在的用户登录时要多计算一次哈希
+_dummy_hash: Optional[str] = None
+
+
+async def get_dummy_hash() -> str:
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = await get_password_hash("dummy password for unknown users")
+    return _dummy_hash
+
+
+@app06.on_event("startup")
+async def warm_dummy_hash():
+    await get_dummy_hash()
+
+
 # 用于验证用户是否已注册并且密码是否正确，username：用户名。password：用户输入的密码。
-def jwt_authenticate_user(db, username: str, password: str):
+async def jwt_authenticate_user(db, username: str, password: str):
     user = jwt_get_user(db=db, username=username)
-    if not user:
-        return False
-    if not verify_password(password, user.hashed_password):
+    hashed_password = user.hashed_password if user else await get_dummy_hash()
+    verified, new_hash = await password_pool.run(_verify_and_update, password, hashed_password)
+    if not user or not verified:
         return False
+    if new_hash is not None:
+        # 提高了 BCRYPT_ROUNDS 之后，用户登录时用新的成本保存哈希
+        db[username]["hashed_password"] = new_hash
+        user.hashed_password = new_hash
     return user
 
+
 # 用于创建 JWT 认证的 token，expires_delta：token的过期时间，可选参数，默认为 15 分钟
 def created_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     # 将data字典参数复制到新的变量to_encode中，以便稍后将其编码为JWT。
@@ -184,8 +305,71 @@ def created_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt  # 返回编码后的JWT字符串。
 
 
+"""已验证 JWT 的缓存"""
+# jwt.decode 每次都要做 HMAC 校验和 JSON 解析，同一个令牌在过期之前会被反复使用，所以把验证通过的令牌缓存起来。
+#     1、键是令牌的签名部分（第三段），值中同时保存签名的原文（前两段），命中时还要比较原文，防止有人拼接别的头部和载荷冒用已缓存的签名；
+#     2、条目在令牌的 exp 时间过期，过期的条目在访问时删除；缓存满了以后淘汰最久没有使用的条目（LRU）；
+#     3、缓存的是用户对象，jwt_get_current_user 和依赖它的 jwt_get_current_active_user 共用同一个结果；
+#        用户被禁用（jwt_disable_user）时删除该用户的所有条目，之后的请求重新查询用户，得到的 disabled 是最新的。
+import threading
+from collections import OrderedDict
+
+
+class VerifiedTokenCache:
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # 签名 -> (签名原文, 用户对象, 过期时间戳)
+        self._lock = threading.Lock()  # 同步的路由和依赖项在线程池中执行，读写都在锁内完成
+
+    def get(self, token: str):
+        signing_input, _, signature = token.rpartition(".")
+        with self._lock:
+            entry = self._entries.get(signature)
+            if entry is None:
+                return None
+            cached_input, user, expire = entry
+            if cached_input != signing_input:
+                return None
+            if expire <= time.time():
+                del self._entries[signature]
+                return None
+            self._entries.move_to_end(signature)
+            return user
+
+    def put(self, token: str, user, expire: float):
+        signing_input, _, signature = token.rpartition(".")
+        with self._lock:
+            self._entries[signature] = (signing_input, user, expire)
+            self._entries.move_to_end(signature)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, username: str):
+        with self._lock:
+            for signature in [k for k, (_, user, _) in self._entries.items() if user.username == username]:
+                del self._entries[signature]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+verified_tokens = VerifiedTokenCache()
+
+
+def jwt_disable_user(username: str):
+    """禁用用户，并让该用户已缓存的令牌失效"""
+    if username in fake_users_db:
+        fake_users_db[username]["disabled"] = True
+    verified_tokens.invalidate_user(username)
+
+
 # token为请求头中的token，使用Depends进行依赖注入，即在函数调用时会自动注入oauth2_scheme。
 async def jwt_get_current_user(token: str = Depends(oauth2_scheme)):
+    # 先查缓存，命中时不需要再验证签名和查询用户
+    user = verified_tokens.get(token)
+    if user is not None:
+        return user
     # 用于在验证用户凭据失败时抛出异常。
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED, # 设置HTTP状态码为401，表示未授权。
@@ -205,6 +389,9 @@ async def jwt_get_current_user(token: str = Depends(oauth2_scheme)):
     user = jwt_get_user(db=fake_users_db, username=username) # 获取用户名为username的用户。
     if user is None:
         raise credentials_exception
+    # jose 已经校验过 exp，没有 exp 的令牌不缓存
+    if isinstance(payload.get("exp"), (int, float)):
+        verified_tokens.put(token, user, payload["exp"])
     return user # 如果一切正常，返回用户对象。
 
 
@@ -216,7 +403,10 @@ async def jwt_get_current_active_user(current_user: User = Depends(jwt_get_curre
 
 @app06.post("/jwt/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm=Depends()):
-    user = jwt_authenticate_user(db=fake_users_db, username=form_data.username, password=form_data.password)
+    try:
+        user = await jwt_authenticate_user(db=fake_users_db, username=form_data.username, password=form_data.password)
+    except PasswordPoolBusy:
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, detail="登录请求过多，请稍后再试", headers={"Retry-After": "1"})
     if not user:
         raise HTTPException(
             status.HTTP_401_UNAUTHORIZED,
@@ -234,3 +424,16 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm=Depends())
 @app06.get("/jwt/users/me")
 async def jwt_read_users_me(current_user: User = Depends(jwt_get_current_active_user)):
     return current_user
+
+
+@app06.post("/jwt/users/me/disable")
+async def jwt_disable_users_me(current_user: User = Depends(jwt_get_current_active_user)):
+    """禁用当前用户（注销账号），同时删除该用户已缓存的令牌，之后使用这些令牌的请求立即返回 Inactive user"""
+    jwt_disable_user(current_user.username)
+    return {"username": current_user.username, "disabled": True}
+
+
+@app06.get("/jwt/password_pool")
+async def password_pool_stats(current_user: User = Depends(jwt_get_current_active_user)):
+    """密码校验池的状态：正在执行、排队、已完成、被拒绝的任务数，以及平均排队和执行时间，只有登录的用户可以查看"""
+    return password_pool.stats()